@@ -0,0 +1,136 @@
+"""
+Бенчмарк отправки ожидающих уведомлений: 5000 уведомлений с наступившим временем.
+Сравнивает прежнюю схему (сессия, повторный SELECT, JOIN и commit на каждое уведомление)
+с пакетной process_pending_notifications (JOIN на порцию + один UPDATE на порцию).
+Клиентов 500: пакетная схема шлёт каждому одно сообщение (проверка — check_coalesce.py).
+Запуск: python benchmarks/bench_dispatch.py [--notifications 5000] [--dir PATH]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class FakeBot:
+    """Бот без сети: считает вызовы send_message"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+
+async def _seed(count: int):
+    """Клиенты, записи и count уведомлений типа created с send_at в прошлом"""
+    from bot.database import init_db, get_session
+    from bot.models.models import Appointment, Company, Notification, User
+
+    await init_db()
+    async with get_session() as session:
+        company = Company(name="Bench", address="-")
+        session.add(company)
+        users = [User(telegram_id=i + 1, phone=f"+7900{i:07d}") for i in range(500)]
+        session.add_all(users)
+        await session.flush()
+        start = datetime.now() + timedelta(days=3)
+        for i in range(count):
+            dt = start + timedelta(minutes=5 * i)
+            app = Appointment(
+                dikidi_id=i + 1, user_id=users[i % len(users)].id, company_id=company.id,
+                event="Услуга", date=dt.strftime("%d.%m.%Y"), time=dt.strftime("%H:%M"),
+                master="Мастер", clientlink="https://dikidi.ru/ru/recording/", status="active",
+            )
+            session.add(app)
+            session.add(Notification(
+                appointment=app, type="created", send_at=datetime.now() - timedelta(minutes=1), sent=False,
+            ))
+        await session.commit()
+
+
+async def _legacy_dispatch(service):
+    """Прежняя схема: N+1 запросов и commit на каждое уведомление"""
+    from sqlalchemy import select
+    from bot.database import get_session
+    from bot.models.models import Appointment, Company, Notification, User
+
+    async with get_session() as session:
+        result = await session.execute(
+            select(Notification).where(Notification.sent == False, Notification.send_at <= datetime.now())
+        )
+        notifications = result.scalars().all()
+    for n in notifications:
+        async with get_session() as session:
+            notification = (await session.execute(
+                select(Notification).where(Notification.id == n.id)
+            )).scalar_one_or_none()
+            if not notification or notification.sent:
+                continue
+            row = (await session.execute(
+                select(Appointment, User, Company).join(User).join(Company)
+                .where(Appointment.id == notification.appointment_id)
+            )).first()
+            appointment, user, company = row
+            text = service._format_notification_text(notification.type, appointment, company)
+            await service.bot.send_message(chat_id=user.telegram_id, text=text, parse_mode="HTML")
+            notification.sent = True
+            await session.commit()
+
+
+async def _run(mode: str, count: int):
+    from sqlalchemy import func, select
+    from bot.database import get_session
+    from bot.models.models import Notification
+    from bot.services.notifications import NotificationService
+
+    await _seed(count)
+    bot = FakeBot()
+    service = NotificationService(bot)
+    started = time.perf_counter()
+    if mode == "legacy":
+        await _legacy_dispatch(service)
+    else:
+        await service.process_pending_notifications()
+    elapsed = time.perf_counter() - started
+    async with get_session() as session:
+        left = (await session.execute(
+            select(func.count(Notification.id)).where(Notification.sent == False)
+        )).scalar()
+    # Пакетная отправка объединяет уведомления клиента (NOTIFY_COALESCE_SECONDS): сообщений меньше
+    print(
+        f"{mode:>7}: {elapsed:6.2f} с, {(count - left) / elapsed:8.0f} уведомлений/с, "
+        f"сообщений {bot.sent}, осталось неотправленных {left}"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--notifications", type=int, default=5000)
+    ap.add_argument("--mode", choices=["legacy", "batched"])
+    ap.add_argument("--dir", default=None, help="каталог для временных баз")
+    args = ap.parse_args()
+
+    if args.mode:
+        asyncio.run(_run(args.mode, args.notifications))
+        return
+
+    print(f"Отправка {args.notifications} ожидающих уведомлений (фейковый бот)")
+    for mode in ("legacy", "batched"):
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            env = dict(os.environ, DATABASE_URL=f"sqlite+aiosqlite:///{tmp}/bench.db")
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--mode", mode,
+                 "--notifications", str(args.notifications)],
+                env=env, check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Проверка плана запроса ожидающих уведомлений (NotificationService._due_select) и его скорости
+на таблице с большой историей отправленных уведомлений: без индекса и с частичным
+индексом ix_notifications_due (send_at, id) WHERE sent = false AND dead = false.
+Запуск: python benchmarks/bench_due_index.py [--sent 200000] [--pending 500]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+async def _seed(sent: int, pending: int):
+    from sqlalchemy import insert
+    from bot.database import init_db, get_session
+    from bot.models.models import Appointment, Company, Notification, User
+
+    await init_db()
+    async with get_session() as session:
+        session.add(Company(id=1, name="Bench", address="-"))
+        session.add(User(id=1, telegram_id=1, phone="+79000000000"))
+        await session.flush()
+        total = sent + pending
+        await session.execute(insert(Appointment), [
+            {"id": i + 1, "dikidi_id": i + 1, "user_id": 1, "company_id": 1, "event": "Услуга",
+             "date": "01.01.2025", "time": "10:00", "master": "Мастер", "clientlink": "-", "status": "active"}
+            for i in range(total)
+        ])
+        now = datetime.now()
+        await session.execute(insert(Notification), [
+            {"appointment_id": i + 1, "type": "reminder", "sent": i < sent,
+             "send_at": now - timedelta(minutes=total - i), "attempts": 0, "dead": False}
+            for i in range(total)
+        ])
+        await session.commit()
+
+
+async def _measure(label: str, runs: int = 20):
+    from bot.database import engine
+    from bot.models.models import Notification
+    from bot.services.notifications import NotificationService
+
+    stmt = (
+        NotificationService(bot=None)._due_select(datetime.now())
+        .order_by(Notification.send_at, Notification.id)
+        .limit(500)
+    )
+    # Фильтр полосы (NOT IN типов) — «расширяемый» параметр: раскрываем его при компиляции
+    compiled = stmt.compile(dialect=engine.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    async with engine.connect() as conn:
+        plan = (await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)).all()
+        started = time.perf_counter()
+        for _ in range(runs):
+            rows = (await conn.exec_driver_sql(str(compiled), params)).all()
+        elapsed = (time.perf_counter() - started) / runs
+    print(f"\n{label}: {elapsed * 1000:.2f} мс на запрос, строк {len(rows)}")
+    for row in plan:
+        print(f"  {row[-1]}")
+    return plan
+
+
+async def main(sent: int, pending: int):
+    from sqlalchemy import text
+    from bot.database import engine
+
+    await _seed(sent, pending)
+    async with engine.begin() as conn:
+        await conn.execute(text("ANALYZE"))
+    with_index = await _measure("С индексом ix_notifications_due")
+    async with engine.begin() as conn:
+        await conn.execute(text("DROP INDEX ix_notifications_due"))
+        await conn.execute(text("ANALYZE"))
+    await _measure("Без индекса")
+
+    scans = [row[-1] for row in with_index if "notifications" in row[-1] and row[-1].startswith("SCAN")]
+    print("\nПолный просмотр notifications с индексом:", "есть — ПРОВЕРКА НЕ ПРОЙДЕНА" if scans else "нет")
+    return 1 if scans else 0
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sent", type=int, default=200_000)
+    ap.add_argument("--pending", type=int, default=500)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tmp}/bench.db"
+        sys.exit(asyncio.run(main(args.sent, args.pending)))
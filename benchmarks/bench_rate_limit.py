@@ -0,0 +1,93 @@
+"""
+Бенчмарк лимита нажатий кнопок на миллионе разных пользователей.
+Сравнивает прежний словарь списков времён нажатий (ключи не удаляются никогда) и RateLimiter
+(token bucket на ключ, удаление через period, потолок max_keys): время на нажатие,
+число ключей и память после прогона. Нажатия равномерно растянуты на --hours виртуального
+времени; затем — всплеск, где все пользователи жмут в одну секунду (срабатывает потолок).
+Запуск: python benchmarks/bench_rate_limit.py [--users 1000000] [--hours 6] [--max-keys 100000]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bot.middlewares.rate_limit import RateLimiter  # noqa: E402
+
+LIMIT = 2
+PERIOD = 60.0
+
+
+class LegacyLimiter:
+    """Прежняя схема handlers._check_button_rate_limit: список времён на ключ"""
+
+    def __init__(self):
+        self.presses = {}
+
+    def allow(self, key, now):
+        if key not in self.presses:
+            self.presses[key] = []
+        cutoff = now - PERIOD
+        self.presses[key] = [t for t in self.presses[key] if t > cutoff]
+        if len(self.presses[key]) >= LIMIT:
+            return False
+        self.presses[key].append(now)
+        return True
+
+    def __len__(self):
+        return len(self.presses)
+
+
+def _press_all(limiter, users: int, span: float) -> int:
+    step = span / users
+    denied = 0
+    for i in range(users):
+        # Каждый пользователь жмёт кнопку трижды подряд: третье нажатие должно быть отклонено
+        now = i * step
+        key = (i, "my_appointments")
+        for _ in range(3):
+            if not limiter.allow(key, now):
+                denied += 1
+    return denied
+
+
+def _run(name: str, make_limiter, users: int, span: float):
+    # Время — без tracemalloc (он замедляет выделения в разы), память — отдельным прогоном
+    limiter = make_limiter()
+    started = time.perf_counter()
+    denied = _press_all(limiter, users, span)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    traced = make_limiter()
+    _press_all(traced, users, span)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"  {name:<12} {users * 3 / elapsed / 1e6:6.2f} млн нажатий/с, отклонено {denied}, "
+        f"ключей {len(limiter)}, память {current / 2**20:7.1f} МБ (пик {peak / 2**20:.1f})"
+    )
+    return limiter
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=1_000_000)
+    ap.add_argument("--hours", type=float, default=6)
+    ap.add_argument("--max-keys", type=int, default=100_000)
+    args = ap.parse_args()
+
+    print(f"{args.users} пользователей по 3 нажатия за {args.hours:g} ч (лимит {LIMIT} за {PERIOD:g} с)")
+    make_new = lambda: RateLimiter(LIMIT, PERIOD, args.max_keys)  # noqa: E731
+    _run("прежний", LegacyLimiter, args.users, args.hours * 3600)
+    _run("RateLimiter", make_new, args.users, args.hours * 3600)
+    print(f"Всплеск: {args.users} пользователей за 1 с (потолок {args.max_keys} ключей)")
+    _run("прежний", LegacyLimiter, args.users, 1.0)
+    limiter = _run("RateLimiter", make_new, args.users, 1.0)
+    print(f"  {limiter.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Бенчмарк очереди отправки (SendQueue) на локальном фейковом Bot API.
+Сравнивает последовательные вызовы bot.send_message и очередь с воркерами и лимитами.
+Запуск: python benchmarks/bench_send_queue.py [--messages 300] [--chats 200] [--latency 0.1]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from bot.services.send_queue import SendQueue  # noqa: E402
+
+
+async def _run(mode: str, messages: int, chats: int, latency: float):
+    api = FakeBotAPI(latency=latency)
+    await api.start()
+    bot = api.make_bot()
+    chat_ids = [1000 + i % chats for i in range(messages)]
+    queue = None
+    started = time.perf_counter()
+    try:
+        if mode == "sequential":
+            for chat_id in chat_ids:
+                await bot.send_message(chat_id=chat_id, text="Напоминание")
+        else:
+            queue = SendQueue(bot)
+            queue.start()
+            await asyncio.gather(*(queue.send(chat_id, "Напоминание") for chat_id in chat_ids))
+        elapsed = time.perf_counter() - started
+    finally:
+        if queue:
+            queue.close()
+        await bot.session.close()
+        await api.stop()
+    extra = f", очередь: {queue.stats()}" if queue else ""
+    print(
+        f"{mode:>10}: {elapsed:6.2f} с, {messages / elapsed:6.1f} сообщений/с, "
+        f"пик за 1 с: {api.max_per_second()}, мин. интервал в чат: {api.min_chat_interval():.2f} с{extra}"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=300)
+    ap.add_argument("--chats", type=int, default=200)
+    ap.add_argument("--latency", type=float, default=0.1, help="задержка ответа фейкового API, с")
+    args = ap.parse_args()
+    print(f"{args.messages} сообщений в {args.chats} чатов, задержка API {args.latency * 1000:.0f} мс")
+    for mode in ("sequential", "queue"):
+        asyncio.run(_run(mode, args.messages, args.chats, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Бенчмарк профилей SQLite: default (rollback journal, synchronous=FULL) против tuned
+(WAL, synchronous=NORMAL, кэш/mmap, busy_timeout — см. SQLITE_TUNED_PRAGMAS).
+Меряет путь регистрации (_add_user через run_write) и путь уведомлений
+(планирование + обработка ожидающих с фейковым ботом). Единственный писатель включается
+так же, как в боте (Config.DB_SINGLE_WRITER: по умолчанию — с профилем tuned).
+Неудачные операции (например, «database is locked») считаются, а не прерывают замер.
+Запуск: python benchmarks/bench_sqlite_profile.py [--users 500] [--appointments 300] [--dir PATH]
+
+Каждый профиль выполняется в отдельном процессе со своей временной базой. Разница видна
+на реальном диске (fsync), на tmpfs она почти пропадает — задайте --dir на нужном томе.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class FakeBot:
+    """Бот без сети: send_message сразу возвращает управление"""
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return None
+
+
+async def _run_profile(profile: str, users: int, appointments: int):
+    from sqlalchemy import text
+    from bot.config import Config
+    from bot.database import init_db, get_session, engine, run_write, start_writer, stop_writer
+    from bot.handlers.handlers import _add_user
+    from bot.models.models import Appointment, Company
+    from bot.services.notifications import NotificationService
+
+    await init_db()
+    async with engine.connect() as conn:
+        journal = (await conn.execute(text("PRAGMA journal_mode"))).scalar()
+        sync = (await conn.execute(text("PRAGMA synchronous"))).scalar()
+    start_writer()
+    errors = []
+
+    async def _register(telegram_id: int, phone: str):
+        try:
+            await run_write(_add_user(telegram_id, phone))
+        except Exception as e:
+            errors.append(e)
+
+    # Регистрация: последовательно (задержка одной записи) и параллельно (конкуренция)
+    started = time.perf_counter()
+    for i in range(users):
+        await _register(i + 1, f"+7900{i:07d}")
+    seq = time.perf_counter() - started
+    started = time.perf_counter()
+    await asyncio.gather(*(_register(100_000 + i, "") for i in range(users)))
+    conc = time.perf_counter() - started
+
+    # Уведомления: записи на завтра → day_before/reminder/created, затем обработка
+    async with get_session() as session:
+        company = Company(name="Bench", address="-")
+        session.add(company)
+        await session.flush()
+        start = datetime.now() + timedelta(days=2)
+        apps = []
+        for i in range(appointments):
+            dt = start + timedelta(minutes=10 * i)
+            app = Appointment(
+                dikidi_id=i + 1, user_id=(i % users) + 1, company_id=company.id,
+                event="Услуга", date=dt.strftime("%d.%m.%Y"), time=dt.strftime("%H:%M"),
+                master="Мастер", clientlink="https://dikidi.ru/ru/recording/", status="active",
+            )
+            session.add(app)
+            apps.append(app)
+        await session.commit()
+    service = NotificationService(FakeBot())
+    started = time.perf_counter()
+    for app in apps:
+        await service.schedule_appointment_notifications(app, "created")
+    schedule = time.perf_counter() - started
+    started = time.perf_counter()
+    await service.process_pending_notifications()
+    dispatch = time.perf_counter() - started
+    await stop_writer()
+
+    failed = f"{len(errors)} ({type(errors[0]).__name__}: {errors[0]})" if errors else "0"
+    print(
+        f"{profile:>7} (journal={journal}, synchronous={sync}, писатель {'да' if Config.DB_SINGLE_WRITER else 'нет'}): "
+        f"регистрация посл. {seq / users * 1000:6.2f} мс/шт, парал. {users / conc:7.0f} шт/с, ошибок {failed} | "
+        f"планирование {appointments / schedule:7.0f} записей/с | "
+        f"отправка {appointments / dispatch:7.0f} уведомлений/с"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=500)
+    ap.add_argument("--appointments", type=int, default=300)
+    ap.add_argument("--profile", choices=["default", "tuned"])
+    ap.add_argument("--dir", default=None, help="каталог для временных баз")
+    args = ap.parse_args()
+
+    if args.profile:
+        asyncio.run(_run_profile(args.profile, args.users, args.appointments))
+        return
+
+    for profile in ("default", "tuned"):
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            env = dict(
+                os.environ,
+                DATABASE_URL=f"sqlite+aiosqlite:///{tmp}/bench.db",
+                SQLITE_PROFILE=profile,
+            )
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--profile", profile,
+                 "--users", str(args.users), "--appointments", str(args.appointments)],
+                env=env, check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
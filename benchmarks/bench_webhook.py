@@ -0,0 +1,178 @@
+"""
+Бенчмарк режима webhook: синтетические обновления /my_appointments отправляются POST-запросами
+в aiohttp-приложение build_webhook_app (настоящий router, временная SQLite, фейковый Bot API
+с задержкой ответа). Запросы идут не больше чем в --connections соединений одновременно —
+как Telegram с max_connections. Сравниваются обработка внутри запроса (handle_in_background=False)
+и в фоне (True): время ответа на запрос (p50/p95) и обновлений/с до последнего ответа пользователю.
+Обновления проходят через UpdateConcurrencyMiddleware, как в main.py (--concurrency).
+Заодно проверяется, что запрос без секрета или с неверным секретом получает 401.
+Запуск: python benchmarks/bench_webhook.py [--updates 2000] [--users 500] [--connections 40] [--latency 0.05]
+       [--concurrency 20]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiohttp import ClientSession, web  # noqa: E402
+
+SECRET = "bench-secret"
+PATH = "/telegram/webhook"
+
+
+async def _seed(users: int):
+    """Зарегистрированные пользователи (telegram_id 1..users) по 8 записей, половина — прошедшие"""
+    from bot.database import init_db, get_session
+    from bot.models.models import Appointment, Company, User, appointment_starts_at
+
+    await init_db()
+    async with get_session() as session:
+        company = Company(name="Bench", address="-")
+        session.add(company)
+        rows = [User(telegram_id=i + 1, phone=f"+7900{i:07d}") for i in range(users)]
+        session.add_all(rows)
+        await session.flush()
+        start = datetime.now() - timedelta(days=20)
+        dikidi_id = 0
+        for user in rows:
+            for k in range(8):
+                dt = start + timedelta(days=5 * k, hours=user.id % 8)
+                dikidi_id += 1
+                date, time_ = dt.strftime("%d.%m.%Y"), dt.strftime("%H:%M")
+                session.add(Appointment(
+                    dikidi_id=dikidi_id, user_id=user.id, company_id=company.id,
+                    event="Услуга", date=date, time=time_, starts_at=appointment_starts_at(date, time_),
+                    master="Мастер", clientlink="https://dikidi.ru/ru/recording/", status="active",
+                ))
+        await session.commit()
+
+
+def _update(update_id: int, telegram_id: int) -> dict:
+    text = "/my_appointments"
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": telegram_id, "type": "private"},
+            "from": {"id": telegram_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+async def _post_all(url: str, updates: list, connections: int) -> list:
+    """POST каждого обновления с секретом; возвращает время ответа на каждый запрос"""
+    semaphore = asyncio.Semaphore(connections)
+    latencies = []
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+    async with ClientSession() as client:
+        async def post(update):
+            async with semaphore:
+                started = time.perf_counter()
+                async with client.post(url, json=update, headers=headers) as response:
+                    assert response.status == 200, response.status
+                    await response.read()
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(post(update) for update in updates))
+    return latencies
+
+
+async def _check_secret(url: str):
+    async with ClientSession() as client:
+        for headers in ({}, {"X-Telegram-Bot-Api-Secret-Token": "wrong"}):
+            async with client.post(url, json=_update(0, 1), headers=headers) as response:
+                assert response.status == 401, f"ожидался 401, получен {response.status}"
+    print("  запросы без секрета и с неверным секретом: 401")
+
+
+async def _run_mode(dp, api, background: bool, updates: list, connections: int):
+    from bot.services.appointment_list import APPOINTMENT_LIST_CACHE
+    from bot.services.user_cache import USER_CACHE
+    from bot.webhook import build_webhook_app
+
+    APPOINTMENT_LIST_CACHE.clear()
+    USER_CACHE.clear()
+    api.sent.clear()
+    # Свой бот на прогон: его сессию закрывает обработчик webhook при остановке приложения
+    bot = api.make_bot()
+    runner = web.AppRunner(build_webhook_app(dp, bot, SECRET, PATH, handle_in_background=background))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{PATH}"
+    try:
+        if background:
+            await _check_secret(url)
+        started = time.perf_counter()
+        latencies = sorted(await _post_all(url, updates, connections))
+        acked = time.perf_counter() - started
+        while len(api.sent) < len(updates):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[int(len(latencies) * 0.95)]
+    name = "в фоне" if background else "в запросе"
+    print(
+        f"  {name:<10} ответ Telegram p50 {p50 * 1000:7.1f} мс, p95 {p95 * 1000:7.1f} мс; "
+        f"все приняты за {acked:5.2f} с, обработаны за {elapsed:5.2f} с — {len(updates) / elapsed:6.0f} обновлений/с"
+    )
+
+
+async def _run(args):
+    from aiogram import Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from benchmarks.fake_bot_api import FakeBotAPI
+    from bot.database import stop_writer
+    from bot.handlers import router
+    from bot.middlewares import UpdateConcurrencyMiddleware
+
+    await _seed(args.users)
+    api = FakeBotAPI(latency=args.latency)
+    await api.start()
+    dp = Dispatcher(storage=MemoryStorage())
+    concurrency = UpdateConcurrencyMiddleware(args.concurrency)
+    dp.update.outer_middleware(concurrency)
+    dp.include_router(router)
+    updates = [_update(i + 1, i % args.users + 1) for i in range(args.updates)]
+    print(
+        f"{args.updates} обновлений от {args.users} пользователей, {args.connections} соединений, "
+        f"задержка Bot API {args.latency * 1000:g} мс"
+    )
+    try:
+        for background in (False, True):
+            await _run_mode(dp, api, background, updates, args.connections)
+        print(f"  очередь обработки: {concurrency.stats()}")
+    finally:
+        await api.stop()
+        await stop_writer()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=2000)
+    ap.add_argument("--users", type=int, default=500)
+    ap.add_argument("--connections", type=int, default=40)
+    ap.add_argument("--latency", type=float, default=0.05)
+    ap.add_argument("--concurrency", type=int, default=None, help="по умолчанию Config.UPDATES_CONCURRENCY")
+    ap.add_argument("--dir", default=None, help="каталог для временной базы")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tmp}/bench.db"
+        asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
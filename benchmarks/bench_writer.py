@@ -0,0 +1,117 @@
+"""
+Бенчмарк: параллельные регистрации пользователей во время большой синхронизации.
+Сравнивает обычный режим (каждый пишет своей сессией) и единственного писателя (DB_SINGLE_WRITER).
+Запуск: python benchmarks/bench_writer.py [--appointments 5000] [--registrations 300]
+
+Каждый режим выполняется в отдельном процессе со своей временной SQLite-базой.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _parsed_rows(users: int, count: int) -> list:
+    """Синтетический результат парсинга: count записей на users клиентов"""
+    start = datetime.now() + timedelta(days=1)
+    rows = []
+    for i in range(count):
+        dt = start + timedelta(minutes=15 * i)
+        rows.append({
+            "phone": f"8900{i % users:07d}",
+            "event": f"Услуга {i}",
+            "date": dt.strftime("%d.%m.%Y"),
+            "time": dt.strftime("%H:%M"),
+            "master": "Мастер",
+            "clientlink": "https://dikidi.ru/ru/recording/",
+            "visit_status": "Ожидает визита",
+        })
+    return rows
+
+
+async def _run_mode(mode: str, appointments: int, registrations: int):
+    from sqlalchemy import select
+    from bot.database import init_db, get_session, run_write, start_writer, stop_writer
+    from bot.handlers.handlers import _add_user
+    from bot.models.models import User
+    from bot.services.dikidi_parser import DikidiParser
+
+    await init_db()
+    users = 200
+    async with get_session() as session:
+        for i in range(users):
+            session.add(User(telegram_id=-(i + 1), phone=f"+7900{i:07d}"))
+        await session.commit()
+    if mode == "writer":
+        start_writer(enabled=True)
+
+    parser = DikidiParser()
+    parsed = _parsed_rows(users, appointments)
+    latencies, errors = [], 0
+
+    async def sync():
+        async with get_session() as session:
+            return await parser.sync_appointments(session, parsed, parser.parse_window())
+
+    async def register(n: int):
+        nonlocal errors
+        await asyncio.sleep(random.uniform(0, 1.0))
+        started = time.perf_counter()
+        try:
+            async with get_session() as session:
+                result = await session.execute(select(User).where(User.telegram_id == 10_000 + n))
+                if result.scalars().first() is None:
+                    await run_write(_add_user(10_000 + n, f"+7911{n:07d}"))
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(sync(), *(register(n) for n in range(registrations)))
+    total = time.perf_counter() - started
+    stats = results[0]
+    await stop_writer()
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(
+        f"{mode:>7}: всего {total:6.2f} с | синхронизация: транзакций {stats['chunks']}, "
+        f"блокировка макс. {stats['lock_max_ms']} мс | регистрации: p50 {p(0.5):7.1f} мс, "
+        f"p95 {p(0.95):7.1f} мс, макс {latencies[-1] * 1000:7.1f} мс, "
+        f"среднее {statistics.mean(latencies) * 1000:7.1f} мс, ошибок {errors}"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--appointments", type=int, default=5000)
+    ap.add_argument("--registrations", type=int, default=300)
+    ap.add_argument("--mode", choices=["direct", "writer"])
+    args = ap.parse_args()
+
+    if args.mode:
+        asyncio.run(_run_mode(args.mode, args.appointments, args.registrations))
+        return
+
+    print(f"Синхронизация {args.appointments} записей + {args.registrations} регистраций параллельно")
+    for mode in ("direct", "writer"):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DATABASE_URL=f"sqlite+aiosqlite:///{tmp}/bench.db")
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--mode", mode,
+                 "--appointments", str(args.appointments), "--registrations", str(args.registrations)],
+                env=env, check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Проверка объединения уведомлений (_coalesce): всё, что клиенту пора получить, уходит
+одним сообщением — даже если его уведомления попали в разные порции NOTIFY_BATCH_SIZE.
+Сценарии: один чат с 3 уведомлениями и 500 клиентов по 10 уведомлений, при порциях 500, 2 и 1.
+В каждый чат должно уйти ровно одно сообщение, все уведомления — помечены отправленными.
+База — временная SQLite.
+Запуск: python benchmarks/check_coalesce.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ((1, 3), (500, 10))  # (клиентов, уведомлений у каждого)
+BATCH_SIZES = (500, 2, 1)
+
+
+class FakeBot:
+    """Бот без сети: считает сообщения по чатам"""
+
+    def __init__(self):
+        self.messages = Counter()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages[chat_id] += 1
+
+
+async def _seed(clients: int, per_client: int):
+    """Клиенты и по per_client уведомлений с наступившим (разным) сроком у каждого"""
+    from bot.database import Base, engine, get_session, init_db
+    from bot.models.models import Appointment, Company, Notification, User
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await init_db()
+    now = datetime.now()
+    async with get_session() as session:
+        company = Company(name="Check", address="-")
+        session.add(company)
+        users = [User(telegram_id=i + 1, phone=f"+7900{i:07d}") for i in range(clients)]
+        session.add_all(users)
+        await session.flush()
+        for k in range(per_client):
+            for i, user in enumerate(users):
+                dt = now + timedelta(days=3, minutes=5 * (k * clients + i))
+                app = Appointment(
+                    dikidi_id=k * clients + i + 1, user_id=user.id, company_id=company.id,
+                    event="Услуга", date=dt.strftime("%d.%m.%Y"), time=dt.strftime("%H:%M"),
+                    master="Мастер", clientlink="https://dikidi.ru/ru/recording/", status="active",
+                )
+                session.add(app)
+                # Сроки клиентов перемешаны: уведомления одного чата расходятся по порциям
+                session.add(Notification(
+                    appointment=app, type="created",
+                    send_at=now - timedelta(minutes=60 - k * 5, seconds=i), sent=False,
+                ))
+        await session.commit()
+
+
+async def _check(clients: int, per_client: int, batch_size: int) -> bool:
+    from sqlalchemy import func, select
+    from bot.config import Config
+    from bot.database import get_session
+    from bot.models.models import Notification
+    from bot.services.notifications import NotificationService
+
+    await _seed(clients, per_client)
+    Config.NOTIFY_BATCH_SIZE = batch_size
+    bot = FakeBot()
+    await NotificationService(bot).process_pending_notifications()
+    async with get_session() as session:
+        left = (await session.execute(
+            select(func.count(Notification.id)).where(Notification.sent == False)
+        )).scalar()
+    per_chat = Counter(bot.messages.values())
+    ok = left == 0 and len(bot.messages) == clients and set(per_chat) == {1}
+    print(
+        f"  клиентов {clients} × {per_client}, порция {batch_size:>3}: сообщений {sum(bot.messages.values())}, "
+        f"сообщений на чат {dict(sorted(per_chat.items()))}, неотправленных {left} — {'OK' if ok else 'ОШИБКА'}"
+    )
+    return ok
+
+
+async def _main() -> bool:
+    ok = True
+    for clients, per_client in SCENARIOS:
+        for batch_size in BATCH_SIZES:
+            ok = await _check(clients, per_client, batch_size) and ok
+    return ok
+
+
+def main():
+    print("Одно сообщение на чат при объединении уведомлений")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tmp}/coalesce.db"
+        os.environ["NOTIFY_COALESCE_SECONDS"] = "120"
+        ok = asyncio.run(_main())
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Проверка аренды уведомлений (claimed_by / claimed_until) двумя процессами на одной БД.
+1. Два экземпляра одновременно отправляют общие ожидающие уведомления: каждое уходит ровно
+   один раз, нагрузка делится между экземплярами.
+2. Экземпляр берёт порцию в аренду и падает, не отправив: после истечения аренды
+   уведомления отправляет другой экземпляр.
+По умолчанию — временная SQLite; для PostgreSQL: --database-url postgresql+asyncpg://...
+(тестовая база: таблицы пересоздаются перед каждым сценарием).
+Запуск: python benchmarks/check_lease_claims.py [--notifications 2000] [--database-url URL]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+LEASE_SECONDS = 3
+
+
+class FakeBot:
+    """Бот без сети: задержка ответа как у Bot API"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+
+
+async def _unsent() -> int:
+    from sqlalchemy import func, select
+    from bot.database import get_session
+    from bot.models.models import Notification
+
+    async with get_session() as session:
+        return (await session.execute(
+            select(func.count(Notification.id)).where(Notification.sent == False)
+        )).scalar()
+
+
+async def _worker(out_path: str, crash: bool, deadline: float):
+    from bot.services.notifications import NotificationService
+
+    delivered = []
+
+    class RecordingService(NotificationService):
+        async def _deliver_group(self, rows, lane=None):
+            delivered.extend(row[0].id for row in rows)
+            return await super()._deliver_group(rows, lane or "transactional")
+
+        async def _claim(self, query, limit=None):
+            rows = await super()._claim(query, limit)
+            if crash and rows:
+                # Аренда взята, отправки не будет — как при падении процесса
+                print(f"  {os.environ['INSTANCE_ID']}: взял {len(rows)} и упал")
+                os._exit(0)
+            return rows
+
+    service = RecordingService(FakeBot(0.005))
+    started = time.perf_counter()
+    while await _unsent() and time.time() < deadline:
+        await service.process_pending_notifications()
+        await asyncio.sleep(0.2)
+    with open(out_path, "w") as f:
+        json.dump({"ids": delivered, "elapsed": time.perf_counter() - started}, f)
+
+
+async def _seed_and_list(count: int):
+    from sqlalchemy import select
+    from bench_dispatch import _seed
+    from bot.database import Base, engine, get_session
+    from bot.models.models import Notification
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await _seed(count)
+    async with get_session() as session:
+        return list((await session.execute(select(Notification.id))).scalars().all())
+
+
+def _spawn(env: dict, *args) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), *args], env=env)
+
+
+def _scenario(title: str, env: dict, count: int, tmp: str, crash_first: bool) -> bool:
+    print(title)
+    subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--mode", "seed",
+         "--notifications", str(count), "--out", os.path.join(tmp, "all.json")],
+        env=env, check=True,
+    )
+    with open(os.path.join(tmp, "all.json")) as f:
+        all_ids = json.load(f)["ids"]
+
+    deadline = str(time.time() + 120)
+    names = ["A", "B"]
+    if crash_first:
+        crashed = _spawn(dict(env, INSTANCE_ID="A"), "--mode", "crash", "--deadline", deadline,
+                         "--out", os.path.join(tmp, "A.json"))
+        crashed.wait()
+        names = ["B"]
+    procs = [
+        _spawn(dict(env, INSTANCE_ID=name), "--mode", "worker", "--deadline", deadline,
+               "--out", os.path.join(tmp, f"{name}.json"))
+        for name in names
+    ]
+    for p in procs:
+        p.wait()
+
+    seen = []
+    for name in names:
+        with open(os.path.join(tmp, f"{name}.json")) as f:
+            result = json.load(f)
+        seen.extend(result["ids"])
+        print(f"  {name}: отправлено {len(result['ids'])} за {result['elapsed']:.2f} с")
+    duplicates = len(seen) - len(set(seen))
+    missing = len(set(all_ids) - set(seen))
+    ok = duplicates == 0 and missing == 0
+    print(f"  всего {len(all_ids)}, дублей {duplicates}, не отправлено {missing} — {'OK' if ok else 'ОШИБКА'}")
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--notifications", type=int, default=2000)
+    ap.add_argument("--database-url", default=None)
+    ap.add_argument("--mode", choices=["seed", "worker", "crash"])
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--deadline", type=float, default=0)
+    args = ap.parse_args()
+
+    if args.mode == "seed":
+        ids = asyncio.run(_seed_and_list(args.notifications))
+        with open(args.out, "w") as f:
+            json.dump({"ids": ids}, f)
+        return
+    if args.mode:
+        asyncio.run(_worker(args.out, args.mode == "crash", args.deadline))
+        return
+
+    ok = True
+    for title, crash_first in (
+        ("Два экземпляра на общей очереди уведомлений", False),
+        (f"Падение экземпляра с арендой (аренда {LEASE_SECONDS} с)", True),
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DATABASE_URL=args.database_url or f"sqlite+aiosqlite:///{tmp}/lease.db",
+                NOTIFY_BATCH_SIZE="50",
+                NOTIFY_LEASE_SECONDS=str(LEASE_SECONDS),
+                NOTIFY_COALESCE_SECONDS="0",
+            )
+            ok = _scenario(title, env, args.notifications, tmp, crash_first) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
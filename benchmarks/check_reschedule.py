@@ -0,0 +1,113 @@
+"""
+Проверка переноса записи (событие field_changed по date/time) на виртуальных часах:
+1. Перенос на более раннее время: напоминания, чей срок для нового времени прошёл, закрываются
+   (dead-letter), а не уходят по старому send_at после визита.
+2. Перенос на более позднее время: напоминания переносятся и остаются в очереди.
+3. Возврат на прежнее время: закрытые переносом напоминания снова в очереди.
+База — временная SQLite.
+Запуск: python benchmarks/check_reschedule.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+async def _state(appointment_id: int) -> dict:
+    """type → (send_at, dead) неотправленных уведомлений записи"""
+    from sqlalchemy import select
+    from bot.database import get_session
+    from bot.models.models import Notification
+
+    async with get_session() as session:
+        rows = (await session.execute(
+            select(Notification.type, Notification.send_at, Notification.dead)
+            .where(Notification.appointment_id == appointment_id, Notification.sent == False)
+        )).all()
+    return {notification_type: (send_at, dead) for notification_type, send_at, dead in rows}
+
+
+async def _move(service, appointment_id: int, visit: datetime) -> dict:
+    """Переносит запись на visit и планирует уведомления, как сверка по событию field_changed"""
+    from bot.database import get_session
+    from bot.models.models import Appointment, appointment_starts_at
+
+    async with get_session() as session:
+        appointment = await session.get(Appointment, appointment_id)
+        appointment.date, appointment.time = visit.strftime("%d.%m.%Y"), visit.strftime("%H:%M")
+        appointment.starts_at = appointment_starts_at(appointment.date, appointment.time)
+        await session.commit()
+        await service.schedule_notifications([(appointment, "field_changed")])
+    return await _state(appointment_id)
+
+
+def _report(title: str, state: dict, visit: datetime, now: datetime, expect_live: set) -> bool:
+    live = {t for t, (_, dead) in state.items() if not dead}
+    after_visit = {t for t, (send_at, dead) in state.items() if not dead and send_at > visit}
+    ok = live == expect_live and not after_visit
+    print(f"{title}: визит {visit:%d.%m %H:%M}, сейчас {now:%d.%m %H:%M}")
+    for notification_type, (send_at, dead) in sorted(state.items()):
+        print(f"  {notification_type:<12} {send_at:%d.%m %H:%M}  {'dead' if dead else 'в очереди'}")
+    print(f"  в очереди {sorted(live)}, ожидалось {sorted(expect_live)}, после визита {sorted(after_visit)} — "
+          f"{'OK' if ok else 'ОШИБКА'}")
+    return ok
+
+
+async def _main() -> bool:
+    from bot.database import get_session, init_db
+    from bot.models.models import Appointment, Company, User, appointment_starts_at
+    from bot.services.clock import VirtualClock
+    from bot.services.notifications import NotificationService
+
+    await init_db()
+    now = (datetime.now() + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+    clock = VirtualClock(now)
+    service = NotificationService(bot=None, clock=clock)
+    visit = now + timedelta(days=20, hours=6)
+    async with get_session() as session:
+        company = Company(name="Check", address="-")
+        user = User(telegram_id=1, phone="+79000000001")
+        session.add_all([company, user])
+        await session.flush()
+        appointment = Appointment(
+            dikidi_id=1, user_id=user.id, company_id=company.id, event="Услуга",
+            date=visit.strftime("%d.%m.%Y"), time=visit.strftime("%H:%M"),
+            starts_at=appointment_starts_at(visit.strftime("%d.%m.%Y"), visit.strftime("%H:%M")),
+            master="Мастер", clientlink="https://dikidi.ru/ru/recording/1", status="active",
+        )
+        session.add(appointment)
+        await session.commit()
+        await service.schedule_notifications([(appointment, "created")])
+    appointment_id = appointment.id
+    reminders = {"day_before", "reminder", "confirmation"}
+
+    ok = _report("Запланировано", await _state(appointment_id), visit, now, reminders | {"created"})
+    earlier = now + timedelta(hours=2)
+    ok = _report(
+        "Перенос раньше", await _move(service, appointment_id, earlier), earlier, now, {"created"}
+    ) and ok
+    later = now + timedelta(days=2, hours=6)
+    ok = _report(
+        "Перенос позже", await _move(service, appointment_id, later), later, now,
+        {"created", "day_before", "reminder"},
+    ) and ok
+    ok = _report(
+        "Возврат на прежнее время", await _move(service, appointment_id, visit), visit, now,
+        reminders | {"created"},
+    ) and ok
+    return ok
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tmp}/reschedule.db"
+        ok = asyncio.run(_main())
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
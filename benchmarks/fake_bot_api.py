@@ -0,0 +1,82 @@
+"""
+Локальный фейковый Bot API для бенчмарков: отвечает на sendMessage с заданной задержкой
+и проверяет соблюдение лимитов (сообщений в секунду, интервал в один чат).
+Используется из других бенчмарков: FakeBotAPI(latency=0.1) → await api.start() → api.make_bot().
+"""
+import asyncio
+import time
+from collections import defaultdict
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+FAKE_TOKEN = "123456:TEST-fake-token-for-benchmarks"
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.05, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.sent = []  # (monotonic time, chat_id)
+        self.forbidden_chats = set()  # чаты, которые «заблокировали бота»
+        self._runner = None
+        self._message_id = 0
+
+    async def _send_message(self, request: web.Request):
+        data = await request.post()
+        chat_id = int(data["chat_id"])
+        await asyncio.sleep(self.latency)
+        if chat_id in self.forbidden_chats:
+            return web.json_response(
+                {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"},
+                status=403,
+            )
+        self.sent.append((time.monotonic(), chat_id))
+        self._message_id += 1
+        return web.json_response({
+            "ok": True,
+            "result": {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": data.get("text", ""),
+            },
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/sendMessage", self._send_message)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def make_bot(self) -> Bot:
+        server = TelegramAPIServer.from_base(f"http://{self.host}:{self.port}")
+        return Bot(token=FAKE_TOKEN, session=AiohttpSession(api=server))
+
+    def max_per_second(self) -> int:
+        """Максимум сообщений в любом скользящем окне 1 с"""
+        times = sorted(t for t, _ in self.sent)
+        best, left = 0, 0
+        for right, t in enumerate(times):
+            while t - times[left] >= 1.0:
+                left += 1
+            best = max(best, right - left + 1)
+        return best
+
+    def min_chat_interval(self) -> float:
+        """Минимальный интервал между сообщениями в один чат (с)"""
+        by_chat = defaultdict(list)
+        for t, chat_id in self.sent:
+            by_chat[chat_id].append(t)
+        gaps = [b - a for ts in by_chat.values() for a, b in zip(ts, ts[1:])]
+        return min(gaps) if gaps else float("inf")
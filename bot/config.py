@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,6 +13,14 @@ class Config:
     BOOKING_URL = os.getenv("BOOKING_URL", "https://dikidi.net/1993359")
     YANDEX_REVIEW_URL = os.getenv("YANDEX_REVIEW_URL", "https://yandex.ru/maps/org/meownomeow/229631800295/")
     VK_GROUP_URL = os.getenv("VK_GROUP_URL", "https://vk.ru/meownomeow_tsk")
+    # Ссылки для отзыва (уведомление after_visit)
+    TWOGIS_REVIEW_URL = os.getenv(
+        "TWOGIS_REVIEW_URL", "https://2gis.ru/tomsk/reviews/70000001087746231/addReview?utm_source=lk"
+    )
+    VK_REVIEW_URL = os.getenv("VK_REVIEW_URL", f"{VK_GROUP_URL}?w=app6326142_-224655267")
+    DIKIDI_REVIEW_URL = os.getenv("DIKIDI_REVIEW_URL", "https://dikidi.net/1993359?p=0.pi")
+    # Тексты уведомлений: <тип>.txt в этой папке
+    TEMPLATES_DIR = os.getenv("TEMPLATES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates"))
     
     # Telegram Bot
     BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -25,6 +34,19 @@ class Config:
         f"sqlite+aiosqlite:///{_db_path}" if _use_sqlite else f"sqlite+aiosqlite:///{_db_path}"
     )
     
+    # Профиль SQLite: tuned (WAL, synchronous=NORMAL, кэш/mmap, busy_timeout) или default
+    SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "tuned").lower()
+    SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "16384"))
+    SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "64"))
+    # Единственный писатель в SQLite: все записи через одну asyncio-задачу (1/true/yes — включить,
+    # 0/false/no — выключить). По умолчанию включён с профилем tuned: пул держит много соединений,
+    # и без писателя каждое параллельное соединение соревновалось бы за блокировку записи
+    _single_writer = os.getenv("DB_SINGLE_WRITER", "").lower()
+    DB_SINGLE_WRITER = _single_writer in ("1", "true", "yes") or (
+        not _single_writer and SQLITE_PROFILE == "tuned" and "sqlite" in DATABASE_URL
+    )
+    DB_WRITER_BATCH_SIZE = int(os.getenv("DB_WRITER_BATCH_SIZE", "32"))
+    
     # Dikidi
     DIKIDI_COMPANY_ID = os.getenv("DIKIDI_COMPANY_ID", "1993359")
     DIKIDI_JOURNAL_URL = os.getenv(
@@ -40,6 +62,86 @@ class Config:
     DIKIDI_JOURNAL_END = os.getenv("DIKIDI_JOURNAL_END", "")    # например 2026-02-15
     DIKIDI_LOGIN_PHONE = os.getenv("DIKIDI_LOGIN_PHONE", "89526834874")
     DIKIDI_LOGIN_PASSWORD = os.getenv("DIKIDI_LOGIN_PASSWORD", "281076zxc")
+
+    # Снимок последнего парсинга (для быстрого старта после перезапуска)
+    SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH") or os.path.join(
+        os.path.dirname(_db_path), "meownomeow_snapshot.json.gz"
+    )
+    # Первая живая синхронизация после старта: задержка + случайный разброс (секунды)
+    SYNC_FIRST_RUN_DELAY = int(os.getenv("SYNC_FIRST_RUN_DELAY", "60"))
+    SYNC_FIRST_RUN_JITTER = int(os.getenv("SYNC_FIRST_RUN_JITTER", "30"))
+    # Сколько записей сверки фиксировать одной транзакцией (короче блокировка SQLite)
+    SYNC_CHUNK_SIZE = int(os.getenv("SYNC_CHUNK_SIZE", "200"))
+    # Сверка между полными проходами трогает только клиентов, чьи строки журнала изменились;
+    # полный проход — после перезапуска, при смене окна или пользователей и раз в столько минут
+    SYNC_FULL_EVERY_MINUTES = int(os.getenv("SYNC_FULL_EVERY_MINUTES", "1440"))
+    # Хранение: записи, прошедшие более RETENTION_DAYS дней назад, переносятся в архивные таблицы
+    # порциями по RETENTION_BATCH_SIZE; задача — ежедневно в RETENTION_HOUR:30 (0 дней — выключено)
+    RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "180"))
+    RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "200"))
+    RETENTION_HOUR = int(os.getenv("RETENTION_HOUR", "4"))
+    
+    # Уведомления: сколько ожидающих уведомлений обрабатывать одной порцией
+    NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "500"))
+    # Страховочный проход таймера отправки, если ближайших сроков нет (секунды)
+    NOTIFY_SWEEP_SECONDS = int(os.getenv("NOTIFY_SWEEP_SECONDS", "300"))
+    # Несколько экземпляров на одной БД: уведомления берутся в аренду на NOTIFY_LEASE_SECONDS
+    # (дольше, чем отправка порции); аренда упавшего экземпляра истекает, и уведомления берёт другой
+    INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+    NOTIFY_LEASE_SECONDS = int(os.getenv("NOTIFY_LEASE_SECONDS", "300"))
+    # Уведомления клиента со сроком в ближайшие N секунд уходят вместе с уже наступившими (0 — только наступившие)
+    NOTIFY_COALESCE_SECONDS = int(os.getenv("NOTIFY_COALESCE_SECONDS", "120"))
+    # Повторы при ошибке отправки: экспоненциальная задержка (с) со случайным разбросом,
+    # после NOTIFY_MAX_ATTEMPTS неудач уведомление уходит в dead-letter
+    NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+    NOTIFY_RETRY_BASE_SECONDS = int(os.getenv("NOTIFY_RETRY_BASE_SECONDS", "30"))
+    NOTIFY_RETRY_MAX_SECONDS = int(os.getenv("NOTIFY_RETRY_MAX_SECONDS", "3600"))
+    # Маркетинговые уведомления (after_visit, rebook_14): отправляются только в дневном окне
+    # [MARKETING_WINDOW_START, MARKETING_WINDOW_END) часов, растягиваются на MARKETING_SPREAD_MINUTES
+    # и не быстрее MARKETING_RATE_PER_SEC сообщений/с — чтобы не мешать напоминаниям и отменам
+    MARKETING_WINDOW_START = int(os.getenv("MARKETING_WINDOW_START", "11"))
+    MARKETING_WINDOW_END = int(os.getenv("MARKETING_WINDOW_END", "20"))
+    MARKETING_SPREAD_MINUTES = int(os.getenv("MARKETING_SPREAD_MINUTES", "90"))
+    MARKETING_RATE_PER_SEC = float(os.getenv("MARKETING_RATE_PER_SEC", "5"))
+    # Очередь отправки в Telegram: воркеры, общий лимит (сообщений/с) и интервал в один чат (с)
+    SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+    SEND_RATE_PER_SEC = float(os.getenv("SEND_RATE_PER_SEC", "30"))
+    SEND_PER_CHAT_INTERVAL = float(os.getenv("SEND_PER_CHAT_INTERVAL", "1.0"))
+    
+    # Лимит нажатий кнопок (флаг rate_limit у обработчика): BUTTON_RATE_LIMIT за BUTTON_RATE_PERIOD секунд
+    # на пользователя и кнопку; в памяти не больше RATE_LIMIT_MAX_KEYS ключей
+    BUTTON_RATE_LIMIT = int(os.getenv("BUTTON_RATE_LIMIT", "2"))
+    BUTTON_RATE_PERIOD = float(os.getenv("BUTTON_RATE_PERIOD", "60"))
+    RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+    
+    # «Мои записи»: записей на странице, сколько первых страниц пользователей держать в кэше
+    # и сколько секунд страница живёт в кэше без сброса
+    APPOINTMENTS_PAGE_SIZE = int(os.getenv("APPOINTMENTS_PAGE_SIZE", "5"))
+    APPOINTMENT_LIST_CACHE_SIZE = int(os.getenv("APPOINTMENT_LIST_CACHE_SIZE", "10000"))
+    APPOINTMENT_LIST_CACHE_TTL = float(os.getenv("APPOINTMENT_LIST_CACHE_TTL", "300"))
+    
+    # Кэш telegram_id → пользователь для обработчиков: размер и время жизни записи (секунды)
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+    USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "600"))
+    
+    # Обработка обновлений: одновременно не больше UPDATES_CONCURRENCY обработчиков,
+    # обновления одного пользователя — по очереди
+    UPDATES_CONCURRENCY = int(os.getenv("UPDATES_CONCURRENCY", "20"))
+    
+    # Метрики уведомлений для Prometheus: GET /metrics на METRICS_HOST:METRICS_PORT (0 — выключено)
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+    # Режим приёма обновлений: polling (по умолчанию) или webhook. В режиме webhook бот слушает
+    # WEBHOOK_HOST:WEBHOOK_PORT + WEBHOOK_PATH и регистрирует в Telegram WEBHOOK_BASE_URL + WEBHOOK_PATH;
+    # запросы без заголовка с WEBHOOK_SECRET отклоняются (пустой — случайный секрет на каждый запуск)
+    BOT_RUN_MODE = os.getenv("BOT_RUN_MODE", "polling").strip().lower()
+    WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+    WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
     
     # Admin
     ADMIN_TELEGRAM_ID = int(os.getenv("ADMIN_TELEGRAM_ID", "0"))
@@ -1,4 +1,8 @@
 from .database import get_session, engine, Base
 from .database_init import init_db
+from .writer import DatabaseWriter, run_write, run_serialized, start_writer, stop_writer
 
-__all__ = ['get_session', 'engine', 'Base', 'init_db']
+__all__ = [
+    'get_session', 'engine', 'Base', 'init_db',
+    'DatabaseWriter', 'run_write', 'run_serialized', 'start_writer', 'stop_writer',
+]
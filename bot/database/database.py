@@ -1,19 +1,67 @@
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 from bot.config import Config
 from contextlib import asynccontextmanager
 
-# Поддержка PostgreSQL и SQLite
-_db_url = Config.DATABASE_URL or "sqlite+aiosqlite:///meownomeow.db"
-_connect_args = {}
-if _db_url.startswith("postgresql"):
-    _db_url = _db_url.replace("postgresql://", "postgresql+asyncpg://", 1)
-elif "sqlite" in _db_url:
-    if not _db_url.startswith("sqlite+"):
-        _db_url = "sqlite+aiosqlite:///" + (_db_url.replace("sqlite:///", "").replace("sqlite://", "") or "meownomeow.db")
-    _connect_args = {"timeout": 15}
-
-engine = create_async_engine(_db_url, echo=False, connect_args=_connect_args)
+# Профиль SQLite "tuned": WAL (чтение не блокирует запись), synchronous=NORMAL
+# (без fsync на каждый commit — в WAL это безопасно для целостности), увеличенный кэш и mmap,
+# пул соединений вместо NullPool
+SQLITE_TUNED_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    f"cache_size=-{Config.SQLITE_CACHE_KB}",
+    f"mmap_size={Config.SQLITE_MMAP_MB * 1024 * 1024}",
+    "busy_timeout=15000",
+    "temp_store=MEMORY",
+)
+
+
+def _normalize_db_url(db_url: str) -> tuple:
+    """URL для async-драйвера и connect_args (поддержка PostgreSQL и SQLite)"""
+    connect_args = {}
+    if db_url.startswith("postgresql"):
+        db_url = db_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    elif "sqlite" in db_url:
+        if not db_url.startswith("sqlite+"):
+            db_url = "sqlite+aiosqlite:///" + (db_url.replace("sqlite:///", "").replace("sqlite://", "") or "meownomeow.db")
+        connect_args = {"timeout": 15}
+    return db_url, connect_args
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Применяет PRAGMA профиля к каждому новому соединению"""
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_TUNED_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+
+def create_engine_for(db_url: str, profile: str = None):
+    """
+    Создаёт async-движок. profile — "tuned" (по умолчанию, Config.SQLITE_PROFILE)
+    или "default" (настройки SQLite как есть); для PostgreSQL не влияет.
+    """
+    db_url, connect_args = _normalize_db_url(db_url)
+    tuned = "sqlite" in db_url and ":memory:" not in db_url and (profile or Config.SQLITE_PROFILE) == "tuned"
+    if not tuned:
+        return create_async_engine(db_url, echo=False, connect_args=connect_args)
+    # aiosqlite по умолчанию без пула (NullPool): каждое открытие сессии — новое соединение,
+    # PRAGMA и холодный кэш. Пул держит соединения (и их кэш страниц) открытыми;
+    # сверх pool_size соединения создаются без ограничения (обработчики держат сессию чтения,
+    # пока ждут запись — лимит пула привёл бы к взаимной блокировке). Поэтому запись с этим
+    # профилем идёт через единственного писателя (Config.DB_SINGLE_WRITER по умолчанию включён):
+    # параллельных соединений много, но блокировку записи берёт одно.
+    new_engine = create_async_engine(
+        db_url, echo=False, connect_args=connect_args,
+        poolclass=AsyncAdaptedQueuePool, pool_size=5, max_overflow=-1,
+    )
+    event.listen(new_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    return new_engine
+
+
+engine = create_engine_for(Config.DATABASE_URL or "sqlite+aiosqlite:///meownomeow.db")
 
 # Создаем session factory
 async_session_maker = async_sessionmaker(
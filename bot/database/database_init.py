@@ -1,5 +1,5 @@
 import asyncio
-from sqlalchemy import text
+from sqlalchemy import bindparam, inspect, text
 from .database import engine, Base
 
 
@@ -15,6 +15,159 @@ def _add_visit_status_if_missing(conn):
         pass
 
 
+def _add_notification_retry_columns(conn):
+    """Добавляет колонки повторных попыток и dead-letter в notifications (миграция)"""
+    columns = {
+        "attempts": "INTEGER NOT NULL DEFAULT 0",
+        "last_error": "TEXT",
+        "next_attempt_at": "TIMESTAMP WITH TIME ZONE",
+        "dead": "BOOLEAN NOT NULL DEFAULT FALSE",
+    }
+    try:
+        existing = {c["name"] for c in inspect(conn).get_columns("notifications")}
+        for name, ddl in columns.items():
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE notifications ADD COLUMN {name} {ddl}"))
+        conn.commit()
+    except Exception:
+        pass
+
+
+def _add_notification_lease_columns(conn):
+    """Добавляет колонки аренды claimed_by / claimed_until в notifications (миграция)"""
+    columns = {
+        "claimed_by": "VARCHAR",
+        "claimed_until": "TIMESTAMP WITH TIME ZONE",
+    }
+    try:
+        existing = {c["name"] for c in inspect(conn).get_columns("notifications")}
+        for name, ddl in columns.items():
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE notifications ADD COLUMN {name} {ddl}"))
+        conn.commit()
+    except Exception:
+        pass
+
+
+def _add_appointment_starts_at(conn):
+    """Добавляет appointments.starts_at, заполняет его из date/time и создаёт индекс (user_id, starts_at, id)"""
+    try:
+        from bot.models.models import Appointment, appointment_starts_at
+        existing = {c["name"] for c in inspect(conn).get_columns("appointments")}
+        if "starts_at" not in existing:
+            conn.execute(text("ALTER TABLE appointments ADD COLUMN starts_at TIMESTAMP"))
+        rows = conn.execute(text("SELECT id, date, time FROM appointments WHERE starts_at IS NULL")).fetchall()
+        values = [
+            {"row_id": row[0], "starts_at": starts_at}
+            for row in rows
+            if (starts_at := appointment_starts_at(row[1], row[2])) is not None
+        ]
+        if values:
+            # Через таблицу модели, а не text(): DateTime в SQLite пишется в том же формате, что и ORM
+            table = Appointment.__table__
+            conn.execute(
+                table.update().where(table.c.id == bindparam("row_id")).values(starts_at=bindparam("starts_at")),
+                values,
+            )
+        for index in Appointment.__table__.indexes:
+            if index.name == "ix_appointments_user_starts":
+                index.create(conn, checkfirst=True)
+        conn.commit()
+    except Exception:
+        pass
+
+
+def _add_archive_starts_at(conn):
+    """Добавляет appointments_archive.starts_at и заполняет его из date/time (миграция)"""
+    try:
+        from bot.models.models import ArchivedAppointment, appointment_starts_at
+        existing = {c["name"] for c in inspect(conn).get_columns("appointments_archive")}
+        if "starts_at" in existing:
+            return
+        conn.execute(text("ALTER TABLE appointments_archive ADD COLUMN starts_at TIMESTAMP"))
+        rows = conn.execute(text("SELECT id, date, time FROM appointments_archive")).fetchall()
+        values = [
+            {"row_id": row[0], "starts_at": starts_at}
+            for row in rows
+            if (starts_at := appointment_starts_at(row[1], row[2])) is not None
+        ]
+        if values:
+            table = ArchivedAppointment.__table__
+            conn.execute(
+                table.update().where(table.c.id == bindparam("row_id")).values(starts_at=bindparam("starts_at")),
+                values,
+            )
+        conn.commit()
+    except Exception:
+        pass
+
+
+def _add_user_reachability_columns(conn):
+    """Добавляет users.is_reachable (с индексом) и users.unreachable_at (миграция)"""
+    try:
+        existing = {c["name"] for c in inspect(conn).get_columns("users")}
+        if "is_reachable" not in existing:
+            conn.execute(text("ALTER TABLE users ADD COLUMN is_reachable BOOLEAN NOT NULL DEFAULT TRUE"))
+        if "unreachable_at" not in existing:
+            conn.execute(text("ALTER TABLE users ADD COLUMN unreachable_at TIMESTAMP WITH TIME ZONE"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_is_reachable ON users (is_reachable)"))
+        conn.commit()
+    except Exception:
+        pass
+
+
+def _add_notification_due_index(conn):
+    """
+    Создаёт частичный индекс ix_notifications_due (sent = false AND dead = false) на существующей
+    таблице; индекс прежней версии (только sent = false) пересоздаётся
+    """
+    try:
+        from bot.models.models import Notification
+        if conn.dialect.name == "postgresql":
+            definition = conn.execute(text(
+                "SELECT indexdef FROM pg_indexes WHERE indexname = 'ix_notifications_due'"
+            )).scalar()
+        else:
+            definition = conn.execute(text(
+                "SELECT sql FROM sqlite_master WHERE type = 'index' AND name = 'ix_notifications_due'"
+            )).scalar()
+        if definition and "dead" not in definition:
+            conn.execute(text("DROP INDEX ix_notifications_due"))
+        for index in Notification.__table__.indexes:
+            if index.name == "ix_notifications_due":
+                index.create(conn, checkfirst=True)
+        conn.commit()
+    except Exception:
+        pass
+
+
+def _add_archive_original_id(conn):
+    """
+    Добавляет original_id в архивные таблицы прежней версии (первичный ключ был id живой строки):
+    original_id заполняется прежним id, а сам id дальше выдаётся архивом
+    """
+    try:
+        from bot.models.models import ArchivedAppointment, ArchivedAppointmentEvent, ArchivedNotification
+        for model in (ArchivedAppointment, ArchivedAppointmentEvent, ArchivedNotification):
+            table = model.__table__
+            existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+            if "original_id" not in existing:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN original_id INTEGER NOT NULL DEFAULT 0"))
+                conn.execute(text(f"UPDATE {table.name} SET original_id = id"))
+                if conn.dialect.name == "postgresql":
+                    # id создавался как SERIAL, но не выдавался — последовательность догоняет max(id)
+                    conn.execute(text(
+                        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                        f"COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"
+                    ))
+            for index in table.indexes:
+                if "original_id" in index.columns:
+                    index.create(conn, checkfirst=True)
+        conn.commit()
+    except Exception:
+        pass
+
+
 def _update_company_name_to_meownomeow(conn):
     """Обновляет название компании Meow → MeowNoMeow"""
     try:
@@ -50,15 +203,51 @@ def _add_notification_unique_constraint(conn):
         pass
 
 
+def _backfill_status_events(conn):
+    """
+    Переводит старые «временные» статусы (created/changed/canceled без уведомления)
+    в журнал appointment_events и сбрасывает created/changed → active.
+    Идёт при каждом запуске, но только по записям без событий в журнале: отмена клиента,
+    заблокировавшего бота, так и остаётся без уведомления и не должна давать новое событие.
+    """
+    try:
+        for status, kind in (("created", "created"), ("changed", "visit_completed"), ("canceled", "canceled")):
+            conn.execute(text(
+                "INSERT INTO appointment_events (appointment_id, kind, processed) "
+                "SELECT a.id, :kind, :processed FROM appointments a "
+                "WHERE a.status = :status AND NOT EXISTS ("
+                "SELECT 1 FROM notifications n WHERE n.appointment_id = a.id AND n.type = :status) "
+                "AND NOT EXISTS (SELECT 1 FROM appointment_events e WHERE e.appointment_id = a.id)"
+            ), {"kind": kind, "status": status, "processed": False})
+        conn.execute(text("UPDATE appointments SET status = 'active' WHERE status IN ('created', 'changed')"))
+        conn.commit()
+    except Exception:
+        pass
+
+
 async def init_db():
     """Инициализация базы данных - создание всех таблиц"""
-    from bot.models.models import Company, User, Appointment, Notification  # noqa: F401 — регистрация в Base
-    async with engine.begin() as conn:
+    from bot.models.models import (  # noqa: F401 — регистрация в Base
+        Company, User, Appointment, AppointmentEvent, Notification,
+        ArchivedAppointment, ArchivedAppointmentEvent, ArchivedNotification,
+    )
+    # connect(), а не begin(): миграции сами фиксируют изменения через conn.commit(),
+    # а внутри begin() после первого commit остальные миграции молча падали бы
+    async with engine.connect() as conn:
         await conn.run_sync(Base.metadata.create_all)
         await conn.run_sync(_add_visit_status_if_missing)
+        await conn.run_sync(_add_notification_retry_columns)
+        await conn.run_sync(_add_notification_lease_columns)
+        await conn.run_sync(_add_user_reachability_columns)
+        await conn.run_sync(_add_appointment_starts_at)
+        await conn.run_sync(_add_notification_due_index)
+        await conn.run_sync(_add_archive_original_id)
+        await conn.run_sync(_add_archive_starts_at)
         await conn.run_sync(_update_company_name_to_meownomeow)
         await conn.run_sync(_update_company_address_full)
         await conn.run_sync(_add_notification_unique_constraint)
+        await conn.run_sync(_backfill_status_events)
+        await conn.commit()
     print("База данных инициализирована!")
 
 
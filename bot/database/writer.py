@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import Config
+from .database import async_session_maker, get_session
+
+logger = logging.getLogger(__name__)
+
+WriteOp = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class DatabaseWriter:
+    """
+    Единственный писатель в БД (опционально, Config.DB_SINGLE_WRITER).
+    Одна asyncio-задача владеет соединением на запись: вызывающие отправляют операции
+    в очередь и ждут результат. Операции из очереди группируются в небольшие транзакции
+    (до Config.DB_WRITER_BATCH_SIZE), поэтому писатели не соревнуются за блокировку SQLite.
+    Чтение по-прежнему идёт через обычные сессии параллельно.
+    """
+
+    def __init__(self, session_maker=None, batch_size: int = None):
+        self._session_maker = session_maker or async_session_maker
+        self.batch_size = max(1, batch_size or Config.DB_WRITER_BATCH_SIZE)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.ops = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Дожидается выполнения уже поставленных операций и останавливает задачу."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, op: WriteOp) -> Any:
+        """Выполняет op(session) в транзакции писателя; commit делает писатель."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, False, future))
+        return await future
+
+    async def run_exclusive(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполняет fn() в очереди писателя отдельно от других операций
+        (например, commit собственной сессии синхронизации)."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((fn, True, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size and not self._queue.empty():
+                nxt = self._queue.get_nowait()
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+            # Эксклюзивные операции выполняются по одной, обычные — одной транзакцией
+            plain: List[Tuple[WriteOp, asyncio.Future]] = []
+            for fn, exclusive, future in batch:
+                if exclusive:
+                    await self._flush(plain)
+                    plain = []
+                    await self._call(fn, future)
+                else:
+                    plain.append((fn, future))
+            await self._flush(plain)
+            if stop:
+                return
+
+    async def _call(self, fn, future: asyncio.Future):
+        try:
+            result = await fn()
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    async def _flush(self, ops: List[Tuple[WriteOp, asyncio.Future]]):
+        if not ops:
+            return
+        self.batches += 1
+        self.ops += len(ops)
+        results = []
+        try:
+            async with self._session_maker() as session:
+                for op, _ in ops:
+                    results.append(await op(session))
+                await session.commit()
+        except Exception as e:
+            if len(ops) == 1:
+                if not ops[0][1].done():
+                    ops[0][1].set_exception(e)
+                return
+            # Одна операция испортила порцию — повторяем каждую в своей транзакции,
+            # чтобы ошибку получил только её автор
+            logger.warning(f"Порция записи откатилась ({e}), повтор по одной операции")
+            for op, future in ops:
+                await self._flush([(op, future)])
+            return
+        for (_, future), result in zip(ops, results):
+            if not future.done():
+                future.set_result(result)
+
+
+_writer: Optional[DatabaseWriter] = None
+
+
+def get_writer() -> Optional[DatabaseWriter]:
+    return _writer
+
+
+def start_writer(enabled: bool = None) -> Optional[DatabaseWriter]:
+    """Запускает писателя, если он включён (Config.DB_SINGLE_WRITER или enabled=True)."""
+    global _writer
+    if not (Config.DB_SINGLE_WRITER if enabled is None else enabled):
+        return None
+    if _writer is None:
+        _writer = DatabaseWriter()
+    _writer.start()
+    return _writer
+
+
+async def stop_writer():
+    global _writer
+    if _writer is not None:
+        await _writer.stop()
+        _writer = None
+
+
+async def run_write(op: WriteOp) -> Any:
+    """Выполняет op(session) и фиксирует: через писателя, если он запущен, иначе в своей сессии."""
+    if _writer is not None and _writer.running:
+        return await _writer.submit(op)
+    async with get_session() as session:
+        result = await op(session)
+        await session.commit()
+        return result
+
+
+async def run_serialized(fn: Callable[[], Awaitable[Any]]) -> Any:
+    """Выполняет fn() (обычно commit чужой сессии) в очереди писателя, если он запущен."""
+    if _writer is not None and _writer.running:
+        return await _writer.run_exclusive(fn)
+    return await fn()
@@ -1,36 +1,24 @@
 from aiogram import Router, F
-from aiogram.types import Message, KeyboardButton, ReplyKeyboardMarkup, Contact, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import CallbackQuery, Message, KeyboardButton, ReplyKeyboardMarkup, Contact, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.filters import Command
-import time
-
 from bot.config import Config
 
-RECORDING_URL = "https://dikidi.net/1993359"
-
-# Ограничение кнопок: не более 2 нажатий в минуту на одну кнопку
-_BUTTON_LIMIT = 2
-_BUTTON_WINDOW = 60  # секунд
-_button_presses: dict[tuple[int, str], list[float]] = {}
-
-
-def _check_button_rate_limit(user_id: int, button_key: str) -> bool:
-    """Возвращает True если нажатие разрешено, False если превышен лимит (2 нажатия в минуту)."""
-    key = (user_id, button_key)
-    now = time.monotonic()
-    if key not in _button_presses:
-        _button_presses[key] = []
-    cutoff = now - _BUTTON_WINDOW
-    _button_presses[key] = [t for t in _button_presses[key] if t > cutoff]
-    if len(_button_presses[key]) >= _BUTTON_LIMIT:
-        return False
-    _button_presses[key].append(now)
-    return True
-from sqlalchemy import select
-from bot.models.models import User, Appointment
+RECORDING_URL = Config.BOOKING_URL
+
+from sqlalchemy import update
+from bot.models.models import User
 from bot.database.database import get_session
+from bot.database.writer import run_write
+from bot.middlewares import RateLimitMiddleware
+from bot.services.appointment_list import AppointmentsPage, fetch_appointment_page, get_appointment_list
+from bot.services.metrics import METRICS
+from bot.services.user_cache import USER_CACHE, cached_user, lookup_user
+from bot.services.notifications import refresh_due_metrics
 import re
 
 router = Router()
+# Кнопки с флагом rate_limit: не более Config.BUTTON_RATE_LIMIT нажатий за Config.BUTTON_RATE_PERIOD секунд
+router.message.middleware(RateLimitMiddleware())
 
 # Клавиатура для незарегистрированных
 KEYBOARD_REGISTER = ReplyKeyboardMarkup(
@@ -47,6 +35,32 @@ KEYBOARD_LOGGED_IN = ReplyKeyboardMarkup(
 )
 
 
+def _add_user(telegram_id: int, phone: str):
+    """Операция записи для run_write: новый пользователь"""
+    async def op(session):
+        user = User(telegram_id=telegram_id, phone=phone)
+        session.add(user)
+        await session.flush()
+        return user
+    return op
+
+
+def _set_user_phone(user_id: int, phone: str):
+    """Операция записи для run_write: смена номера телефона"""
+    async def op(session):
+        await session.execute(update(User).where(User.id == user_id).values(phone=phone))
+    return op
+
+
+def _mark_user_reachable(user_id: int):
+    """Операция записи для run_write: клиент снова пишет боту — уведомления возобновляются"""
+    async def op(session):
+        await session.execute(
+            update(User).where(User.id == user_id).values(is_reachable=True, unreachable_at=None)
+        )
+    return op
+
+
 def normalize_phone(phone: str) -> str:
     """Нормализует номер телефона к формату +7XXXXXXXXXX"""
     # Убираем все символы кроме цифр
@@ -69,44 +83,24 @@ async def cmd_start(message: Message):
     if not message.from_user:
         return
     async with get_session() as session:
-        result = await session.execute(
-            select(User).where(User.telegram_id == message.from_user.id)
-        )
-        user = result.scalars().first()
+        user = await lookup_user(session, message.from_user.id)
         if not user:
             # Сохраняем нового пользователя при первом заходе (phone="" до отправки контакта)
-            user = User(telegram_id=message.from_user.id, phone="")
-            session.add(user)
-            await session.commit()
-            await session.refresh(user)
+            user = cached_user(await run_write(_add_user(message.from_user.id, "")))
+            USER_CACHE.put(message.from_user.id, user)
+        elif not user.is_reachable:
+            await run_write(_mark_user_reachable(user.id))
+            USER_CACHE.update(message.from_user.id, is_reachable=True)
         if user.phone and user.phone.strip():
             await message.answer(
                 "👋 Вы уже зарегистрированы!\n\n"
                 "Используйте кнопки меню или команды.",
                 reply_markup=KEYBOARD_LOGGED_IN
             )
-            # Сразу показываем записи пользователя из БД
-            result = await session.execute(
-                select(Appointment)
-                .where(Appointment.user_id == user.id)
-                .where(Appointment.status != "canceled")
-                .order_by(Appointment.date, Appointment.time)
-            )
-            appointments = result.scalars().all()
-            if appointments:
-                text = "📅 Ваши записи:\n\n"
-                for app in appointments:
-                    status_line = f"📌 {app.visit_status}\n" if getattr(app, "visit_status", None) else ""
-                    text += (
-                        f"🎯 {app.event}\n"
-                        f"📅 Дата: {app.date}\n"
-                        f"⏰ Время: {app.time}\n"
-                        f"👤 Мастер: {app.master}\n"
-                        f"{status_line}"
-                        f"📍 Адрес: г.Томск, ул. Фрунзе, 11Б\n"
-                        f"🔗 {app.clientlink}\n\n"
-                    )
-                await message.answer(text)
+            # Сразу показываем первую страницу записей (кэш, сбрасывается сверкой)
+            text, markup = await get_appointment_list(session, user.id)
+            if text:
+                await message.answer(text, reply_markup=markup)
             else:
                 await message.answer("📅 У вас пока нет активных записей. Нажмите «Записаться» или «Мои записи» для просмотра.")
         else:
@@ -157,16 +151,18 @@ async def _register_phone(message: Message, phone: str):
     phone_norm = normalize_phone(phone)
     async with get_session() as session:
         try:
-            result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-            user = result.scalars().first()
+            user = await lookup_user(session, telegram_id)
             inline_kb = InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="📅 Записаться", url=RECORDING_URL)]
             ])
 
             if user:
+                if not user.is_reachable:
+                    await run_write(_mark_user_reachable(user.id))
+                    USER_CACHE.update(telegram_id, is_reachable=True)
                 if user.phone != phone_norm:
-                    user.phone = phone_norm
-                    await session.commit()
+                    await run_write(_set_user_phone(user.id, phone_norm))
+                    USER_CACHE.update(telegram_id, phone=phone_norm)
                 await message.answer(
                     f"✅ Номер телефона обновлён: {phone}\n\n"
                     "🔔 Уведомления подключены!",
@@ -174,11 +170,8 @@ async def _register_phone(message: Message, phone: str):
                 )
                 await message.answer("🔗 Записаться на процедуру:", reply_markup=inline_kb)
             else:
-                new_user = User(telegram_id=telegram_id, phone=phone_norm)
-                session.add(new_user)
-                await session.commit()
-                await session.refresh(new_user)
-                user = new_user
+                user = cached_user(await run_write(_add_user(telegram_id, phone_norm)))
+                USER_CACHE.put(telegram_id, user)
 
                 await message.answer(
                     f"✅ Регистрация успешна!\n"
@@ -189,41 +182,20 @@ async def _register_phone(message: Message, phone: str):
                 await message.answer("🔗 Записаться на процедуру:", reply_markup=inline_kb)
 
             # Отправляем уведомление о записях, если есть
-            result = await session.execute(
-                select(Appointment)
-                .where(Appointment.user_id == user.id)
-                .where(Appointment.status != "canceled")
-                .order_by(Appointment.date, Appointment.time)
-            )
-            appointments = result.scalars().all()
-            if appointments:
-                text = "📅 Ваши записи:\n\n"
-                for app in appointments:
-                    status_line = f"📌 {app.visit_status}\n" if getattr(app, "visit_status", None) else ""
-                    text += (
-                        f"🎯 {app.event}\n"
-                        f"📅 Дата: {app.date}\n"
-                        f"⏰ Время: {app.time}\n"
-                        f"👤 Мастер: {app.master}\n"
-                        f"{status_line}"
-                        f"📍 Адрес: г.Томск, ул. Фрунзе, 11Б\n"
-                        f"🔗 {app.clientlink}\n\n"
-                    )
-                await message.answer(text)
+            text, markup = await get_appointment_list(session, user.id)
+            if text:
+                await message.answer(text, reply_markup=markup)
         except Exception as e:
             import traceback
             traceback.print_exc()
             await message.answer("❌ Произошла ошибка при регистрации. Попробуйте позже.")
 
 
-@router.message(F.text == "📅 Записаться")
+@router.message(F.text == "📅 Записаться", flags={"rate_limit": "zapisatsya"})
 async def handle_btn_zapisatsya(message: Message):
     """Кнопка «Записаться» в меню"""
     if not message.from_user:
         return
-    if not _check_button_rate_limit(message.from_user.id, "zapisatsya"):
-        await message.answer("⏳ Не более 2 нажатий в минуту. Подождите немного.")
-        return
     await message.answer(
         "🔗 Записаться на процедуру:",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -232,26 +204,20 @@ async def handle_btn_zapisatsya(message: Message):
     )
 
 
-@router.message(F.text == "📋 Мои записи")
+@router.message(F.text == "📋 Мои записи", flags={"rate_limit": "my_appointments"})
 async def handle_btn_my_appointments(message: Message):
     """Кнопка «Мои записи» в меню — тот же функционал что /my_appointments"""
     if not message.from_user:
         return
-    if not _check_button_rate_limit(message.from_user.id, "my_appointments"):
-        await message.answer("⏳ Не более 2 нажатий в минуту. Подождите немного.")
-        return
     await cmd_my_appointments(message)
 
 
 @router.message(Command("my_appointments"))
 async def cmd_my_appointments(message: Message):
-    """Показывает все записи пользователя"""
+    """Показывает записи пользователя: ближайшие первыми, дальше — кнопками по страницам"""
     async with get_session() as session:
         try:
-            result = await session.execute(
-                select(User).where(User.telegram_id == message.from_user.id)
-            )
-            user = result.scalars().first()
+            user = await lookup_user(session, message.from_user.id)
             
             if not user:
                 await message.answer(
@@ -259,36 +225,50 @@ async def cmd_my_appointments(message: Message):
                 )
                 return
             
-            # Получаем все записи пользователя
-            result = await session.execute(
-                select(Appointment)
-                .where(Appointment.user_id == user.id)
-                .where(Appointment.status != "canceled")
-                .order_by(Appointment.date, Appointment.time)
-            )
-            appointments = result.scalars().all()
-            
-            if not appointments:
+            # Первая страница записей — из кэша, запрос к БД только после изменений
+            text, markup = await get_appointment_list(session, user.id)
+            if not text:
                 await message.answer("📅 У вас пока нет активных записей.")
             else:
-                text = "📅 Ваши записи:\n\n"
-                for appointment in appointments:
-                    status_line = f"📌 {appointment.visit_status}\n" if getattr(appointment, "visit_status", None) else ""
-                    text += (
-                        f"🎯 {appointment.event}\n"
-                        f"📅 Дата: {appointment.date}\n"
-                        f"⏰ Время: {appointment.time}\n"
-                        f"👤 Мастер: {appointment.master}\n"
-                        f"{status_line}"
-                        f"📍 Адрес: г.Томск, ул. Фрунзе, 11Б\n"
-                        f"🔗 Ссылка: {appointment.clientlink}\n\n"
-                    )
-                await message.answer(text)
+                await message.answer(text, reply_markup=markup)
         except Exception as e:
             await message.answer("❌ Произошла ошибка. Попробуйте позже.")
             print(f"Ошибка при получении записей: {e}")
 
 
+@router.callback_query(AppointmentsPage.filter())
+async def cb_appointments_page(callback: CallbackQuery, callback_data: AppointmentsPage):
+    """Кнопки «Назад / Вперёд» под списком записей: страница по ключу крайней записи"""
+    async with get_session() as session:
+        try:
+            user = await lookup_user(session, callback.from_user.id)
+            if user is None:
+                await callback.answer("Вы не зарегистрированы. Используйте /start.", show_alert=True)
+                return
+            page = await fetch_appointment_page(session, user.id, callback_data)
+            if not page.appointments:
+                await callback.answer("Записей больше нет.")
+                return
+            if callback.message:
+                await callback.message.edit_text(page.text, reply_markup=page.markup)
+            await callback.answer()
+        except Exception as e:
+            await callback.answer("❌ Произошла ошибка. Попробуйте позже.")
+            print(f"Ошибка при получении страницы записей: {e}")
+
+
+@router.message(Command("stats"))
+async def cmd_stats(message: Message):
+    """Метрики уведомлений — только для администратора (Config.ADMIN_TELEGRAM_ID)"""
+    if not message.from_user or not Config.ADMIN_TELEGRAM_ID or message.from_user.id != Config.ADMIN_TELEGRAM_ID:
+        return
+    try:
+        await refresh_due_metrics()
+    except Exception as e:
+        print(f"Ошибка при подсчёте просроченных уведомлений: {e}")
+    await message.answer(METRICS.render_text())
+
+
 @router.message(Command("help"))
 async def cmd_help(message: Message):
     """Справка по командам"""
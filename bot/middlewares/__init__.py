@@ -0,0 +1,4 @@
+from .concurrency import UpdateConcurrencyMiddleware
+from .rate_limit import RateLimiter, RateLimitMiddleware
+
+__all__ = ['RateLimiter', 'RateLimitMiddleware', 'UpdateConcurrencyMiddleware']
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from bot.config import Config
+from bot.services.metrics import METRICS, Histogram
+
+# Границы гистограммы ожидания обновления в очереди (секунды)
+WAIT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class UpdateConcurrencyMiddleware(BaseMiddleware):
+    """
+    Ограничивает обработку обновлений: одновременно не больше limit обработчиков на процесс,
+    обновления одного пользователя — строго по очереди, в порядке поступления
+    (контакт, затем «Мои записи» не обгоняют друг друга). Пока обновление ждёт свою очередь
+    у пользователя, общий слот оно не занимает — занятые им слоты не простаивают.
+    Замки пользователей удаляются, когда у пользователя не осталось обновлений.
+    Регистрируется как внешняя middleware на обновления: dp.update.outer_middleware(...).
+    """
+
+    def __init__(self, limit: int = None):
+        self.limit = max(1, limit or Config.UPDATES_CONCURRENCY)
+        self._slots = asyncio.Semaphore(self.limit)
+        self._users: Dict[Hashable, list] = {}  # ключ пользователя → [замок, обновлений у пользователя]
+        self.waiting = 0
+        self.in_progress = 0
+        self.wait_seconds = Histogram(WAIT_BUCKETS)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        key: Optional[int] = user.id if user is not None else None
+        entry = None
+        if key is not None:
+            entry = self._users.get(key)
+            if entry is None:
+                entry = self._users[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+        queued = time.monotonic()
+        started = False
+        self.waiting += 1
+        try:
+            if entry is not None:
+                await entry[0].acquire()
+            try:
+                async with self._slots:
+                    started = True
+                    self.waiting -= 1
+                    self.wait_seconds.observe(time.monotonic() - queued)
+                    self.in_progress += 1
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self.in_progress -= 1
+            finally:
+                if entry is not None:
+                    entry[0].release()
+        finally:
+            if not started:
+                # Отменено в очереди, до обработчика
+                self.waiting -= 1
+            if entry is not None:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._users[key]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": self.limit, "waiting": self.waiting, "in_progress": self.in_progress,
+            "users": len(self._users), "processed": self.wait_seconds.count,
+            "wait_p95": self.wait_seconds.quantile(0.95),
+        }
+
+    def register_metrics(self, metrics=None):
+        """Глубина очереди, обработчики в работе и ожидание в очереди — в /stats и экспортёр"""
+        metrics = metrics or METRICS
+        metrics.register_gauge("updates_waiting", "Обновлений ждут очереди", lambda: self.waiting)
+        metrics.register_gauge("updates_in_progress", "Обновлений в обработке", lambda: self.in_progress)
+        metrics.register_gauge(
+            "update_wait_p95_seconds", "Ожидание обновления в очереди, p95 ≤ (с)",
+            lambda: self.wait_seconds.quantile(0.95),
+        )
+        metrics.register_gauge(
+            "update_wait_avg_seconds", "Среднее ожидание обновления в очереди (с)",
+            lambda: self.wait_seconds.sum / self.wait_seconds.count if self.wait_seconds.count else 0.0,
+        )
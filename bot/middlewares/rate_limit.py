@@ -0,0 +1,126 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from bot.config import Config
+
+
+class RateLimiter:
+    """
+    Token bucket на ключ (например, (user_id, кнопка)): limit нажатий за period секунд,
+    запас не больше limit. Память ограничена:
+    - запись, не тронутая period секунд, удаляется — её корзина уже полная,
+      то есть не отличается от новой (поведение не меняется);
+    - сверх max_keys вытесняется самая давняя запись.
+    Записи хранятся в OrderedDict в порядке последнего обращения, поэтому истёкшие
+    всегда в начале и удаляются за O(1) на вызов в среднем.
+    """
+
+    def __init__(self, limit: int = None, period: float = None, max_keys: int = None):
+        self.capacity = float(limit or Config.BUTTON_RATE_LIMIT)
+        self.period = float(period or Config.BUTTON_RATE_PERIOD)
+        self.rate = self.capacity / self.period
+        self.max_keys = max(1, max_keys or Config.RATE_LIMIT_MAX_KEYS)
+        self._buckets: "OrderedDict[Hashable, tuple]" = OrderedDict()  # ключ → (токены, время)
+        self.allowed = 0
+        self.denied = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """True — действие разрешено (токен списан), False — лимит исчерпан"""
+        if now is None:
+            now = time.monotonic()
+        buckets = self._buckets
+        # Истёкшие — в начале словаря: снимаем, пока не встретим свежую запись
+        while buckets:
+            oldest = next(iter(buckets))
+            if now - buckets[oldest][1] < self.period:
+                break
+            del buckets[oldest]
+            self.expired += 1
+        entry = buckets.get(key)
+        if entry is None:
+            tokens = self.capacity
+        else:
+            tokens = min(self.capacity, entry[0] + (now - entry[1]) * self.rate)
+            buckets.move_to_end(key)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+            self.allowed += 1
+        else:
+            self.denied += 1
+        buckets[key] = (tokens, now)
+        if len(buckets) > self.max_keys:
+            buckets.popitem(last=False)
+            self.evicted += 1
+        return allowed
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "keys": len(self._buckets), "allowed": self.allowed, "denied": self.denied,
+            "expired": self.expired, "evicted": self.evicted,
+        }
+
+
+def _plural(n: int, one: str, few: str, many: str) -> str:
+    """Форма слова для числа n: 1 нажатие, 2 нажатия, 5 нажатий"""
+    if n % 10 == 1 and n % 100 != 11:
+        return one
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return few
+    return many
+
+
+def _period_text(seconds: float) -> str:
+    """Период лимита словами: «в минуту», «за 2 часа», «за 90 секунд»"""
+    for unit, forms in ((3600, ("час", "часа", "часов")), (60, ("минуту", "минуты", "минут"))):
+        if seconds >= unit and seconds % unit == 0:
+            count = int(seconds // unit)
+            return f"в {forms[0]}" if count == 1 else f"за {count} {_plural(count, *forms)}"
+    if seconds == int(seconds):
+        count = int(seconds)
+        return "в секунду" if count == 1 else f"за {count} {_plural(count, 'секунду', 'секунды', 'секунд')}"
+    return f"за {seconds:g} с"
+
+
+def _limit_text(limit: int, period: float) -> str:
+    """Ответ при превышении лимита: из настроенных limit и period"""
+    presses = _plural(limit, "нажатия", "нажатий", "нажатий")
+    return f"⏳ Не более {limit} {presses} {_period_text(period)}. Подождите немного."
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """
+    Лимит нажатий для обработчиков с флагом rate_limit: значение флага — имя кнопки,
+    ключ лимита — (telegram_id, имя). Обработчики без флага проходят без проверки.
+    Регистрируется как внутренняя middleware: dp.message.middleware(RateLimitMiddleware()).
+    """
+
+    def __init__(self, limiter: Optional[RateLimiter] = None, text: str = None):
+        self.limiter = limiter or RateLimiter()
+        self.text = text or _limit_text(int(self.limiter.capacity), self.limiter.period)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        button = get_flag(data, "rate_limit")
+        user = data.get("event_from_user")
+        if button is None or user is None or self.limiter.allow((user.id, button)):
+            return await handler(event, data)
+        if isinstance(event, Message):
+            await event.answer(self.text)
+        elif isinstance(event, CallbackQuery):
+            await event.answer(self.text)
+        return None
@@ -1,3 +1,9 @@
-from .models import Company, User, Appointment, Notification
+from .models import (
+    Company, User, Appointment, AppointmentEvent, Notification,
+    ArchivedAppointment, ArchivedAppointmentEvent, ArchivedNotification,
+)
 
-__all__ = ['Company', 'User', 'Appointment', 'Notification']
+__all__ = [
+    'Company', 'User', 'Appointment', 'AppointmentEvent', 'Notification',
+    'ArchivedAppointment', 'ArchivedAppointmentEvent', 'ArchivedNotification',
+]
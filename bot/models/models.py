@@ -1,6 +1,9 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, UniqueConstraint
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from bot.database.database import Base
 
 
@@ -21,13 +24,30 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     telegram_id = Column(Integer, unique=True, nullable=False, index=True)
     phone = Column(String, nullable=False, default="", index=True)  # "" до отправки контакта
+    is_reachable = Column(Boolean, default=True, nullable=False, index=True)  # False — бот заблокирован / чат не найден
+    unreachable_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     appointments = relationship("Appointment", back_populates="user")
 
 
+def appointment_starts_at(date_str: str, time_str: str) -> Optional[datetime]:
+    """Начало визита из строк Dikidi (DD.MM.YYYY, HH:MM); без времени — начало дня, без даты — None"""
+    try:
+        day = datetime.strptime((date_str or "").strip(), "%d.%m.%Y")
+    except ValueError:
+        return None
+    try:
+        moment = datetime.strptime((time_str or "").strip()[:5], "%H:%M")
+    except ValueError:
+        return day
+    return day.replace(hour=moment.hour, minute=moment.minute)
+
+
 class Appointment(Base):
     __tablename__ = "appointments"
+    # Список «Мои записи» постранично по ключу (starts_at, id) одного пользователя
+    __table_args__ = (Index("ix_appointments_user_starts", "user_id", "starts_at", "id"),)
     
     id = Column(Integer, primary_key=True, index=True)
     dikidi_id = Column(Integer, unique=True, nullable=False, index=True)  # авто в БД: 1, 2, 3, ...
@@ -37,28 +57,120 @@ class Appointment(Base):
     event = Column(String, nullable=False)  # название услуги/события
     date = Column(String, nullable=False)  # дата записи
     time = Column(String, nullable=False)  # время записи
+    starts_at = Column(DateTime, nullable=True)  # date + time одним значением (местное время), для сортировки
     master = Column(String, nullable=False)  # мастер
     clientlink = Column(String, nullable=False)  # ссылка на запись
     visit_status = Column(String, nullable=True)  # Визит завершен / Ожидает визита (из Dikidi .journal458-visit-status)
 
-    status = Column(String, nullable=False, default="created")  # created / changed / canceled / visited / active
+    status = Column(String, nullable=False, default="active")  # active / canceled (история изменений — AppointmentEvent)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     user = relationship("User", back_populates="appointments")
     company = relationship("Company", back_populates="appointments")
     notifications = relationship("Notification", back_populates="appointment")
+    events = relationship("AppointmentEvent", back_populates="appointment")
+
+
+class AppointmentEvent(Base):
+    """Журнал изменений записи (только добавление) — результат сверки с Dikidi"""
+    __tablename__ = "appointment_events"
+    __table_args__ = (Index("ix_appointment_events_pending", "processed", "id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    appointment_id = Column(Integer, ForeignKey("appointments.id"), nullable=False, index=True)
+    kind = Column(String, nullable=False)  # created / field_changed / visit_completed / canceled
+    field = Column(String, nullable=True)  # для field_changed — имя поля
+    old_value = Column(Text, nullable=True)
+    new_value = Column(Text, nullable=True)
+    processed = Column(Boolean, default=False, nullable=False)  # уведомления по событию запланированы
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    appointment = relationship("Appointment", back_populates="events")
 
 
 class Notification(Base):
     __tablename__ = "notifications"
-    __table_args__ = (UniqueConstraint("appointment_id", "type", name="uq_notification_appointment_type"),)
+    __table_args__ = (
+        UniqueConstraint("appointment_id", "type", name="uq_notification_appointment_type"),
+        # Горячий запрос «sent = false AND dead = false AND send_at <= now ORDER BY send_at, id»:
+        # частичный индекс только по ожидающим — не растёт ни с историей отправленных,
+        # ни с dead-letter (в том числе уведомлениями клиентов, заблокировавших бота)
+        Index(
+            "ix_notifications_due", "send_at", "id",
+            sqlite_where=text("sent = 0 AND dead = 0"),
+            postgresql_where=text("sent = false AND dead = false"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     appointment_id = Column(Integer, ForeignKey("appointments.id"), nullable=False)
     type = Column(String, nullable=False)  # created / changed / canceled / reminder / after_visit / confirmation
     send_at = Column(DateTime(timezone=True), nullable=False)
     sent = Column(Boolean, default=False, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)  # неудачных попыток отправки
+    last_error = Column(Text, nullable=True)  # класс и текст последней ошибки
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)  # не раньше (backoff / retry_after)
+    dead = Column(Boolean, default=False, nullable=False)  # dead-letter: больше не отправляем
+    claimed_by = Column(String, nullable=True)  # экземпляр бота, взявший уведомление в отправку
+    claimed_until = Column(DateTime(timezone=True), nullable=True)  # аренда до; после — может взять другой
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     appointment = relationship("Appointment", back_populates="notifications")
+
+
+class ArchivedAppointment(Base):
+    """
+    Архив записей (задача хранения, RetentionService): копия строки appointments без связей.
+    Свой первичный ключ: SQLite без AUTOINCREMENT выдаёт id удалённых записей повторно,
+    поэтому id живой записи (original_id) в архиве может встретиться не один раз.
+    """
+    __tablename__ = "appointments_archive"
+
+    id = Column(Integer, primary_key=True)
+    original_id = Column(Integer, nullable=False, index=True)  # id из appointments
+    dikidi_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False, index=True)
+    company_id = Column(Integer, nullable=False)
+    event = Column(String, nullable=False)
+    date = Column(String, nullable=False)
+    time = Column(String, nullable=False)
+    starts_at = Column(DateTime, nullable=True)
+    master = Column(String, nullable=False)
+    clientlink = Column(String, nullable=False)
+    visit_status = Column(String, nullable=True)
+    status = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ArchivedAppointmentEvent(Base):
+    """Архив журнала изменений архивных записей"""
+    __tablename__ = "appointment_events_archive"
+
+    id = Column(Integer, primary_key=True)
+    original_id = Column(Integer, nullable=False, index=True)  # id из appointment_events
+    appointment_id = Column(Integer, nullable=False, index=True)
+    kind = Column(String, nullable=False)
+    field = Column(String, nullable=True)
+    old_value = Column(Text, nullable=True)
+    new_value = Column(Text, nullable=True)
+    processed = Column(Boolean, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class ArchivedNotification(Base):
+    """Архив уведомлений архивных записей (все отправлены или в dead-letter)"""
+    __tablename__ = "notifications_archive"
+
+    id = Column(Integer, primary_key=True)
+    original_id = Column(Integer, nullable=False, index=True)  # id из notifications
+    appointment_id = Column(Integer, nullable=False, index=True)
+    type = Column(String, nullable=False)
+    send_at = Column(DateTime(timezone=True), nullable=False)
+    sent = Column(Boolean, nullable=False)
+    attempts = Column(Integer, nullable=False)
+    last_error = Column(Text, nullable=True)
+    dead = Column(Boolean, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=True)
@@ -1,5 +1,7 @@
+from .clock import Clock, VirtualClock
 from .dikidi_parser import DikidiParser
 from .notifications import NotificationService
 from .scheduler import SchedulerService
+from .send_queue import SendQueue
 
-__all__ = ['DikidiParser', 'NotificationService', 'SchedulerService']
+__all__ = ['Clock', 'VirtualClock', 'DikidiParser', 'NotificationService', 'SchedulerService', 'SendQueue']
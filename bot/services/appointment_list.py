@@ -0,0 +1,244 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import cached_property
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import Config
+from bot.models.models import Appointment
+from bot.services.metrics import METRICS
+
+# Части списка: сначала предстоящие (по возрастанию starts_at), затем прошедшие (по убыванию),
+# в конце — записи без даты (starts_at не разобран из Dikidi), по возрастанию id
+UPCOMING = "u"
+PAST = "p"
+UNDATED = "n"
+_PARTS = (UPCOMING, PAST, UNDATED)
+
+
+class AppointmentsPage(CallbackData, prefix="apps"):
+    """
+    Кнопки «назад/вперёд»: направление и ключ (часть, starts_at, id) крайней записи страницы;
+    для записей без даты ts = 0 и ключ — только id
+    """
+    direction: str  # "next" — после ключа, "prev" — до ключа
+    part: str
+    ts: int
+    id: int
+
+
+def render_appointment_list(appointments: List[Appointment], now: datetime = None) -> str:
+    """Текст «Ваши записи»; перед первой прошедшей и первой без даты — заголовки. Пустая строка — записей нет"""
+    if not appointments:
+        return ""
+    now = now or datetime.now()
+    parts = ["📅 Ваши записи:\n\n"]
+    past_header = undated_header = False
+    for app in appointments:
+        if not undated_header and app.starts_at is None:
+            parts.append("❔ Без даты:\n\n")
+            undated_header = True
+        elif not past_header and app.starts_at is not None and app.starts_at < now:
+            parts.append("🕘 Прошедшие:\n\n")
+            past_header = True
+        status_line = f"📌 {app.visit_status}\n" if app.visit_status else ""
+        parts.append(
+            f"🎯 {app.event}\n"
+            f"📅 Дата: {app.date}\n"
+            f"⏰ Время: {app.time}\n"
+            f"👤 Мастер: {app.master}\n"
+            f"{status_line}"
+            f"📍 Адрес: {Config.COMPANY_ADDRESS}\n"
+            f"🔗 Ссылка: {app.clientlink}\n\n"
+        )
+    return "".join(parts)
+
+
+def _key(app: Appointment, now: datetime) -> Tuple[str, int, int]:
+    """Ключ записи для кнопки: (часть, starts_at в секундах, id)"""
+    if app.starts_at is None:
+        return UNDATED, 0, app.id
+    return UPCOMING if app.starts_at >= now else PAST, int(app.starts_at.timestamp()), app.id
+
+
+def _cursor_key(cursor: AppointmentsPage) -> tuple:
+    return datetime.fromtimestamp(cursor.ts), cursor.id
+
+
+async def _fetch(session: AsyncSession, user_id: int, now: datetime, part: str, limit: int,
+                 after: Optional[tuple] = None, before: Optional[tuple] = None, tail: bool = False) -> List[Appointment]:
+    """
+    До limit записей части part в порядке показа: с начала части или после ключа after;
+    до ключа before или с конца части (tail) — читаются в обратном порядке и разворачиваются.
+    Запрос идёт по индексу (user_id, starts_at, id); в части без даты ключ — только id.
+    """
+    query = select(Appointment).where(Appointment.user_id == user_id, Appointment.status != "canceled")
+    if part == UNDATED:
+        key, order = Appointment.id, (Appointment.id,)
+        query = query.where(Appointment.starts_at.is_(None))
+        after = after and after[1]
+        before = before and before[1]
+    else:
+        key, order = tuple_(Appointment.starts_at, Appointment.id), (Appointment.starts_at, Appointment.id)
+        if part == UPCOMING:
+            query = query.where(Appointment.starts_at >= now)
+        else:
+            query = query.where(Appointment.starts_at < now)
+    ascending = part != PAST
+    if after is not None:
+        query = query.where(key > after if ascending else key < after)
+    if before is not None:
+        query = query.where(key < before if ascending else key > before)
+    backwards = before is not None or tail
+    if ascending != backwards:
+        query = query.order_by(*order)
+    else:
+        query = query.order_by(*[column.desc() for column in order])
+    rows = list((await session.execute(query.limit(limit))).scalars().all())
+    return rows[::-1] if backwards else rows
+
+
+class AppointmentPageView:
+    """Страница списка: записи, есть ли записи до/после неё, текст и кнопки"""
+
+    def __init__(self, appointments: List[Appointment], has_prev: bool, has_next: bool, now: datetime):
+        self.appointments = appointments
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.now = now
+
+    @cached_property
+    def text(self) -> str:
+        return render_appointment_list(self.appointments, self.now)
+
+    @cached_property
+    def markup(self) -> Optional[InlineKeyboardMarkup]:
+        buttons = []
+        if self.has_prev:
+            part, ts, app_id = _key(self.appointments[0], self.now)
+            buttons.append(InlineKeyboardButton(
+                text="⬅️ Назад",
+                callback_data=AppointmentsPage(direction="prev", part=part, ts=ts, id=app_id).pack(),
+            ))
+        if self.has_next:
+            part, ts, app_id = _key(self.appointments[-1], self.now)
+            buttons.append(InlineKeyboardButton(
+                text="Вперёд ➡️",
+                callback_data=AppointmentsPage(direction="next", part=part, ts=ts, id=app_id).pack(),
+            ))
+        return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+async def fetch_appointment_page(
+    session: AsyncSession,
+    user_id: int,
+    cursor: Optional[AppointmentsPage] = None,
+    now: datetime = None,
+    limit: int = None,
+) -> AppointmentPageView:
+    """
+    Страница «Мои записи» по ключу (keyset): без cursor — первая (ближайшие предстоящие),
+    с cursor — следующая или предыдущая от крайней записи. Читается limit + 1 строка,
+    лишняя говорит, есть ли ещё страница в этом направлении; на границе частей
+    недостающее добирается из следующих (предыдущих) частей.
+    """
+    now = now or datetime.now()
+    limit = max(1, limit or Config.APPOINTMENTS_PAGE_SIZE)
+    if cursor is None or cursor.direction == "next":
+        part, after = UPCOMING, None
+        if cursor is not None:
+            part, after = cursor.part, _cursor_key(cursor)
+        rows = await _fetch(session, user_id, now, part, limit + 1, after=after)
+        for following in _PARTS[_PARTS.index(part) + 1:]:
+            if len(rows) > limit:
+                break
+            rows += await _fetch(session, user_id, now, following, limit + 1 - len(rows))
+        return AppointmentPageView(rows[:limit], cursor is not None, len(rows) > limit, now)
+
+    part = cursor.part
+    rows = await _fetch(session, user_id, now, part, limit + 1, before=_cursor_key(cursor))
+    for preceding in reversed(_PARTS[:_PARTS.index(part)]):
+        if len(rows) > limit:
+            break
+        rows = await _fetch(session, user_id, now, preceding, limit + 1 - len(rows), tail=True) + rows
+    return AppointmentPageView(rows[-limit:], len(rows) > limit, True, now)
+
+
+class AppointmentListCache:
+    """
+    Первая страница «Мои записи» (текст и кнопки) по user_id (LRU, не больше max_size).
+    Сверка с Dikidi и архивация сбрасывают записи тех пользователей, чьи записи изменились,
+    сразу после commit, поэтому повторные нажатия «Мои записи» и /start — без запросов к БД.
+    Страница устаревает и сама, когда ближайшая предстоящая запись на ней уходит в прошлое,
+    и не позже чем через ttl (Config.APPOINTMENT_LIST_CACHE_TTL) — это страхует от изменений
+    мимо процесса (сверка в другом экземпляре, ручная правка БД).
+    Чтение, начавшееся до сброса, свой результат в кэш не кладёт (generation).
+    """
+
+    def __init__(self, max_size: int = None, ttl: float = None):
+        self.max_size = max(1, max_size or Config.APPOINTMENT_LIST_CACHE_SIZE)
+        self.ttl = Config.APPOINTMENT_LIST_CACHE_TTL if ttl is None else ttl
+        self._pages: "OrderedDict[int, tuple]" = OrderedDict()  # user_id → (текст, кнопки, годна до)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, now: datetime) -> Optional[tuple]:
+        entry = self._pages.get(user_id)
+        if entry is None or now >= entry[2]:
+            self.misses += 1
+            return None
+        self._pages.move_to_end(user_id)
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def put(self, user_id: int, page: AppointmentPageView, generation: int):
+        """Кладёт страницу, если с начала чтения (generation) ничего не сбрасывалось"""
+        if generation != self.generation:
+            return
+        upcoming = [
+            app.starts_at for app in page.appointments if app.starts_at is not None and app.starts_at >= page.now
+        ]
+        valid_until = min([page.now + timedelta(seconds=self.ttl), *upcoming])
+        self._pages[user_id] = (page.text, page.markup, valid_until)
+        self._pages.move_to_end(user_id)
+        if len(self._pages) > self.max_size:
+            self._pages.popitem(last=False)
+
+    def invalidate(self, user_ids: Iterable[int]):
+        self.generation += 1
+        for user_id in user_ids:
+            self._pages.pop(user_id, None)
+
+    def clear(self):
+        self.generation += 1
+        self._pages.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._pages), "hits": self.hits, "misses": self.misses}
+
+
+# Общий кэш процесса: читают обработчики, сбрасывают сверка (DikidiParser) и RetentionService
+APPOINTMENT_LIST_CACHE = AppointmentListCache()
+METRICS.register_gauge(
+    "appointment_list_cache_hits", "Попаданий в кэш «Мои записи»", lambda: APPOINTMENT_LIST_CACHE.hits
+)
+METRICS.register_gauge(
+    "appointment_list_cache_misses", "Промахов кэша «Мои записи»", lambda: APPOINTMENT_LIST_CACHE.misses
+)
+
+
+async def get_appointment_list(session: AsyncSession, user_id: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Первая страница записей пользователя (текст, кнопки): из кэша или запросом по индексу"""
+    now = datetime.now()
+    cached = APPOINTMENT_LIST_CACHE.get(user_id, now)
+    if cached is not None:
+        return cached
+    generation = APPOINTMENT_LIST_CACHE.generation
+    page = await fetch_appointment_page(session, user_id, now=now)
+    APPOINTMENT_LIST_CACHE.put(user_id, page, generation)
+    return page.text, page.markup
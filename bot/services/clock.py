@@ -0,0 +1,91 @@
+import asyncio
+import heapq
+import itertools
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+
+class Clock:
+    """Источник текущего времени для сервисов: локальное naive-время, как datetime.now()"""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        """Ждёт event не дольше timeout секунд по этим часам; True — событие наступило"""
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return event.is_set()
+
+
+class VirtualClock(Clock):
+    """
+    Виртуальные часы для симуляции (simulate.py): время стоит, пока его не сдвинут
+    advance() или set(), поэтому месяц расписания проигрывается за секунды.
+    wait() спит до виртуального срока: его будит set()/advance(), а симуляция через
+    settle() дожидается, пока задачи на этих часах уснут, и next_wakeup() знает, куда прыгать.
+    """
+
+    def __init__(self, start: datetime):
+        self._now = start
+        self._sleepers: List[tuple] = []  # куча (срок, номер, future, event)
+        self._seq = itertools.count()
+        self._changed: Optional[asyncio.Event] = None
+
+    def now(self) -> datetime:
+        return self._now
+
+    def advance(self, delta: timedelta):
+        self.set(self._now + delta)
+
+    def set(self, moment: datetime):
+        """Переводит часы вперёд на moment (назад время не идёт) и будит уснувших до него"""
+        if moment > self._now:
+            self._now = moment
+        while self._sleepers and self._sleepers[0][0] <= self._now:
+            _, _, timer, _ = heapq.heappop(self._sleepers)
+            if not timer.done():
+                timer.set_result(None)
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        if event.is_set():
+            return True
+        loop = asyncio.get_running_loop()
+        timer = loop.create_future()
+        heapq.heappush(self._sleepers, (self._now + timedelta(seconds=timeout), next(self._seq), timer, event))
+        waiter = loop.create_task(event.wait())
+        self._signal()
+        try:
+            await asyncio.wait({timer, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            if not timer.done():
+                timer.cancel()
+        return event.is_set()
+
+    def _sleeping(self) -> list:
+        """Спящие: срок не наступил и событие не пришло"""
+        return [entry for entry in self._sleepers if not entry[2].done() and not entry[3].is_set()]
+
+    def _signal(self):
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        self._changed.set()
+
+    def next_wakeup(self) -> Optional[datetime]:
+        """Ближайший срок, до которого спит задача на этих часах"""
+        sleeping = self._sleeping()
+        return min(entry[0] for entry in sleeping) if sleeping else None
+
+    async def settle(self, sleepers: int = 1):
+        """Ждёт, пока не менее sleepers задач уснут на этих часах (проходы и запросы к БД завершены)"""
+        while len(self._sleeping()) < sleepers:
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            self._changed.clear()
+            await self._changed.wait()
+
+
+SYSTEM_CLOCK = Clock()
@@ -1,16 +1,40 @@
 import asyncio
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import FrozenSet, List, Dict, NamedTuple, Optional
 from playwright.async_api import async_playwright, Page
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from bot.models.models import Appointment, User, Company
+from sqlalchemy import and_, func, or_, select
+from bot.models.models import Appointment, AppointmentEvent, User, Company, appointment_starts_at
 from bot.config import Config
+from bot.database.writer import run_serialized
+from bot.services.appointment_list import APPOINTMENT_LIST_CACHE
+from bot.services.clock import SYSTEM_CLOCK, Clock
 import re
 import os
 from pathlib import Path
 
 
+# Поля строки журнала, по которым сверка сравнивает журнал с прошлой сверкой
+_SYNC_FIELDS = ("phone", "event", "date", "time", "master", "clientlink", "visit_status")
+
+
+class _SyncState(NamedTuple):
+    """Что сверено в прошлый раз: окно, пользователи (id, телефон) и строки журнала"""
+    window: tuple
+    users: List[tuple]
+    appointments: List[Dict]
+    full_at: datetime
+
+
+# Пользователи для сопоставления с журналом; запрос собирается один раз — он идёт в каждой сверке
+_USERS_QUERY = select(User.id, User.phone).order_by(User.id)
+
+
+def _journal_rows(appointments: List[Dict]) -> FrozenSet[tuple]:
+    return frozenset(tuple(map(a.get, _SYNC_FIELDS)) for a in appointments)
+
+
 def _as_time(s: str) -> str:
     """Извлекает время в формате HH:MM. 11:00 → '11:00'. Если не время — ''."""
     if not s:
@@ -164,11 +188,14 @@ def _year_from_page_url(url: str) -> int:
 
 
 class DikidiParser:
-    def __init__(self):
+    def __init__(self, clock: Optional[Clock] = None):
+        # Текущее время для окна парсинга; в симуляции — виртуальные часы
+        self.clock = clock or SYSTEM_CLOCK
         self.company_id = Config.DIKIDI_COMPANY_ID
         self.journal_url = Config.DIKIDI_JOURNAL_URL
         self.login_phone = Config.DIKIDI_LOGIN_PHONE
         self.login_password = Config.DIKIDI_LOGIN_PASSWORD
+        self._last_sync: Optional[_SyncState] = None
         self._journal_list_base = getattr(
             Config, "DIKIDI_JOURNAL_LIST_BASE",
             "https://dikidi.ru/ru/owner/journal/?company=1993359&view=list&start=2026-02-01&end=2026-02-28&limit=50&period=month"
@@ -833,14 +860,79 @@ class DikidiParser:
             print(f"Ошибка при извлечении данных записи: {e}")
             return None
     
-    async def sync_appointments(self, session: AsyncSession) -> Dict[str, int]:
+    def parse_window(self) -> tuple:
+        """Диапазон дат парсинга (1 нед назад + 3 нед вперёд): (parse_min, parse_max)"""
+        today = self.clock.now().date()
+        week_start = today - timedelta(days=today.weekday())
+        return (week_start - timedelta(days=7), week_start + timedelta(days=6 + 14))
+
+    async def sync_appointments(
+        self,
+        session: AsyncSession,
+        parsed_appointments: Optional[List[Dict]] = None,
+        window: Optional[tuple] = None,
+    ) -> Dict[str, int]:
         """
         Синхронизирует записи с базой данных
-        Возвращает статистику: создано, изменено, отменено
+        parsed_appointments — уже готовый результат парсинга (например, из снимка);
+        window — диапазон дат, в котором пропавшие записи считаются отменёнными.
+        Возвращает статистику: создано, изменено, отменено, событий, а также число
+        транзакций (chunks) и время удержания блокировки записи (lock_max_ms / lock_total_ms).
+        Каждое изменение пишется в журнал AppointmentEvent (created / field_changed /
+        visit_completed / canceled) в той же транзакции, что и сама запись.
+        Коммит — порциями по Config.SYNC_CHUNK_SIZE записей: запись и её события всегда
+        в одной порции, поэтому между порциями БД согласована, а /start и регистрация
+        не ждут всю синхронизацию.
+        Из БД читаются только записи окна дат. Если окно и пользователи те же, что в прошлой
+        сверке, а полный проход был не раньше Config.SYNC_FULL_EVERY_MINUTES назад, сверяются
+        только клиенты, чьи строки журнала появились, изменились или пропали (full=0 в статистике);
+        неизменный журнал не читает записи вовсе. rows — сколько строк журнала сверено.
         """
-        parsed_appointments = await self.parse_appointments(session)
-        
-        stats = {"created": 0, "changed": 0, "canceled": 0}
+        if parsed_appointments is None:
+            parsed_appointments = await self.parse_appointments(session)
+        parse_min, parse_max = window or self.parse_window()
+        chunk_size = max(1, Config.SYNC_CHUNK_SIZE)
+
+        stats = {
+            "created": 0, "changed": 0, "canceled": 0, "events": 0,
+            "chunks": 0, "lock_max_ms": 0, "lock_total_ms": 0, "full": 1, "rows": 0,
+        }
+        chunk = {"rows": 0}
+        # Пользователи, чьи записи изменились в текущей порции: их «Мои записи» сбрасываются после commit
+        touched_users = set()
+
+        async def _commit_chunk():
+            """Фиксирует порцию. Запросов внутри цикла нет (autoflush не срабатывает),
+            поэтому SQLite держит блокировку записи только на время flush + commit."""
+            if not chunk["rows"]:
+                return
+
+            async def _timed_commit() -> int:
+                started = time.perf_counter()
+                await session.commit()
+                return int((time.perf_counter() - started) * 1000)
+
+            # При включённом едином писателе commit ждёт своей очереди, а не блокировки файла
+            held_ms = await run_serialized(_timed_commit)
+            stats["chunks"] += 1
+            stats["lock_total_ms"] += held_ms
+            stats["lock_max_ms"] = max(stats["lock_max_ms"], held_ms)
+            chunk["rows"] = 0
+            if touched_users:
+                APPOINTMENT_LIST_CACHE.invalidate(touched_users)
+                touched_users.clear()
+
+        async def _next_row():
+            if chunk["rows"] >= chunk_size:
+                await _commit_chunk()
+            chunk["rows"] += 1
+
+        def _emit(appointment: Appointment, kind: str, field: str = None, old=None, new=None):
+            session.add(AppointmentEvent(
+                appointment=appointment, kind=kind, field=field, old_value=old, new_value=new,
+            ))
+            stats["events"] += 1
+            touched_users.add(appointment.user_id)
 
         def _norm(s: str) -> str:
             return (s or "").strip()
@@ -849,26 +941,7 @@ class DikidiParser:
             """Нормализованный ключ: избегаем дубликатов при разном формате даты/пробелах."""
             return (uid, _normalize_date(_norm(d)) or _norm(d), _norm(t), _norm(ev))
 
-        # Получаем все существующие записи. Ключ нормализован — чтобы избежать дубликатов
-        # при разном формате даты (09.02 vs 9.02) или пробелах.
-        result = await session.execute(select(Appointment))
-        existing_appointments = {}
-        next_dikidi_id = 1
-        for app in result.scalars().all():
-            key = _canon_key(app.user_id, app.date or "", app.time or "", app.event or "")
-            existing_appointments[key] = app
-            if app.dikidi_id is not None and app.dikidi_id >= next_dikidi_id:
-                next_dikidi_id = app.dikidi_id + 1
-
-        # Получаем всех пользователей по телефонам (только с указанным номером — для сопоставления с Dikidi)
-        result = await session.execute(select(User))
-        users_by_phone = {
-            user.phone: user
-            for user in result.scalars().all()
-            if user.phone and user.phone.strip()
-        }
-
-        # Нормализуем телефоны в справочнике (без пробелов/скобок для сопоставления)
+        # Нормализуем телефоны (без пробелов/скобок для сопоставления)
         def norm_phone(p: str) -> str:
             if not p:
                 return ""
@@ -879,11 +952,77 @@ class DikidiParser:
                 p = "+7" + p
             return p
 
-        users_by_phone_norm = {norm_phone(p): u for p, u in users_by_phone.items()}
-
         # Привязка к Telegram — только когда пользователь напишет /start и отправит номер.
         # Записи без зарегистрированного пользователя в боте — пропускаем. После регистрации
-        # следующий цикл синхронизации подтянет их записи из Dikidi.
+        # следующий цикл синхронизации подтянет их записи из Dikidi (пользователи сменились —
+        # проход полный).
+        result = await session.execute(_USERS_QUERY)
+        users = [tuple(row) for row in result.all()]
+
+        # Сравнение с прошлой сверкой: до успешного конца сверки состояния нет (сбой — полный проход)
+        previous, self._last_sync = self._last_sync, None
+        now = self.clock.now()
+        state = _SyncState((parse_min, parse_max), users, parsed_appointments, now)
+        phones = None  # None — полный проход
+        if (
+            previous is not None
+            and previous.window == state.window
+            and previous.users == users
+            and now - previous.full_at < timedelta(minutes=Config.SYNC_FULL_EVERY_MINUTES)
+        ):
+            stats["full"] = 0
+            state = state._replace(full_at=previous.full_at)
+            if parsed_appointments == previous.appointments:
+                self._last_sync = state
+                return stats
+            # Клиенты, чьи строки появились, изменились или пропали; записи остальных уже сверены
+            changed_rows = _journal_rows(parsed_appointments) ^ _journal_rows(previous.appointments)
+            phones = {norm_phone(row[0]) for row in changed_rows}
+
+        # Пользователи с указанным номером (для сопоставления с Dikidi): телефон → id
+        users_by_phone_norm = {
+            norm_phone(phone): user_id
+            for user_id, phone in users
+            if phone and phone.strip()
+        }
+        to_sync = parsed_appointments
+        affected_users = None
+        if phones is not None:
+            affected_users = {users_by_phone_norm[p] for p in phones if p in users_by_phone_norm}
+            if not affected_users:
+                self._last_sync = state
+                return stats
+            to_sync = [
+                app_data for app_data in parsed_appointments
+                if norm_phone(app_data.get("phone") or "") in phones
+            ]
+
+        # Существующие записи окна (и строк журнала вне его), а при частичной сверке — только
+        # затронутых клиентов; без даты — всегда. Ключ нормализован — чтобы избежать дубликатов
+        # при разном формате даты (09.02 vs 9.02) или пробелах.
+        span_min, span_max = parse_min, parse_max
+        for date_str in {_norm(app_data.get("date")) for app_data in to_sync}:
+            try:
+                day = datetime.strptime(date_str, "%d.%m.%Y").date()
+            except ValueError:
+                continue
+            span_min, span_max = min(span_min, day), max(span_max, day)
+        query = select(Appointment).where(or_(
+            Appointment.starts_at.is_(None),
+            and_(
+                Appointment.starts_at >= datetime.combine(span_min, datetime.min.time()),
+                Appointment.starts_at < datetime.combine(span_max + timedelta(days=1), datetime.min.time()),
+            ),
+        ))
+        if affected_users is not None:
+            query = query.where(Appointment.user_id.in_(affected_users))
+        result = await session.execute(query)
+        existing_appointments = {}
+        for app in result.scalars().all():
+            key = _canon_key(app.user_id, app.date or "", app.time or "", app.event or "")
+            existing_appointments[key] = app
+        result = await session.execute(select(func.max(Appointment.dikidi_id)))
+        next_dikidi_id = (result.scalar() or 0) + 1
 
         # Получаем компанию (предполагаем одну компанию)
         result = await session.execute(select(Company).limit(1))
@@ -892,7 +1031,7 @@ class DikidiParser:
         if not company:
             company = Company(name=Config.COMPANY_NAME, address=Config.COMPANY_ADDRESS)
             session.add(company)
-            await session.flush()
+            await run_serialized(session.commit)  # отдельная короткая транзакция: нужен company.id
 
         parsed_keys = set()
 
@@ -904,17 +1043,19 @@ class DikidiParser:
                 o = _normalize_date(o) or o
             return n == o
 
-        for app_data in parsed_appointments:
+        for app_data in to_sync:
             if not app_data.get("phone"):
                 continue
             phone = norm_phone(app_data["phone"])
-            user = users_by_phone_norm.get(phone)
-            if not user:
+            user_id = users_by_phone_norm.get(phone)
+            if not user_id:
                 # Пропускаем — пользователь ещё не зарегистрирован в боте. Привязка при /start.
                 continue
+            stats["rows"] += 1
             event = app_data.get("event") or "Услуга"
-            key = _canon_key(user.id, app_data["date"], app_data["time"], event)
+            key = _canon_key(user_id, app_data["date"], app_data["time"], event)
             parsed_keys.add(key)
+            await _next_row()
             existing_app = existing_appointments.get(key)
             visit_status = app_data.get("visit_status") or ""
 
@@ -922,17 +1063,32 @@ class DikidiParser:
                 old_visit_status = (existing_app.visit_status or "").strip().lower()
                 new_visit_status = (visit_status or "").strip().lower()
 
-                # Обновляем поля в БД
-                existing_app.event = app_data["event"]
-                existing_app.date = app_data["date"]
-                existing_app.time = app_data["time"]
-                existing_app.master = app_data["master"]
-                existing_app.clientlink = app_data.get("clientlink") or existing_app.clientlink
-                existing_app.visit_status = visit_status
+                # Обновляем поля в БД; реальные расхождения — в журнал событий
+                new_values = {
+                    "event": app_data["event"],
+                    "date": app_data["date"],
+                    "time": app_data["time"],
+                    "master": app_data["master"],
+                    "clientlink": app_data.get("clientlink") or existing_app.clientlink,
+                    "visit_status": visit_status,
+                }
+                for field, new_val in new_values.items():
+                    old_val = getattr(existing_app, field)
+                    if not _same(new_val, old_val, normalize_date=(field == "date")):
+                        _emit(existing_app, "field_changed", field, old_val, new_val)
+                    elif new_val != old_val:
+                        # Только формат (пробелы, 9.02 → 09.02): события нет, но текст «Мои записи» другой
+                        touched_users.add(existing_app.user_id)
+                    if new_val != old_val:
+                        setattr(existing_app, field, new_val)
+                starts_at = appointment_starts_at(existing_app.date, existing_app.time)
+                if existing_app.starts_at != starts_at:
+                    existing_app.starts_at = starts_at
 
                 # Отмена — когда в Dikidi запись помечена «отменена/отменено»
                 is_canceled = "отменена" in new_visit_status or "отменено" in new_visit_status
                 if is_canceled and existing_app.status != "canceled":
+                    _emit(existing_app, "canceled", "status", existing_app.status, "canceled")
                     existing_app.status = "canceled"
                     stats["canceled"] += 1
                 # Уведомление «изменено» — ТОЛЬКО когда визит стал «завершён» (и не отменён)
@@ -942,33 +1098,29 @@ class DikidiParser:
                         and not ("завершен" in old_visit_status or "завершён" in old_visit_status)
                     )
                     if visit_just_completed:
-                        existing_app.status = "changed"
+                        _emit(existing_app, "visit_completed", "visit_status", old_visit_status, new_visit_status)
                         stats["changed"] += 1
             else:
                 new_appointment = Appointment(
                     dikidi_id=next_dikidi_id,
-                    user_id=user.id,
+                    user_id=user_id,
                     company_id=company.id,
                     event=app_data["event"],
                     date=app_data["date"],
                     time=app_data["time"],
+                    starts_at=appointment_starts_at(app_data["date"], app_data["time"]),
                     master=app_data["master"],
                     clientlink=app_data["clientlink"],
                     visit_status=visit_status,
-                    status="created",
+                    status="active",
                 )
                 session.add(new_appointment)
-                await session.flush()
+                _emit(new_appointment, "created")
                 existing_appointments[key] = new_appointment  # чтобы не дублировать в рамках этой синхронизации
                 next_dikidi_id += 1
                 stats["created"] += 1
 
         # Помечаем как отменённые ТОЛЬКО записи в диапазоне парсинга (1 нед назад + 3 нед вперёд)
-        today = datetime.now().date()
-        week_start = today - timedelta(days=today.weekday())
-        parse_min = (week_start - timedelta(days=7))
-        parse_max = (week_start + timedelta(days=6 + 14))
-
         def _date_in_range(date_str: str) -> bool:
             if not date_str:
                 return False
@@ -988,8 +1140,11 @@ class DikidiParser:
         for key, appointment in existing_appointments.items():
             if key not in parsed_keys and appointment.status != "canceled":
                 if _date_in_range(appointment.date or ""):
+                    await _next_row()
+                    _emit(appointment, "canceled", "status", appointment.status, "canceled")
                     appointment.status = "canceled"
                     stats["canceled"] += 1
-        
-        await session.commit()
+
+        await _commit_chunk()
+        self._last_sync = state
         return stats
@@ -0,0 +1,156 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import bindparam, case, select
+
+from bot.config import Config
+from bot.database.database import engine
+from bot.models.models import Notification
+from bot.services.clock import SYSTEM_CLOCK, Clock
+from bot.services.notifications import MARKETING_TYPES
+
+logger = logging.getLogger(__name__)
+
+
+def _due_at():
+    """Когда уведомление реально можно отправлять: send_at или позже, если идёт backoff"""
+    return case(
+        (Notification.next_attempt_at > Notification.send_at, Notification.next_attempt_at),
+        else_=Notification.send_at,
+    )
+
+
+class NotificationTimer:
+    """
+    Отправка уведомлений точно к сроку вместо опроса раз в минуту.
+    Задача держит кучу ближайших сроков (загружается запросом по ожидающим уведомлениям),
+    спит ровно до ближайшего, а notify() будит её раньше, если запланировано более близкое.
+    Раз в Config.NOTIFY_SWEEP_SECONDS после прошлого прохода (или запуска) — страховочный
+    проход, даже если сроков нет: куча перечитывается, а отправка идёт, если в БД есть
+    наступившие уведомления, которых в куче нет. Срок, о котором сообщили во время прохода, не теряется:
+    он переносится в перезагруженную кучу, а уже наступивший — запускает ещё один проход.
+    «Сейчас» и сон берутся из clock — тех же часов, по которым NotificationService решает, что пора.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[], Awaitable[None]],
+        sweep_seconds: int = None,
+        preload: int = 64,
+        clock: Optional[Clock] = None,
+    ):
+        self.dispatch = dispatch
+        self.clock = clock or SYSTEM_CLOCK
+        self.sweep = timedelta(seconds=sweep_seconds or Config.NOTIFY_SWEEP_SECONDS)
+        self.preload = preload
+        self._heap: List[datetime] = []
+        self._notified: List[datetime] = []  # сроки из notify() с прошлой перезагрузки кучи
+        self._due = False  # сообщили о наступившем сроке — нужен проход
+        self._target: Optional[datetime] = None
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_run: Optional[datetime] = None
+        self._sweep_from: Optional[datetime] = None  # от этого момента отсчитывается страховочный проход
+        self.runs = 0
+        # Запросы сроков собираются один раз: таймер выполняет их после каждого прохода
+        self._pending = (
+            select(_due_at())
+            .where(
+                Notification.sent == False,
+                Notification.dead == False,
+                Notification.type.notin_(MARKETING_TYPES),
+            )
+            .order_by(_due_at())
+            .limit(preload)
+        )
+        self._upcoming = self._pending.where(_due_at() > bindparam("after"))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def notify(self, when: datetime):
+        """Запланировано уведомление на when: разбудить таймер, если это раньше текущей цели"""
+        heapq.heappush(self._heap, when)
+        self._notified.append(when)
+        # Уже наступившее требует прохода, даже если строка закоммичена во время текущего прохода
+        # и её срок раньше его начала (по виртуальным часам время могло и не сдвинуться)
+        if when <= self.clock.now():
+            self._due = True
+        if self._due or self._target is None or when < self._target:
+            self._wake.set()
+
+    async def _reload(self, sweep: bool = False) -> bool:
+        """Ближайшие сроки транзакционных уведомлений из БД. Просроченные, но не отправленные в прошлый проход, не берём —
+        иначе таймер крутился бы вхолостую; их подберёт страховочный проход.
+        sweep — страховочный проход: просроченные берутся тоже; True, если среди сроков из БД есть наступившие."""
+        if sweep or self._last_run is None:
+            query, params = self._pending, {}
+        else:
+            query, params = self._upcoming, {"after": self._last_run}
+        # Только сроки, без ORM-объектов: хватает соединения (перечитывается и в каждом страховочном проходе)
+        async with engine.connect() as conn:
+            times = (await conn.execute(query, params)).scalars().all()
+        # PostgreSQL возвращает aware-время, остальной код работает с локальным naive
+        heap = [t.astimezone().replace(tzinfo=None) if t.tzinfo else t for t in times if t is not None]
+        due = bool(heap) and heap[0] <= self.clock.now()
+        # Сроки из notify() во время прохода и запроса в БД могли ещё не попасть в выборку
+        heap.extend(self._notified)
+        self._notified = []
+        heapq.heapify(heap)
+        self._heap = heap
+        return due
+
+    async def _wait(self) -> bool:
+        """Спит до ближайшего срока из кучи или notify() о наступившем; True — вместо него наступил страховочный проход"""
+        while not self._due:
+            now = self.clock.now()
+            while self._heap and self._last_run is not None and self._heap[0] <= self._last_run:
+                heapq.heappop(self._heap)
+            if self._heap and self._heap[0] <= now:
+                return False
+            sweep_at = self._sweep_from + self.sweep
+            if sweep_at <= now:
+                return True
+            self._target = min(self._heap[0], sweep_at) if self._heap else sweep_at
+            # Сон по часам сервиса: на виртуальных часах его будит симуляция
+            await self.clock.wait(self._wake, (self._target - now).total_seconds())
+            self._wake.clear()
+        return False
+
+    async def _run(self):
+        self._sweep_from = self.clock.now()
+        reload = True
+        while True:
+            try:
+                if reload:
+                    await self._reload()
+                    reload = False
+                if await self._wait() and not self._due:
+                    # Страховочный проход: куча перечитывается, а отправка — только если в БД есть
+                    # наступившие сроки (например, записанные другим экземпляром)
+                    self._sweep_from = self.clock.now()
+                    if not await self._reload(sweep=True):
+                        continue
+                # Сбрасываются до прохода: notify() во время прохода запросит следующий
+                self._wake.clear()
+                self._due = False
+                self._target = None
+                self._last_run = self._sweep_from = self.clock.now()
+                self.runs += 1
+                reload = True
+                await self.dispatch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка таймера уведомлений: {e}", exc_info=True)
+                reload = True
+                await asyncio.sleep(5)
@@ -0,0 +1,213 @@
+import time
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, Optional, Sequence, Tuple
+import logging
+
+from aiohttp import web
+
+from bot.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограммы опоздания (секунды от send_at до фактической отправки)
+LATENESS_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 4 * 3600, 24 * 3600)
+
+_PREFIX = "meownomeow"
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами: observe — двоичный поиск и пара сложений"""
+
+    def __init__(self, bounds: Sequence[float] = LATENESS_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # последняя корзина — больше всех границ
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Оценка сверху: граница корзины, в которую попадает q-я доля (inf — за последней)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return float(bound)
+        return float("inf")
+
+
+def lateness_seconds(send_at: datetime, now: datetime) -> float:
+    """Опоздание отправки относительно send_at (PostgreSQL отдаёт время с зоной, SQLite — без)"""
+    if send_at.tzinfo is not None and now.tzinfo is None:
+        now = now.astimezone()
+    return max(0.0, (now - send_at).total_seconds())
+
+
+class NotificationMetrics:
+    """
+    Метрики уведомлений в памяти процесса: гистограмма опоздания по типам, исходы отправки
+    (sent / skipped / класс ошибки) по типам и число просроченных неотправленных (due).
+    Читаются командой /stats и экспортёром Prometheus (Config.METRICS_PORT).
+    """
+
+    def __init__(self):
+        self.lateness: Dict[str, Histogram] = {}
+        self.outcomes: Counter = Counter()  # (тип, исход) → число
+        self.due: Dict[str, int] = {}
+        self.due_updated_at: Optional[datetime] = None
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self.started = time.time()
+
+    def observe_sent(self, notification_type: str, lateness: float):
+        histogram = self.lateness.get(notification_type)
+        if histogram is None:
+            histogram = self.lateness[notification_type] = Histogram()
+        histogram.observe(lateness)
+        self.outcomes[(notification_type, "sent")] += 1
+
+    def observe_skipped(self, notification_type: str):
+        self.outcomes[(notification_type, "skipped")] += 1
+
+    def observe_failure(self, notification_type: str, error: Exception):
+        self.outcomes[(notification_type, type(error).__name__)] += 1
+
+    def set_due(self, counts: Dict[str, int], now: datetime = None):
+        self.due = dict(counts)
+        self.due_updated_at = now or datetime.now()
+
+    def register_gauge(self, name: str, description: str, fn: Callable[[], float]):
+        """Показатель, читаемый в момент экспорта (например, глубина очереди отправки)"""
+        self._gauges[name] = (description, fn)
+
+    def render_text(self) -> str:
+        """Сводка для администратора (/stats)"""
+        types = sorted({t for t, _ in self.outcomes} | set(self.due))
+        lines = [f"📊 Уведомления (с запуска, {int((time.time() - self.started) // 3600)} ч)"]
+        if not types:
+            lines.append("Пока ничего не отправлялось.")
+        for notification_type in types:
+            histogram = self.lateness.get(notification_type)
+            failures = sum(
+                count for (t, outcome), count in self.outcomes.items()
+                if t == notification_type and outcome not in ("sent", "skipped")
+            )
+            late = (
+                f", опоздание p50 ≤ {_seconds(histogram.quantile(0.5))}, p95 ≤ {_seconds(histogram.quantile(0.95))}"
+                if histogram else ""
+            )
+            lines.append(
+                f"• {notification_type}: отправлено {self.outcomes[(notification_type, 'sent')]}, "
+                f"пропущено {self.outcomes[(notification_type, 'skipped')]}, ошибок {failures}, "
+                f"просрочено {self.due.get(notification_type, 0)}{late}"
+            )
+        errors = Counter()
+        for (_, outcome), count in self.outcomes.items():
+            if outcome not in ("sent", "skipped"):
+                errors[outcome] += count
+        if errors:
+            lines.append("Ошибки: " + ", ".join(f"{name} {count}" for name, count in errors.most_common()))
+        for name, (description, fn) in sorted(self._gauges.items()):
+            lines.append(f"{description}: {_gauge_value(fn):g}")
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        """Текстовый формат экспозиции Prometheus"""
+        out = [
+            f"# HELP {_PREFIX}_notification_lateness_seconds Опоздание отправки относительно send_at",
+            f"# TYPE {_PREFIX}_notification_lateness_seconds histogram",
+        ]
+        for notification_type, histogram in sorted(self.lateness.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                out.append(
+                    f'{_PREFIX}_notification_lateness_seconds_bucket{{type="{notification_type}",le="{bound}"}} {cumulative}'
+                )
+            out.append(
+                f'{_PREFIX}_notification_lateness_seconds_bucket{{type="{notification_type}",le="+Inf"}} {histogram.count}'
+            )
+            out.append(f'{_PREFIX}_notification_lateness_seconds_sum{{type="{notification_type}"}} {histogram.sum:.3f}')
+            out.append(f'{_PREFIX}_notification_lateness_seconds_count{{type="{notification_type}"}} {histogram.count}')
+        out += [
+            f"# HELP {_PREFIX}_notifications_total Исходы отправки уведомлений (sent, skipped, класс ошибки)",
+            f"# TYPE {_PREFIX}_notifications_total counter",
+        ]
+        for (notification_type, outcome), count in sorted(self.outcomes.items()):
+            out.append(f'{_PREFIX}_notifications_total{{type="{notification_type}",outcome="{outcome}"}} {count}')
+        out += [
+            f"# HELP {_PREFIX}_notifications_due Неотправленные уведомления, срок которых наступил",
+            f"# TYPE {_PREFIX}_notifications_due gauge",
+        ]
+        for notification_type, count in sorted(self.due.items()):
+            out.append(f'{_PREFIX}_notifications_due{{type="{notification_type}"}} {count}')
+        for name, (description, fn) in sorted(self._gauges.items()):
+            out += [
+                f"# HELP {_PREFIX}_{name} {description}",
+                f"# TYPE {_PREFIX}_{name} gauge",
+                f"{_PREFIX}_{name} {_gauge_value(fn):g}",
+            ]
+        return "\n".join(out) + "\n"
+
+
+def _gauge_value(fn: Callable[[], float]) -> float:
+    try:
+        return float(fn())
+    except Exception:
+        return float("nan")
+
+
+def _seconds(value: float) -> str:
+    if value == float("inf"):
+        return f">{LATENESS_BUCKETS[-1] // 3600} ч"
+    if value < 60:
+        return f"{value:g} с"
+    if value < 3600:
+        return f"{value / 60:g} мин"
+    return f"{value / 3600:g} ч"
+
+
+# Общие метрики процесса: пишет NotificationService, читают /stats и экспортёр
+METRICS = NotificationMetrics()
+
+
+class MetricsExporter:
+    """
+    HTTP-экспортёр для Prometheus: GET /metrics на Config.METRICS_HOST:Config.METRICS_PORT.
+    refresh — корутина, обновляющая метрики перед выдачей (число просроченных из БД).
+    """
+
+    def __init__(self, metrics: NotificationMetrics = None, refresh: Callable = None, host: str = None, port: int = None):
+        self.metrics = metrics or METRICS
+        self.refresh = refresh
+        self.host = host or Config.METRICS_HOST
+        self.port = Config.METRICS_PORT if port is None else port
+        self._runner = None
+
+    async def _handle(self, request):
+        if self.refresh is not None:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Метрики: не удалось обновить число просроченных: {e}")
+        return web.Response(text=self.metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Метрики Prometheus: http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -1,67 +1,73 @@
+import asyncio
+import random
 from datetime import datetime, timedelta
-from typing import List
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func, select, update, and_, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from bot.models.models import Appointment, Notification, User, Company
 from bot.database.database import get_session
+from bot.database.writer import run_write
 from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramUnauthorizedError,
+)
 from bot.config import Config
+from bot.services.clock import SYSTEM_CLOCK, Clock
+from bot.services.metrics import METRICS, NotificationMetrics, lateness_seconds
+from bot.services.send_queue import PRIORITY_MARKETING, PRIORITY_TRANSACTIONAL, SendQueue, TokenBucket
+from bot.services.templates import TemplateRegistry, get_templates
+from bot.services.user_cache import USER_CACHE
+
+# Полосы отправки: транзакционные (время важно) и маркетинговые (отзывы, повторная запись)
+LANE_TRANSACTIONAL = "transactional"
+LANE_MARKETING = "marketing"
+MARKETING_TYPES = ("after_visit", "rebook_14")
 
 
 class NotificationService:
-    def __init__(self, bot: Bot):
+    def __init__(
+        self,
+        bot: Bot,
+        send_queue: Optional[SendQueue] = None,
+        templates: Optional[TemplateRegistry] = None,
+        clock: Optional[Clock] = None,
+        metrics: Optional[NotificationMetrics] = None,
+    ):
         self.bot = bot
+        # Текущее время; в симуляции — виртуальные часы
+        self.clock = clock or SYSTEM_CLOCK
+        # Опоздание и исходы отправки по типам (/stats, экспортёр Prometheus)
+        self.metrics = metrics or METRICS
+        # Тексты уведомлений, скомпилированные один раз
+        self.templates = templates or get_templates()
+        # Очередь с ограничением скорости; без неё — прямые последовательные вызовы бота
+        self.send_queue = send_queue
+        # Собственный лимит маркетинговой полосы — поверх общего лимита очереди
+        self.marketing_bucket = TokenBucket(Config.MARKETING_RATE_PER_SEC)
+        # Вызывается с send_at каждого нового/перенесённого уведомления (таймер отправки)
+        self.on_scheduled: Optional[Callable[[datetime], None]] = None
+        # Вызывается для каждого доставленного уведомления (статистика, симуляция)
+        self.on_delivered: Optional[Callable[[Notification], None]] = None
+
+    def _scheduled(self, send_at: datetime):
+        if self.on_scheduled is not None:
+            self.on_scheduled(send_at)
     
     async def create_notification(self, appointment: Appointment, notification_type: str, send_at: datetime, once_only: bool = False):
         """
         Создает уведомление в базе данных (если его еще нет).
         once_only: для canceled/created/changed — не создавать, если уже было когда-либо.
         """
-        async with get_session() as session:
-            # Для «разовых» типов — не дублировать, если уже было
-            if once_only:
-                r = await session.execute(
-                    select(Notification).where(
-                        and_(
-                            Notification.appointment_id == appointment.id,
-                            Notification.type == notification_type
-                        )
-                    )
-                )
-                if r.scalars().first():
-                    return
-            # Проверяем, нет ли уже ожидающего уведомления
-            result = await session.execute(
-                select(Notification).where(
-                    and_(
-                        Notification.appointment_id == appointment.id,
-                        Notification.type == notification_type,
-                        Notification.sent == False
-                    )
-                )
-            )
-            existing = result.scalar_one_or_none()
-            
-            if existing:
-                # Обновляем время отправки, если оно изменилось
-                if existing.send_at != send_at:
-                    existing.send_at = send_at
-                    await session.commit()
-                return
-            
-            notification = Notification(
-                appointment_id=appointment.id,
-                type=notification_type,
-                send_at=send_at,
-                sent=False
-            )
-            session.add(notification)
-            try:
-                await session.commit()
-            except IntegrityError:
-                await session.rollback()
-                return  # Дубликат — уникальный индекс (appointment_id, type)
+        rows = [{"appointment_id": appointment.id, "type": notification_type, "send_at": send_at}]
+        await run_write(_upsert_notifications(rows, force_once_only=once_only))
+        if notification_type not in MARKETING_TYPES:
+            self._scheduled(send_at)
     
     def _should_skip_reminders(self, appointment: Appointment) -> bool:
         """Пропускать напоминания: визит завершён, отменён или удалён"""
@@ -79,77 +85,104 @@ class NotificationService:
         s = status.lower()
         return "завершен" in s or "завершён" in s
 
-    async def schedule_appointment_notifications(self, appointment: Appointment):
-        """Планирует уведомления. Не уведомляет о старых записях (дата уже прошла)."""
-        try:
-            # 1. Отменена — только уведомление об отмене
-            if appointment.status == "canceled":
-                await self.create_notification(
-                    appointment, "canceled", datetime.now(), once_only=True
-                )
-                return
-
-            appointment_datetime = self._parse_appointment_datetime(appointment.date, appointment.time)
-            if not appointment_datetime:
-                return
-
-            now = datetime.now()
-            is_past = appointment_datetime < now
-
-            # 2. Новая запись — только если дата в будущем (не старые записи)
-            if appointment.status == "created":
-                if not is_past:
-                    await self.create_notification(
-                        appointment, "created", datetime.now(), once_only=True
-                    )
-                return
-
-            # 3. Визит завершён (changed) — after_visit (2ч после, только для недавних) + rebook_14 (через 14 дней)
-            # Не уведомляем о старых записях — только если визит был не более 7 дней назад
-            if appointment.status == "changed" and self._is_visit_completed(appointment):
-                days_since_visit = (now - appointment_datetime).days
-                # after_visit — только для недавних визитов, один раз
-                if days_since_visit <= 7:
-                    after_visit_time = max(
-                        appointment_datetime + timedelta(hours=2),
-                        now
-                    )
-                    await self.create_notification(
-                        appointment, "after_visit", after_visit_time, once_only=True
-                    )
-                # rebook_14 — через 14 дней после визита, напоминание записаться снова
-                rebook_time = appointment_datetime + timedelta(days=14)
-                if rebook_time > now:
-                    await self.create_notification(
-                        appointment, "rebook_14", rebook_time, once_only=True
-                    )
-                return
-
-            # 4. Активные записи (не завершённые) — напоминания, только если дата в будущем
-            if is_past:
-                return
-
-            if self._should_skip_reminders(appointment):
-                return
-
-            day_before_time = appointment_datetime - timedelta(days=1)
-            if day_before_time > now:
-                await self.create_notification(
-                    appointment, "day_before", day_before_time
-                )
-            reminder_time = appointment_datetime - timedelta(hours=3)
-            if reminder_time > now:
-                await self.create_notification(
-                    appointment, "reminder", reminder_time
-                )
-            confirmation_time = appointment_datetime - timedelta(days=14)
-            if confirmation_time > now:
-                await self.create_notification(
-                    appointment, "confirmation", confirmation_time
-                )
+    async def schedule_appointment_notifications(self, appointment: Appointment, event_kind: str = None):
+        """
+        Планирует уведомления по событию записи (AppointmentEvent.kind):
+        created / visit_completed / canceled; без события или при переносе (field_changed
+        даты/времени) — только напоминания, уже запланированные переносятся на новое время.
+        Не уведомляет о старых записях (дата уже прошла).
+        """
+        await self.schedule_notifications([(appointment, event_kind)])
 
+    async def schedule_notifications(self, items: Iterable[Tuple[Appointment, Optional[str]]]) -> int:
+        """
+        Пакетное планирование: строки (appointment_id, type, send_at) для всех записей
+        считаются в памяти и пишутся одним INSERT ... ON CONFLICT на порцию.
+        Перенос (field_changed) закрывает напоминания, которые для нового времени уже не нужны
+        (их срок прошёл): иначе они ушли бы по старому send_at, возможно — после визита.
+        Возвращает число рассчитанных строк. Ошибка записи в БД пробрасывается —
+        вызывающий не должен считать события обработанными.
+        """
+        now = self.clock.now()
+        # Несколько событий одной записи (перенос даты и времени) дают одну строку на тип
+        planned = {}
+        stale = set()
+        for appointment, event_kind in items:
+            try:
+                plan = self._plan_notifications(appointment, event_kind, now)
+                for notification_type, send_at in plan:
+                    planned[(appointment.id, notification_type)] = send_at
+                if event_kind == "field_changed":
+                    kept = {notification_type for notification_type, _ in plan}
+                    stale.update((appointment.id, t) for t in _REMINDER_TYPES if t not in kept)
+            except Exception as e:
+                print(f"Ошибка при планировании уведомлений: {e}")
+        stale = sorted(stale - planned.keys())
+        rows = [
+            {"appointment_id": appointment_id, "type": notification_type, "send_at": send_at}
+            for (appointment_id, notification_type), send_at in planned.items()
+        ]
+        try:
+            for i in range(0, len(rows), _UPSERT_CHUNK):
+                await run_write(_upsert_notifications(rows[i:i + _UPSERT_CHUNK]))
+            for i in range(0, len(stale), _SQLITE_MAX_VARIABLES):
+                await run_write(_close_stale_reminders(stale[i:i + _SQLITE_MAX_VARIABLES]))
         except Exception as e:
             print(f"Ошибка при планировании уведомлений: {e}")
+            raise
+        # Таймеру достаточно ближайшего срока — остальные он дочитает из БД;
+        # маркетинговые отправляет отдельная периодическая задача
+        transactional = [r["send_at"] for r in rows if r["type"] not in MARKETING_TYPES]
+        if transactional:
+            self._scheduled(min(transactional))
+        return len(rows)
+
+    def _plan_notifications(self, appointment: Appointment, event_kind: Optional[str], now: datetime) -> List[Tuple[str, datetime]]:
+        """Какие уведомления (тип, время отправки) нужны записи по событию"""
+        # 1. Отменена — только уведомление об отмене
+        if event_kind == "canceled":
+            return [("canceled", now)]
+        if appointment.status == "canceled":
+            return []
+
+        appointment_datetime = self._parse_appointment_datetime(appointment.date, appointment.time)
+        if not appointment_datetime:
+            return []
+
+        is_past = appointment_datetime < now
+        planned = []
+
+        # 2. Новая запись — только если дата в будущем (не старые записи), далее напоминания
+        if event_kind == "created" and not is_past:
+            planned.append(("created", now))
+
+        # 3. Визит завершён — after_visit (2ч после, только для недавних) + rebook_14 (через 14 дней)
+        # Не уведомляем о старых записях — только если визит был не более 7 дней назад
+        if event_kind == "visit_completed" and self._is_visit_completed(appointment):
+            days_since_visit = (now - appointment_datetime).days
+            # after_visit — только для недавних визитов, один раз
+            if days_since_visit <= 7:
+                after_visit_time = max(appointment_datetime + timedelta(hours=2), now)
+                planned.append(("after_visit", _marketing_send_at(after_visit_time, appointment.id)))
+            # rebook_14 — через 14 дней после визита, напоминание записаться снова
+            rebook_time = appointment_datetime + timedelta(days=14)
+            if rebook_time > now:
+                planned.append(("rebook_14", _marketing_send_at(rebook_time, appointment.id)))
+            return planned
+
+        # 4. Активные записи (не завершённые) — напоминания, только если дата в будущем
+        if is_past or self._should_skip_reminders(appointment):
+            return planned
+
+        # Напоминания (_REMINDER_TYPES)
+        for notification_type, send_at in (
+            ("day_before", appointment_datetime - timedelta(days=1)),
+            ("reminder", appointment_datetime - timedelta(hours=3)),
+            ("confirmation", appointment_datetime - timedelta(days=14)),
+        ):
+            if send_at > now:
+                planned.append((notification_type, send_at))
+        return planned
     
     def _parse_appointment_datetime(self, date_str: str, time_str: str) -> datetime:
         """Парсит дату и время из строк в datetime"""
@@ -185,192 +218,524 @@ class NotificationService:
             print(f"Ошибка при парсинге даты/времени: {e}")
             return None
     
-    async def send_notification(self, notification: Notification):
-        """Отправляет уведомление пользователю"""
-        async with get_session() as session:
+    def _dispatch_select(self):
+        """Уведомление вместе с записью, клиентом и салоном — одним запросом"""
+        return (
+            select(Notification, Appointment, User, Company)
+            .join(Appointment, Notification.appointment_id == Appointment.id)
+            .join(User, Appointment.user_id == User.id)
+            .join(Company, Appointment.company_id == Company.id)
+        )
+
+    def _due_select(self, now: datetime, lane: str = LANE_TRANSACTIONAL):
+        """Ожидающие уведомления полосы lane со сроком до now (частичный индекс ix_notifications_due)"""
+        if lane == LANE_MARKETING:
+            lane_filter = Notification.type.in_(MARKETING_TYPES)
+        else:
+            lane_filter = Notification.type.notin_(MARKETING_TYPES)
+        return self._dispatch_select().where(
+            Notification.sent == False,
+            Notification.send_at <= now,
+            Notification.dead == False,
+            or_(Notification.next_attempt_at.is_(None), Notification.next_attempt_at <= now),
+            User.is_reachable == True,
+            lane_filter,
+        )
+
+    def _should_skip_delivery(self, notification: Notification, appointment: Appointment, user: User) -> bool:
+        """Уведомление не отправляется, но закрывается как отправленное"""
+        # Не отправляем пользователям с telegram_id < 0
+        if user.telegram_id < 0:
+            return True
+        # Не отправлять, если запись отменена
+        app_status = getattr(appointment, "status", "") or ""
+        if app_status == "canceled" and notification.type in ("after_visit", "rebook_14", "day_before", "reminder", "confirmation"):
+            return True
+        # Напоминания (day_before, reminder, confirmation) — пропускать для завершённых/отменённых
+        if notification.type in ("day_before", "reminder", "confirmation"):
+            return self._should_skip_reminders(appointment)
+        return False
+
+    async def _deliver_group(self, rows: list, lane: str = LANE_TRANSACTIONAL) -> List[Optional[Exception]]:
+        """
+        Отправляет уведомления одного клиента одним сообщением (или несколькими,
+        если не влезают в лимит Telegram). Для каждого уведомления: None — можно пометить sent
+        (отправлено или не требуется), иначе — ошибка отправки его части.
+        """
+        errors: List[Optional[Exception]] = [None] * len(rows)
+        owners = []
+        for i, (notification, appointment, user, _) in enumerate(rows):
+            if self._should_skip_delivery(notification, appointment, user):
+                self.metrics.observe_skipped(notification.type)
+            else:
+                owners.append(i)
+        if not owners:
+            return errors
+        try:
+            # Тексты уведомлений — одним пакетом по скомпилированным шаблонам
+            texts = self.templates.render_many(
+                (rows[i][0].type, rows[i][1], rows[i][3]) for i in owners
+            )
+        except Exception as e:
+            print(f"Ошибка при отправке уведомления: {e}")
+            for i in owners:
+                errors[i] = e
+                self.metrics.observe_failure(rows[i][0].type, e)
+            return errors
+        chat_id = rows[0][2].telegram_id
+        priority = PRIORITY_MARKETING if lane == LANE_MARKETING else PRIORITY_TRANSACTIONAL
+        for members, text in _pack_messages(texts):
             try:
-                # Перезагружаем уведомление из базы
-                result = await session.execute(
-                    select(Notification).where(Notification.id == notification.id)
-                )
-                notification = result.scalar_one_or_none()
-                
-                if not notification or notification.sent:
-                    return
-                
-                # Получаем запись с связанными данными
-                result = await session.execute(
-                    select(Appointment, User, Company)
-                    .join(User)
-                    .join(Company)
-                    .where(Appointment.id == notification.appointment_id)
-                )
-                row = result.first()
-                
-                if not row:
-                    return
-                
-                appointment, user, company = row
-                
-                if not appointment or not user:
-                    return
-                # Не отправляем пользователям с telegram_id < 0
-                if user.telegram_id < 0:
-                    notification.sent = True
-                    await session.commit()
-                    return
-
-                # Не отправлять, если запись отменена
-                app_status = getattr(appointment, "status", "") or ""
-                if app_status == "canceled" and notification.type in ("after_visit", "rebook_14", "day_before", "reminder", "confirmation"):
-                    notification.sent = True
-                    await session.commit()
-                    return
-                # Напоминания (day_before, reminder, confirmation) — пропускать для завершённых/отменённых
-                if notification.type in ("day_before", "reminder", "confirmation"):
-                    if self._should_skip_reminders(appointment):
-                        notification.sent = True
-                        await session.commit()
-                        return
-
-                # Формируем текст уведомления
-                text = self._format_notification_text(
-                    notification.type, appointment, company
-                )
-                
+                if lane == LANE_MARKETING:
+                    # Маркетинг входит в общую очередь не быстрее своего лимита
+                    await self.marketing_bucket.acquire()
                 # Отправляем сообщение
-                await self.bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=text,
-                    parse_mode="HTML"
-                )
-                
-                # Помечаем уведомление как отправленное
-                notification.sent = True
-                await session.commit()
-                
+                await self._send_message(chat_id, text, priority)
             except Exception as e:
                 print(f"Ошибка при отправке уведомления: {e}")
-    
-    def _escape_html(self, s: str) -> str:
-        """Экранирует HTML для parse_mode=HTML"""
-        if not s:
-            return ""
-        return str(s).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+                for m in members:
+                    errors[owners[m]] = e
+                    self.metrics.observe_failure(rows[owners[m]][0].type, e)
+            else:
+                now = self.clock.now()
+                for m in members:
+                    notification = rows[owners[m]][0]
+                    self.metrics.observe_sent(notification.type, lateness_seconds(notification.send_at, now))
+                    if self.on_delivered is not None:
+                        self.on_delivered(notification)
+        return errors
 
-    def _format_notification_text(self, notification_type: str, appointment: Appointment, company: Company) -> str:
-        """Форматирует текст уведомления в зависимости от типа"""
-        e = self._escape_html
-        address = Config.COMPANY_ADDRESS or (company.address if company else "")
-        if notification_type == "created":
-            return (
-                f"✅ <b>Вы записаны!</b>\n\n"
-                f"🎯 Услуга: {e(appointment.event)}\n"
-                f"📅 Дата: {e(appointment.date)}\n"
-                f"⏰ Время: {e(appointment.time)}\n"
-                f"👤 Мастер: {e(appointment.master)}\n"
-                f"📍 Адрес: {e(address)}\n\n"
-                f"🔗 Посмотреть запись: {appointment.clientlink}\n\n"
-                f"✨ Салон «{e(company.name)}»"
-            )
-        
-        elif notification_type == "changed":
-            return (
-                f"⚠️ <b>Ваша запись изменена</b>\n\n"
-                f"Новые данные:\n\n"
-                f"🎯 Услуга: {e(appointment.event)}\n"
-                f"📅 Дата: {e(appointment.date)}\n"
-                f"⏰ Время: {e(appointment.time)}\n"
-                f"👤 Мастер: {e(appointment.master)}\n"
-                f"📍 Адрес: {e(address)}\n\n"
-                f"🔗 Посмотреть запись: {appointment.clientlink}\n\n"
-                f"✨ Салон «{e(company.name)}»"
-            )
-        
-        elif notification_type == "canceled":
-            return (
-                f"❌ <b>Запись отменена или удалена</b>\n\n"
-                f"🎯 Услуга: {e(appointment.event)}\n"
-                f"📅 Дата: {e(appointment.date)}\n"
-                f"⏰ Время: {e(appointment.time)}\n"
-                f"📍 Адрес: {e(address)}\n\n"
-                f"💬 Для новой записи свяжитесь с салоном «{e(company.name)}»"
-            )
-        
-        elif notification_type == "day_before":
-            return (
-                f"📅 <b>Напоминание</b>\n\n"
-                f"Завтра вас ждут в салоне!\n\n"
-                f"🎯 Услуга: {e(appointment.event)}\n"
-                f"📅 Дата: {e(appointment.date)}\n"
-                f"⏰ Время: {e(appointment.time)}\n"
-                f"👤 Мастер: {e(appointment.master)}\n"
-                f"📍 Адрес: {e(address)}\n\n"
-                f"✨ Салон «{e(company.name)}»"
+    async def _coalesce(self, rows: list, now: datetime, lane: str = LANE_TRANSACTIONAL) -> List[list]:
+        """
+        Группирует порцию по клиенту (telegram_id) и добавляет все его свободные уведомления
+        со сроком до now + Config.NOTIFY_COALESCE_SECONDS — и уже наступившие, которые
+        попали бы в следующие порции, и ближайшие будущие: всё, что клиенту пора получить,
+        уходит одним сообщением. Строки порции уже в аренде и повторно не берутся.
+        """
+        groups: Dict[int, list] = {}
+        for row in rows:
+            groups.setdefault(row[2].telegram_id, []).append(row)
+        window = Config.NOTIFY_COALESCE_SECONDS
+        if window > 0 and rows:
+            user_ids = {row[2].id for row in rows}
+            early = await self._claim(
+                self._due_select(now + timedelta(seconds=window), lane)
+                .where(User.id.in_(user_ids))
             )
-        
-        elif notification_type == "reminder":
-            return (
-                f"⏰ <b>Напоминание</b>\n\n"
-                f"Сегодня у вас запись:\n\n"
-                f"🎯 {e(appointment.event)}\n"
-                f"👤 Мастер: {e(appointment.master)}\n"
-                f"📍 Адрес: {e(address)}\n\n"
-                f"Ждём вас! ✨"
+            for row in early:
+                groups[row[2].telegram_id].append(row)
+        return list(groups.values())
+
+    async def _claim(self, query, limit: Optional[int] = None) -> list:
+        """
+        Берёт в аренду до limit уведомлений из query (_dispatch_select с условиями) и возвращает
+        их строки. Аренда на Config.NOTIFY_LEASE_SECONDS: другие экземпляры бота на той же БД
+        эти уведомления не возьмут, а после падения владельца они снова станут доступны.
+        """
+        now = self.clock.now()
+        until = now + timedelta(seconds=Config.NOTIFY_LEASE_SECONDS)
+        ids = await run_write(_claim_notifications(query, limit, Config.INSTANCE_ID, now, until))
+        if not ids:
+            return []
+        async with get_session() as session:
+            result = await session.execute(
+                self._dispatch_select()
+                .where(Notification.id.in_(ids), Notification.claimed_by == Config.INSTANCE_ID)
+                .order_by(Notification.send_at, Notification.id)
             )
-        
-        elif notification_type == "confirmation":
-            return (
-                f"📅 <b>Подтверждение записи</b>\n\n"
-                f"Вы записаны на:\n\n"
-                f"🎯 Услуга: {e(appointment.event)}\n"
-                f"📅 Дата: {e(appointment.date)}\n"
-                f"⏰ Время: {e(appointment.time)}\n"
-                f"👤 Мастер: {e(appointment.master)}\n"
-                f"📍 Адрес: {e(address)}\n\n"
-                f"🔗 Подтвердите запись: {appointment.clientlink}\n\n"
-                f"✨ Салон «{e(company.name)}»"
+            return result.all()
+
+    async def _record_outcomes(self, rows: list, errors: List[Optional[Exception]], now: datetime):
+        """Один UPDATE на отправленные и одно пакетное обновление попыток для неудачных"""
+        done_ids = [row[0].id for row, error in zip(rows, errors) if error is None]
+        retries = [_retry_values(row[0], error, now) for row, error in zip(rows, errors) if error is not None]
+        if done_ids:
+            await run_write(_mark_sent(done_ids))
+        if retries:
+            await run_write(_mark_failed(retries))
+            types = {row[0].id: row[0].type for row in rows}
+            for r in retries:
+                if r["next_attempt_at"] is not None and types[r["id"]] not in MARKETING_TYPES:
+                    self._scheduled(r["next_attempt_at"])
+            dead = sum(1 for r in retries if r["dead"])
+            if dead:
+                print(f"Уведомлений в dead-letter: {dead}")
+        # Бот заблокирован / чат не найден — клиент недоступен, его очередь закрывается целиком
+        unreachable = {
+            row[2].id for row, error in zip(rows, errors)
+            if error is not None and _is_unreachable_error(error)
+        }
+        if unreachable:
+            await run_write(_mark_users_unreachable(sorted(unreachable), now))
+            for row in rows:
+                if row[2].id in unreachable:
+                    USER_CACHE.update(row[2].telegram_id, is_reachable=False)
+            print(f"Клиентов недоступно (бот заблокирован): {len(unreachable)}")
+
+    async def _send_message(self, chat_id: int, text: str, priority: int = PRIORITY_TRANSACTIONAL):
+        if self.send_queue is not None:
+            return await self.send_queue.send(chat_id, text, priority=priority, parse_mode="HTML")
+        return await self.bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+
+    async def send_notification(self, notification: Notification):
+        """Отправляет одно уведомление пользователю (вне пакетной обработки)"""
+        try:
+            claimed = await self._claim(
+                self._dispatch_select().where(
+                    Notification.id == notification.id,
+                    Notification.sent == False,
+                ),
+                1,
             )
-        
-        elif notification_type == "after_visit":
-            return (
-                f"🙏 <b>Спасибо за посещение!</b>\n\n"
-                f"Будем рады видеть вас снова ✨\n\n"
-                f"📝 <b>Оставьте отзыв</b> — нам будет приятно:\n\n"
-                f"🗺 Яндекс.Карты:\n{Config.YANDEX_REVIEW_URL}\n\n"
-                f"🗺 2GIS:\nhttps://2gis.ru/tomsk/reviews/70000001087746231/addReview?utm_source=lk\n\n"
-                f"💙 ВКонтакте:\n{Config.VK_GROUP_URL}?w=app6326142_-224655267\n\n"
-                f"📱 Dikidi:\nhttps://dikidi.net/1993359?p=0.pi\n\n"
-                f"✨ Салон «{e(company.name)}»"
+            if claimed:
+                row = claimed[0]
+                lane = LANE_MARKETING if row[0].type in MARKETING_TYPES else LANE_TRANSACTIONAL
+                await self._record_outcomes([row], await self._deliver_group([row], lane), self.clock.now())
+        except Exception as e:
+            print(f"Ошибка при отправке уведомления: {e}")
+    
+    def _format_notification_text(self, notification_type: str, appointment: Appointment, company: Company) -> str:
+        """Форматирует текст уведомления в зависимости от типа (шаблоны bot/templates)"""
+        return self.templates.render(notification_type, appointment, company)
+    
+    async def process_pending_notifications(self, lane: str = LANE_TRANSACTIONAL):
+        """
+        Обрабатывает все ожидающие уведомления полосы lane порциями (Config.NOTIFY_BATCH_SIZE):
+        аренда порции (_claim), отправка, затем один UPDATE sent = true на порцию.
+        Уведомления одного клиента объединяются в одно сообщение (_coalesce).
+        Порции идут по ключу (send_at, id), поэтому неотправленные (ошибка) не выбираются повторно.
+        Неудачные получают следующую попытку по backoff (next_attempt_at) или уходят в dead-letter.
+        Маркетинговая полоса работает только в дневном окне, вне его — тихие часы.
+        """
+        now = self.clock.now()
+        if lane == LANE_MARKETING and not _in_marketing_window(now):
+            return
+        batch_size = max(1, Config.NOTIFY_BATCH_SIZE)
+        after = None
+        try:
+            while True:
+                query = self._due_select(now, lane)
+                if after is not None:
+                    query = query.where(tuple_(Notification.send_at, Notification.id) > after)
+                # Порция берётся в аренду: параллельные экземпляры получают разные уведомления
+                rows = await self._claim(
+                    query.order_by(Notification.send_at, Notification.id), batch_size
+                )
+                if not rows:
+                    break
+
+                # Курсор — по порции из запроса; подтянутые _coalesce уведомления уже в аренде
+                # и отправлены, следующие порции их не возьмут
+                last = rows[-1][0]
+                after = (last.send_at, last.id)
+                full = len(rows) == batch_size
+
+                groups = await self._coalesce(rows, now, lane)
+                if self.send_queue is not None and self.send_queue.running:
+                    # Вся порция сразу в очередь: воркеры отправляют с учётом лимитов и приоритета
+                    results = await asyncio.gather(*(self._deliver_group(g, lane) for g in groups))
+                else:
+                    results = [await self._deliver_group(g, lane) for g in groups]
+                rows = [row for g in groups for row in g]
+                errors = [error for r in results for error in r]
+                await self._record_outcomes(rows, errors, now)
+
+                if not full:
+                    break
+        except Exception as e:
+            print(f"Ошибка при обработке уведомлений: {e}")
+
+
+async def count_due(now: datetime = None) -> Dict[str, int]:
+    """Неотправленные уведомления по типам, которым пора уйти (gauge для /stats и экспортёра)"""
+    now = now or datetime.now()
+    async with get_session() as session:
+        rows = (await session.execute(
+            select(Notification.type, func.count(Notification.id))
+            .join(Appointment, Notification.appointment_id == Appointment.id)
+            .join(User, Appointment.user_id == User.id)
+            .where(
+                Notification.sent == False,
+                Notification.send_at <= now,
+                Notification.dead == False,
+                or_(Notification.next_attempt_at.is_(None), Notification.next_attempt_at <= now),
+                User.is_reachable == True,
             )
+            .group_by(Notification.type)
+        )).all()
+    return {notification_type: count for notification_type, count in rows}
+
+
+async def refresh_due_metrics(metrics: NotificationMetrics = None):
+    """Обновляет gauge просроченных перед чтением метрик"""
+    metrics = metrics or METRICS
+    now = datetime.now()
+    metrics.set_due(await count_due(now), now)
+
+
+def _marketing_window(day: datetime) -> Tuple[datetime, datetime]:
+    """Начало и конец окна маркетинговых отправок в день day"""
+    midnight = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    return (
+        midnight + timedelta(hours=Config.MARKETING_WINDOW_START),
+        midnight + timedelta(hours=Config.MARKETING_WINDOW_END),
+    )
+
+
+def _in_marketing_window(moment: datetime) -> bool:
+    start, end = _marketing_window(moment)
+    return start <= moment < end
+
+
+def _marketing_send_at(base: datetime, key: int) -> datetime:
+    """
+    Время маркетинговой отправки: не раньше base, внутри дневного окна.
+    Сдвиг зависит от key (id записи), поэтому отправки загруженного дня растягиваются
+    на Config.MARKETING_SPREAD_MINUTES, а перенесённые из тихих часов — на всё окно.
+    Последняя минута окна не используется: задача маркетинга запускается раз в минуту,
+    и срок в ней наступил бы уже после последнего запуска в окне — отправка ушла бы на утро.
+    """
+    fraction = (key * 2654435761 % 2 ** 32) / 2 ** 32
+    start, end = _marketing_window(base)
+    last = end - timedelta(minutes=1)
+    if start <= base < last:
+        spread = min(timedelta(minutes=Config.MARKETING_SPREAD_MINUTES), last - base)
+        return base + spread * fraction
+    if base >= last:
+        start, end = _marketing_window(base + timedelta(days=1))
+        last = end - timedelta(minutes=1)
+    return start + (last - start) * fraction
+
+
+# Лимит длины сообщения Telegram (в UTF-16 единицах) и разделитель объединённых уведомлений
+_MESSAGE_LIMIT = 4096
+_MESSAGE_SEPARATOR = "\n\n— — —\n\n"
+
+
+def _message_length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _split_text(text: str, limit: int) -> List[str]:
+    """Делит слишком длинный текст по строкам; строку длиннее лимита — по символам"""
+    parts, current = [], ""
+    for line in text.split("\n"):
+        while _message_length(line) > limit:
+            cut = limit
+            while _message_length(line[:cut]) > limit:
+                cut -= 1
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:cut])
+            line = line[cut:]
+        candidate = f"{current}\n{line}" if current else line
+        if current and _message_length(candidate) > limit:
+            parts.append(current)
+            candidate = line
+        current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
 
-        elif notification_type == "rebook_14":
-            return (
-                f"📅 <b>Время записаться снова!</b>\n\n"
-                f"Прошло уже 2 недели с вашего последнего визита.\n\n"
-                f"Ждём вас в салоне «{e(company.name)}» ✨\n\n"
-                f"🔗 Записаться: {Config.BOOKING_URL}"
+def _pack_messages(texts: List[str], limit: int = _MESSAGE_LIMIT) -> List[Tuple[List[int], str]]:
+    """
+    Склеивает тексты в сообщения не длиннее limit: [(индексы текстов, сообщение)].
+    Текст, который один не влезает, делится на части (_split_text).
+    """
+    messages: List[Tuple[List[int], str]] = []
+    members: List[int] = []
+    current = ""
+    for i, text in enumerate(texts):
+        if _message_length(text) > limit:
+            if members:
+                messages.append((members, current))
+                members, current = [], ""
+            messages.extend(([i], part) for part in _split_text(text, limit))
+            continue
+        candidate = f"{current}{_MESSAGE_SEPARATOR}{text}" if members else text
+        if members and _message_length(candidate) > limit:
+            messages.append((members, current))
+            members, candidate = [], text
+        members.append(i)
+        current = candidate
+    if members:
+        messages.append((members, current))
+    return messages
+
+
+# «Разовые» типы: не создаются повторно и не переносятся, если уже были когда-либо
+_ONCE_ONLY_TYPES = ("canceled", "created", "changed", "after_visit", "rebook_14")
+# Напоминания перед визитом: переносятся вместе с записью
+_REMINDER_TYPES = ("day_before", "reminder", "confirmation")
+
+# Лимит переменных в одном запросе SQLite до 3.32 (SQLITE_MAX_VARIABLE_NUMBER)
+_SQLITE_MAX_VARIABLES = 999
+# Параметры строки INSERT: appointment_id, type, send_at, sent и колонки с Python-default (attempts, dead)
+_UPSERT_COLUMNS = {"appointment_id", "type", "send_at", "sent"} | {
+    column.name for column in Notification.__table__.columns if column.default is not None
+}
+# Строк в одном INSERT — так, чтобы параметров было не больше лимита
+_UPSERT_CHUNK = _SQLITE_MAX_VARIABLES // len(_UPSERT_COLUMNS)
+
+
+def _upsert_notifications(rows: List[dict], force_once_only: bool = False):
+    """
+    Операция записи для run_write: один INSERT ... ON CONFLICT (appointment_id, type).
+    Новое уведомление вставляется; у существующего меняется send_at —
+    если оно ещё не отправлено и тип не «разовый». Отправленные и разовые не трогаются.
+    Перенос начинает отправку заново: счётчик попыток, backoff и dead-letter сбрасываются.
+    """
+    async def op(session: AsyncSession):
+        if session.bind.dialect.name == "postgresql":
+            stmt = pg_insert(Notification)
+        else:
+            stmt = sqlite_insert(Notification)
+        stmt = stmt.values([{**row, "sent": False} for row in rows])
+        conflict = [Notification.appointment_id, Notification.type]
+        if force_once_only:
+            stmt = stmt.on_conflict_do_nothing(index_elements=conflict)
+        else:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=conflict,
+                set_={
+                    "send_at": stmt.excluded.send_at,
+                    "attempts": 0,
+                    "dead": False,
+                    "next_attempt_at": None,
+                },
+                where=and_(
+                    Notification.sent == False,
+                    Notification.type.notin_(_ONCE_ONLY_TYPES),
+                    # dead — в том числе закрытое прошлым переносом, если запись вернули на то же время
+                    or_(Notification.send_at != stmt.excluded.send_at, Notification.dead == True),
+                ),
             )
+        await session.execute(stmt)
+    return op
 
-        return ""
-    
-    async def process_pending_notifications(self):
-        """Обрабатывает все ожидающие уведомления"""
-        async with get_session() as session:
-            try:
-                # Получаем все неотправленные уведомления, время которых наступило
-                result = await session.execute(
-                    select(Notification).where(
-                        and_(
-                            Notification.sent == False,
-                            Notification.send_at <= datetime.now()
-                        )
-                    )
+
+def _close_stale_reminders(keys: List[Tuple[int, str]]):
+    """
+    Операция записи для run_write: неотправленные напоминания (appointment_id, type), которые
+    после переноса записи не нужны, уходят в dead-letter. Новый перенос вернёт их (upsert сбрасывает dead).
+    """
+    async def op(session: AsyncSession):
+        by_type: Dict[str, List[int]] = {}
+        for appointment_id, notification_type in keys:
+            by_type.setdefault(notification_type, []).append(appointment_id)
+        for notification_type, appointment_ids in by_type.items():
+            await session.execute(
+                update(Notification)
+                .where(
+                    Notification.sent == False,
+                    Notification.dead == False,
+                    Notification.type == notification_type,
+                    Notification.appointment_id.in_(appointment_ids),
                 )
-                notifications = result.scalars().all()
-                
-                for notification in notifications:
-                    await self.send_notification(notification)
-                    
-            except Exception as e:
-                print(f"Ошибка при обработке уведомлений: {e}")
+                .values(dead=True, last_error="rescheduled: send time passed")
+                .execution_options(synchronize_session=False)
+            )
+    return op
+
+
+def _claim_notifications(query, limit: Optional[int], owner: str, now: datetime, until: datetime):
+    """
+    Операция записи для run_write: аренда уведомлений одним UPDATE ... WHERE id IN (SELECT ...)
+    RETURNING id. На PostgreSQL подзапрос идёт с FOR UPDATE SKIP LOCKED — строки, которые
+    прямо сейчас берёт другой экземпляр, пропускаются; в SQLite запись и так последовательна.
+    Свободны уведомления без аренды и с истёкшей арендой.
+    """
+    async def op(session: AsyncSession):
+        ids = query.with_only_columns(Notification.id).where(
+            or_(Notification.claimed_until.is_(None), Notification.claimed_until <= now)
+        )
+        if limit:
+            ids = ids.limit(limit)
+        if session.bind.dialect.name == "postgresql":
+            ids = ids.with_for_update(skip_locked=True, of=Notification)
+        result = await session.execute(
+            update(Notification)
+            .where(Notification.id.in_(ids))
+            .values(claimed_by=owner, claimed_until=until)
+            .returning(Notification.id)
+            .execution_options(synchronize_session=False)
+        )
+        return list(result.scalars().all())
+    return op
+
+
+def _mark_sent(notification_ids: List[int]):
+    """Операция записи для run_write: пометить уведомления отправленными одним UPDATE"""
+    async def op(session: AsyncSession):
+        await session.execute(
+            update(Notification)
+            .where(Notification.id.in_(notification_ids))
+            .values(sent=True, claimed_by=None, claimed_until=None)
+        )
+    return op
+
+
+# Ошибки, после которых повтор бессмыслен: сразу в dead-letter
+_PERMANENT_ERRORS = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramUnauthorizedError)
+
+
+def _retry_values(notification: Notification, error: Exception, now: datetime) -> dict:
+    """Новые значения попыток для неудачной отправки: backoff с разбросом, retry_after или dead-letter"""
+    attempts = (notification.attempts or 0) + 1
+    values = {
+        "id": notification.id,
+        "attempts": attempts,
+        "last_error": f"{type(error).__name__}: {error}"[:1000],
+        "next_attempt_at": None,
+        "dead": False,
+        # Аренда снимается: повтор может взять любой экземпляр
+        "claimed_by": None,
+        "claimed_until": None,
+    }
+    if isinstance(error, _PERMANENT_ERRORS) or attempts >= Config.NOTIFY_MAX_ATTEMPTS:
+        values["dead"] = True
+    elif isinstance(error, TelegramRetryAfter):
+        values["next_attempt_at"] = now + timedelta(seconds=error.retry_after)
+    else:
+        delay = min(Config.NOTIFY_RETRY_MAX_SECONDS, Config.NOTIFY_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+        values["next_attempt_at"] = now + timedelta(seconds=delay * random.uniform(0.5, 1.0))
+    return values
+
+
+def _mark_failed(values: List[dict]):
+    """Операция записи для run_write: попытки, ошибка и время следующей попытки (по первичному ключу)"""
+    async def op(session: AsyncSession):
+        await session.execute(update(Notification), values)
+    return op
+
+
+def _is_unreachable_error(error: Exception) -> bool:
+    """Клиент заблокировал бота / удалил аккаунт / чат не найден"""
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and "chat not found" in str(error).lower()
+
+
+def _mark_users_unreachable(user_ids: List[int], now: datetime):
+    """Операция записи для run_write: клиент недоступен, его ожидающие уведомления закрываются"""
+    async def op(session: AsyncSession):
+        await session.execute(
+            update(User)
+            .where(User.id.in_(user_ids))
+            .values(is_reachable=False, unreachable_at=now)
+        )
+        await session.execute(
+            update(Notification)
+            .where(
+                Notification.sent == False,
+                Notification.dead == False,
+                Notification.appointment_id.in_(
+                    select(Appointment.id).where(Appointment.user_id.in_(user_ids))
+                ),
+            )
+            .values(dead=True, last_error="user unreachable")
+            .execution_options(synchronize_session=False)
+        )
+    return op
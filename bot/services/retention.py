@@ -0,0 +1,164 @@
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+import logging
+
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import Config
+from bot.database.database import engine, get_session
+from bot.database.writer import run_serialized, run_write
+from bot.models.models import (
+    Appointment, AppointmentEvent, Notification,
+    ArchivedAppointment, ArchivedAppointmentEvent, ArchivedNotification,
+)
+from bot.services.appointment_list import APPOINTMENT_LIST_CACHE
+from bot.services.clock import SYSTEM_CLOCK, Clock
+
+logger = logging.getLogger(__name__)
+
+# (живая таблица, архивная) в порядке копирования; удаление — в обратном (внешние ключи)
+_ARCHIVE_PAIRS = (
+    (Appointment, ArchivedAppointment),
+    (AppointmentEvent, ArchivedAppointmentEvent),
+    (Notification, ArchivedNotification),
+)
+_LIVE_TABLES = ("appointments", "appointment_events", "notifications")
+
+
+def _visit_date(value: str) -> Optional[date]:
+    try:
+        return datetime.strptime((value or "").strip(), "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+
+class RetentionService:
+    """
+    Хранение: записи, визит по которым был больше Config.RETENTION_DAYS дней назад,
+    вместе с их событиями и уведомлениями переносятся в архивные таблицы (*_archive).
+    Перенос идёт порциями по Config.RETENTION_BATCH_SIZE, каждая порция — одна короткая
+    транзакция записи, поэтому синхронизация и отправка не ждут всю задачу.
+    Записи с неотправленными уведомлениями не трогаются. После переноса — VACUUM/ANALYZE.
+    """
+
+    def __init__(self, clock: Optional[Clock] = None):
+        self.clock = clock or SYSTEM_CLOCK
+
+    async def run(self) -> Dict[str, int]:
+        """Переносит устаревшие строки и обслуживает БД. Возвращает статистику переноса"""
+        stats = {
+            "appointments": 0, "events": 0, "notifications": 0, "batches": 0,
+            "bytes_before": 0, "bytes_after": 0, "elapsed_ms": 0,
+        }
+        if Config.RETENTION_DAYS <= 0:
+            return stats
+        started = time.perf_counter()
+        cutoff = self.clock.now().date() - timedelta(days=Config.RETENTION_DAYS)
+        batch_size = max(1, Config.RETENTION_BATCH_SIZE)
+        stats["bytes_before"] = await self._database_size()
+
+        last_id = 0
+        while True:
+            async with get_session() as session:
+                page = (await session.execute(
+                    select(Appointment.id, Appointment.date, Appointment.user_id)
+                    .where(Appointment.id > last_id)
+                    .order_by(Appointment.id)
+                    .limit(batch_size)
+                )).all()
+                if not page:
+                    break
+                last_id = page[-1][0]
+                owners = {appointment_id: user_id for appointment_id, _, user_id in page}
+                old_ids = [
+                    appointment_id for appointment_id, visit, _ in page
+                    if (_visit_date(visit) or cutoff) < cutoff
+                ]
+                if old_ids:
+                    # Неотправленное уведомление ещё может уйти (rebook_14, повтор) — такую запись оставляем
+                    pending = set((await session.execute(
+                        select(Notification.appointment_id).where(
+                            Notification.appointment_id.in_(old_ids),
+                            Notification.sent == False,
+                            Notification.dead == False,
+                        )
+                    )).scalars().all())
+                    old_ids = [i for i in old_ids if i not in pending]
+            if old_ids:
+                moved = await run_write(_archive_appointments(old_ids))
+                # Прошедшие записи пропадают из «Мои записи» этих пользователей
+                APPOINTMENT_LIST_CACHE.invalidate({owners[i] for i in old_ids})
+                for key, count in moved.items():
+                    stats[key] += count
+                stats["batches"] += 1
+
+        await self._maintain(vacuum=stats["appointments"] > 0)
+        stats["bytes_after"] = await self._database_size()
+        stats["elapsed_ms"] = int((time.perf_counter() - started) * 1000)
+        return stats
+
+    async def _maintain(self, vacuum: bool):
+        """
+        VACUUM (только если что-то перенесли) и ANALYZE вне транзакции.
+        На SQLite VACUUM пересобирает файл и возвращает место ОС; на PostgreSQL освобождает
+        место для повторного использования и обновляет статистику планировщика.
+        """
+        autocommit = engine.execution_options(isolation_level="AUTOCOMMIT")
+
+        async def _run():
+            async with autocommit.connect() as conn:
+                if conn.dialect.name == "postgresql":
+                    command = "VACUUM (ANALYZE)" if vacuum else "ANALYZE"
+                    await conn.execute(text(f"{command} {', '.join(_LIVE_TABLES)}"))
+                else:
+                    if vacuum:
+                        await conn.execute(text("VACUUM"))
+                    await conn.execute(text("ANALYZE"))
+
+        try:
+            # При включённом едином писателе обслуживание ждёт своей очереди, как commit
+            await run_serialized(_run)
+        except Exception as e:
+            logger.warning(f"Хранение: VACUUM/ANALYZE не выполнен: {e}")
+
+    async def _database_size(self) -> int:
+        """Размер БД в байтах: SQLite — страницы файла без свободных, PostgreSQL — pg_database_size"""
+        try:
+            async with engine.connect() as conn:
+                if conn.dialect.name == "postgresql":
+                    return int((await conn.execute(text("SELECT pg_database_size(current_database())"))).scalar())
+                page_size = (await conn.execute(text("PRAGMA page_size"))).scalar()
+                page_count = (await conn.execute(text("PRAGMA page_count"))).scalar()
+                return int(page_size * page_count)
+        except Exception:
+            return 0
+
+
+def _archive_appointments(appointment_ids: List[int]):
+    """
+    Операция записи для run_write: копирует записи, их события и уведомления в архивные
+    таблицы (INSERT ... SELECT) и удаляет из живых — в одной транзакции.
+    """
+    async def op(session: AsyncSession) -> Dict[str, int]:
+        keys = {
+            Appointment: Appointment.id.in_(appointment_ids),
+            AppointmentEvent: AppointmentEvent.appointment_id.in_(appointment_ids),
+            Notification: Notification.appointment_id.in_(appointment_ids),
+        }
+        for live, archive in _ARCHIVE_PAIRS:
+            # id живой строки — в original_id; у архива свой первичный ключ
+            columns = [c.name for c in archive.__table__.columns if c.name != "id" and c.name in live.__table__.columns]
+            source = live.__table__.c
+            await session.execute(
+                insert(archive).from_select(
+                    ["original_id", *columns], select(source.id, *[source[name] for name in columns]).where(keys[live])
+                )
+            )
+        moved = {}
+        for live, key in ((Notification, "notifications"), (AppointmentEvent, "events"), (Appointment, "appointments")):
+            result = await session.execute(delete(live).where(keys[live]))
+            moved[key] = result.rowcount
+        return moved
+    return op
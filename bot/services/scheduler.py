@@ -1,88 +1,208 @@
-from datetime import datetime
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from sqlalchemy.ext.asyncio import AsyncSession
 from bot.database.database import get_session
+from bot.database.writer import run_serialized
+from bot.services.clock import SYSTEM_CLOCK, Clock
 from bot.services.dikidi_parser import DikidiParser
-from bot.services.notifications import NotificationService
-from bot.models.models import Appointment, Notification
-from sqlalchemy import select, exists, and_
+from bot.services.dispatch_timer import NotificationTimer
+from bot.services.notifications import LANE_MARKETING, NotificationService
+from bot.services.retention import RetentionService
+from bot.services.send_queue import SendQueue
+from bot.services.snapshot import SnapshotStore
+from bot.config import Config
+from bot.models.models import Appointment, AppointmentEvent, User
+from sqlalchemy import select
 from aiogram import Bot
 import logging
 
 logger = logging.getLogger(__name__)
 
+# События сверки, по которым планируются уведомления
+_NOTIFY_EVENT_KINDS = ("created", "visit_completed", "canceled")
+# Изменения полей (field_changed), переносящие запись: напоминания переезжают на новое время
+_RESCHEDULE_FIELDS = ("date", "time")
+
+
+def _needs_scheduling(event: AppointmentEvent) -> bool:
+    return event.kind in _NOTIFY_EVENT_KINDS or (
+        event.kind == "field_changed" and event.field in _RESCHEDULE_FIELDS
+    )
+
 
 class SchedulerService:
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, clock: Optional[Clock] = None):
         self.scheduler = AsyncIOScheduler()
         self.bot = bot
-        self.parser = DikidiParser()
-        self.notification_service = NotificationService(bot)
+        # Одни часы на парсер и уведомления: в симуляции (simulate.py) — виртуальные
+        self.clock = clock or SYSTEM_CLOCK
+        self.parser = DikidiParser(self.clock)
+        self.send_queue = SendQueue(bot)
+        self.notification_service = NotificationService(bot, self.send_queue, clock=self.clock)
+        # Отправка точно к сроку: таймер вместо опроса раз в минуту
+        self.timer = NotificationTimer(self.process_notifications, clock=self.clock)
+        self.notification_service.on_scheduled = self.timer.notify
+        self.snapshots = SnapshotStore(clock=self.clock)
+        self.retention = RetentionService(self.clock)
+        # Могут быть необработанные события сверки (после старта — неизвестно, значит да)
+        self._events_pending = True
+        self.notification_service.metrics.register_gauge(
+            "send_queue_depth", "Сообщений в очереди отправки", lambda: self.send_queue.depth
+        )
     
     async def sync_and_schedule(self):
         """Синхронизирует записи с Dikidi и планирует уведомления"""
+        try:
+            async with get_session() as session:
+                parsed = await self.parser.parse_appointments(session)
+        except Exception as e:
+            logger.error(f"Ошибка при парсинге Dikidi: {e}", exc_info=True)
+            return
+        if parsed:
+            # Пустой результат — скорее всего сбой парсинга, прошлый снимок не затираем
+            self.snapshots.save(parsed, self.parser.parse_window())
+        await self._reconcile(parsed, None, "Синхронизация с Dikidi")
+
+    async def warm_start(self):
+        """Сверка БД со снимком последнего парсинга — до первой живой синхронизации"""
+        snapshot = self.snapshots.current
+        if snapshot is None:
+            return
+        await self._reconcile(snapshot.appointments, snapshot.window, "Сверка со снимком")
+
+    async def _reconcile(self, parsed: List[Dict], window: Optional[tuple], label: str):
+        """Сверяет записи с БД и планирует уведомления по изменениям"""
         async with get_session() as session:
             try:
+                # Пока события не обработаны, флаг поднят: сбой сверки после коммита порций их не потеряет
+                pending, self._events_pending = self._events_pending, True
                 # Синхронизируем записи
-                stats = await self.parser.sync_appointments(session)
-                logger.info(f"Синхронизация с Dikidi: создано {stats['created']}, изменено {stats['changed']}, отменено {stats['canceled']}")
-                
-                # Только записи БЕЗ уже созданного уведомления этого типа (created/changed/canceled)
-                has_notification = exists().where(
-                    Notification.appointment_id == Appointment.id,
-                    Notification.type == Appointment.status
+                stats = await self.parser.sync_appointments(session, parsed, window)
+                logger.info(
+                    f"{label}: создано {stats['created']}, изменено {stats['changed']}, отменено {stats['canceled']}, событий {stats['events']}; "
+                    f"сверено строк {stats['rows']} ({'полная' if stats['full'] else 'по изменениям'}), "
+                    f"транзакций {stats['chunks']}, блокировка макс. {stats['lock_max_ms']} мс, "
+                    f"всего {stats['lock_total_ms']} мс"
                 )
+                
+                # Сверка без событий, когда необработанных не осталось, — запрос не нужен
+                if not stats["events"] and not pending:
+                    self._events_pending = False
+                    return
+
+                # Необработанные события сверки — по индексу (processed, id), без сканирования записей
                 result = await session.execute(
-                    select(Appointment).where(
-                        and_(
-                            Appointment.status.in_(["created", "changed", "canceled"]),
-                            ~has_notification
-                        )
-                    )
+                    select(AppointmentEvent, Appointment, User.is_reachable)
+                    .join(Appointment, AppointmentEvent.appointment_id == Appointment.id)
+                    .join(User, Appointment.user_id == User.id)
+                    .where(AppointmentEvent.processed == False)
+                    .order_by(AppointmentEvent.id)
                 )
-                appointments = result.scalars().unique().all()
-                
-                # Планируем уведомления для каждой записи
-                for appointment in appointments:
-                    await self.notification_service.schedule_appointment_notifications(appointment)
-                    # Сбрасываем статус (кроме canceled — отмена остаётся)
-                    if appointment.status in ("created", "changed"):
-                        appointment.status = "active"
-                if appointments:
-                    await session.commit()
+                rows = result.all()
+
+                # Планируем уведомления по всем событиям одним пакетом (из field_changed — только перенос
+                # даты/времени); клиентам, заблокировавшим бота, ничего не планируем. Если запись
+                # уведомлений не удалась, исключение оставляет события необработанными до следующей сверки
+                await self.notification_service.schedule_notifications(
+                    (appointment, event.kind)
+                    for event, appointment, is_reachable in rows
+                    if _needs_scheduling(event) and is_reachable
+                )
+                for event, _, _ in rows:
+                    event.processed = True
+                if rows:
+                    await run_serialized(session.commit)
+                self._events_pending = False
                 
             except Exception as e:
                 logger.error(f"Ошибка при синхронизации с Dikidi: {e}", exc_info=True)
     
     async def process_notifications(self):
         """Обрабатывает ожидающие уведомления"""
+        handled = self.send_queue.sent + self.send_queue.failed
         await self.notification_service.process_pending_notifications()
+        if self.send_queue.sent + self.send_queue.failed != handled:
+            logger.info(f"Очередь отправки: {self.send_queue.stats()}")
+
+    async def process_marketing(self):
+        """Маркетинговая полоса (after_visit, rebook_14): отдельно от таймера, в дневном окне,
+        поэтому её отправки никогда не задерживают напоминания и отмены"""
+        await self.notification_service.process_pending_notifications(LANE_MARKETING)
+
+    async def run_retention(self):
+        """Переносит старые записи и уведомления в архив и обслуживает БД (VACUUM/ANALYZE)"""
+        try:
+            stats = await self.retention.run()
+        except Exception as e:
+            logger.error(f"Ошибка задачи хранения: {e}", exc_info=True)
+            return
+        logger.info(
+            f"Хранение: в архив записей {stats['appointments']}, событий {stats['events']}, "
+            f"уведомлений {stats['notifications']} ({stats['batches']} порций); "
+            f"размер БД {stats['bytes_before'] // 1024} → {stats['bytes_after'] // 1024} КБ, "
+            f"{stats['elapsed_ms']} мс"
+        )
     
     def start(self):
         """Запускает планировщик"""
-        # Синхронизация каждые 10 минут (первый запуск — сразу при старте)
+        now = datetime.now()
+        first_sync = now
+        snapshot = self.snapshots.load()
+        if snapshot is not None:
+            logger.info(
+                f"Загружен снимок парсинга: {len(snapshot.appointments)} записей, "
+                f"возраст {int(snapshot.age_seconds(self.clock.now()))} с, окно {snapshot.window[0]} — {snapshot.window[1]}"
+            )
+            self.scheduler.add_job(
+                self.warm_start,
+                id="warm_start",
+                replace_existing=True,
+                next_run_time=now,
+            )
+            # Журнал уже есть — живой парсинг не конкурирует со стартом polling
+            first_sync = now + timedelta(
+                seconds=Config.SYNC_FIRST_RUN_DELAY + random.uniform(0, Config.SYNC_FIRST_RUN_JITTER)
+            )
+
+        # Синхронизация каждые 10 минут (первый запуск — сразу, либо с задержкой при наличии снимка)
         self.scheduler.add_job(
             self.sync_and_schedule,
             IntervalTrigger(minutes=10),
             id="sync_appointments",
             replace_existing=True,
-            next_run_time=datetime.now(),  # Запуск сразу, не ждать 15 минут
+            next_run_time=first_sync,
             misfire_grace_time=300,
         )
-        
-        # Обработка уведомлений каждую минуту
+
+        # Маркетинговые уведомления — раз в минуту, только в окне Config.MARKETING_WINDOW_*
         self.scheduler.add_job(
-            self.process_notifications,
+            self.process_marketing,
             IntervalTrigger(minutes=1),
-            id="process_notifications",
+            id="process_marketing",
             replace_existing=True,
-            next_run_time=datetime.now(),
         )
+
+        # Архивация и VACUUM/ANALYZE — раз в сутки ночью, вне рассылок и активности клиентов
+        if Config.RETENTION_DAYS > 0:
+            self.scheduler.add_job(
+                self.run_retention,
+                CronTrigger(hour=Config.RETENTION_HOUR, minute=30),
+                id="retention",
+                replace_existing=True,
+                misfire_grace_time=3600,
+            )
         
+        self.send_queue.start()
+        self.timer.start()
         self.scheduler.start()
-        logger.info("Планировщик запущен! Первая синхронизация с Dikidi запущена сразу.")
+        logger.info(f"Планировщик запущен! Первая синхронизация с Dikidi: {first_sync:%H:%M:%S}")
     
     def shutdown(self):
         """Останавливает планировщик"""
         self.scheduler.shutdown(wait=False)
+        self.timer.close()
+        self.send_queue.close()
@@ -0,0 +1,197 @@
+import asyncio
+import itertools
+import time
+from typing import Any, Dict
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from bot.config import Config
+
+
+# Приоритеты очереди: транзакционные (напоминания, отмены) всегда впереди маркетинговых
+PRIORITY_TRANSACTIONAL = 0
+PRIORITY_MARKETING = 1
+
+
+class TokenBucket:
+    """
+    Глобальный лимит отправки: rate токенов в секунду, запас не больше capacity.
+    По умолчанию запас — один токен: в любом окне 1 с уходит не больше rate сообщений.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Flood control Telegram (retry_after): никто не отправляет seconds секунд."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SendQueueClosed(Exception):
+    """Очередь закрыта (остановка бота), сообщение не отправлено"""
+
+
+class SendQueue:
+    """
+    Очередь исходящих сообщений с пулом воркеров.
+    Глобальный token bucket (Config.SEND_RATE_PER_SEC, около 30 сообщений/с по правилам Telegram)
+    и интервал между сообщениями в один чат (Config.SEND_PER_CHAT_INTERVAL).
+    Очередь приоритетная: воркеры берут сообщения с меньшим priority первыми
+    (PRIORITY_TRANSACTIONAL раньше PRIORITY_MARKETING), при равном — по порядку постановки.
+    Сообщение в чат, которому ещё рано, воркер не ждёт: оно возвращается в очередь
+    к своему времени, а воркер берёт следующее — пачка в один чат не задерживает остальные.
+    Вызывающий ждёт результат send_message или исключение (SendQueueClosed — при close()).
+    """
+
+    def __init__(self, bot: Bot, workers: int = None, rate: float = None, per_chat_interval: float = None):
+        self.bot = bot
+        self.workers = max(1, workers or Config.SEND_WORKERS)
+        self.bucket = TokenBucket(rate or Config.SEND_RATE_PER_SEC)
+        self.per_chat_interval = Config.SEND_PER_CHAT_INTERVAL if per_chat_interval is None else per_chat_interval
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._tasks = []
+        self._next_chat_slot: Dict[int, float] = {}
+        self._deferred: Dict[int, tuple] = {}  # seq → (таймер возврата в очередь, сообщение)
+        self.sent = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def running(self) -> bool:
+        return any(not t.done() for t in self._tasks)
+
+    @property
+    def depth(self) -> int:
+        """Сколько сообщений ждут отправки (в очереди и отложенных до своего времени)"""
+        return self._queue.qsize() + len(self._deferred)
+
+    def stats(self) -> Dict[str, Any]:
+        done = self.sent + self.failed
+        return {
+            "depth": self.depth,
+            "sent": self.sent,
+            "failed": self.failed,
+            "latency_avg_ms": round(self.latency_total / done * 1000, 1) if done else 0.0,
+            "latency_max_ms": round(self.latency_max * 1000, 1),
+        }
+
+    def start(self):
+        if self.running:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def close(self):
+        """Останавливает воркеры; все неотправленные сообщения завершаются SendQueueClosed"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        pending = []
+        for handle, item in self._deferred.values():
+            handle.cancel()
+            pending.append(item)
+        self._deferred.clear()
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+            self._queue.task_done()
+        for item in pending:
+            _fail(item[5], SendQueueClosed())
+
+    async def send(self, chat_id: int, text: str, priority: int = PRIORITY_TRANSACTIONAL, **kwargs) -> Any:
+        """Ставит сообщение в очередь и ждёт отправки"""
+        if not self.running:
+            return await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((priority, next(self._seq), chat_id, text, kwargs, future, time.monotonic(), None))
+        return await future
+
+    def _reserve_chat_slot(self, chat_id: int) -> float:
+        """Резервирует время отправки в чат (time.monotonic()), не раньше текущего"""
+        now = time.monotonic()
+        slot = max(now, self._next_chat_slot.get(chat_id, 0.0))
+        self._next_chat_slot[chat_id] = slot + self.per_chat_interval
+        if len(self._next_chat_slot) > 10000:
+            self._next_chat_slot = {c: t for c, t in self._next_chat_slot.items() if t > now}
+        return slot
+
+    def _defer(self, item: tuple, delay: float):
+        """Возвращает сообщение в очередь через delay секунд (с тем же приоритетом и порядком)"""
+        seq = item[1]
+
+        def requeue():
+            if self._deferred.pop(seq, None) is not None:
+                self._queue.put_nowait(item)
+
+        self._deferred[seq] = (asyncio.get_running_loop().call_later(delay, requeue), item)
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            priority, seq, chat_id, text, kwargs, future, queued_at, slot = item
+            try:
+                if future.cancelled():
+                    continue
+                if slot is None:
+                    # Слот резервируется при первой выдаче — порядок сообщений в чат сохраняется
+                    slot = self._reserve_chat_slot(chat_id)
+                wait = slot - time.monotonic()
+                if wait > 0:
+                    self._defer((priority, seq, chat_id, text, kwargs, future, queued_at, slot), wait)
+                    continue
+                await self.bucket.acquire()
+                try:
+                    result = await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                except TelegramRetryAfter as e:
+                    self.bucket.pause(e.retry_after)
+                    self._record(queued_at, ok=False)
+                    _fail(future, e)
+                except Exception as e:
+                    self._record(queued_at, ok=False)
+                    _fail(future, e)
+                else:
+                    self._record(queued_at, ok=True)
+                    if not future.done():
+                        future.set_result(result)
+            except asyncio.CancelledError:
+                # close() во время отправки: вызывающий не должен ждать вечно
+                _fail(future, SendQueueClosed())
+                raise
+            finally:
+                self._queue.task_done()
+
+    def _record(self, queued_at: float, ok: bool):
+        latency = time.monotonic() - queued_at
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+
+
+def _fail(future: asyncio.Future, error: BaseException):
+    if not future.done():
+        future.set_exception(error)
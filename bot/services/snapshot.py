@@ -0,0 +1,111 @@
+import gzip
+import json
+import os
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+import logging
+
+from bot.config import Config
+from bot.services.clock import SYSTEM_CLOCK, Clock
+
+logger = logging.getLogger(__name__)
+
+# Поля нормализованной записи, которые нужны для сверки с БД (sync_appointments)
+_SNAPSHOT_FIELDS = ("phone", "event", "date", "time", "master", "clientlink", "visit_status")
+_SNAPSHOT_VERSION = 1
+
+
+class ScrapeSnapshot:
+    """Последний успешный результат парсинга Dikidi: записи, время парсинга и окно дат."""
+
+    def __init__(self, appointments: List[Dict], scraped_at: datetime, window: Tuple[date, date]):
+        self.appointments = appointments
+        self.scraped_at = scraped_at
+        self.window = window
+
+    def age_seconds(self, now: datetime = None) -> float:
+        return ((now or datetime.now()) - self.scraped_at).total_seconds()
+
+
+class SnapshotStore:
+    """
+    Хранит снимок последнего парсинга на диске (gzip + JSON, строки вместо словарей),
+    чтобы после перезапуска бот сразу имел актуальный журнал, не дожидаясь браузера.
+    Время снимка — по clock (в симуляции — виртуальные часы планировщика).
+    Неизменный журнал файл не перезаписывает: время снимка обновляется в mtime файла.
+    """
+
+    def __init__(self, path: str = None, clock: Optional[Clock] = None):
+        self.path = path or Config.SNAPSHOT_PATH
+        self.clock = clock or SYSTEM_CLOCK
+        self.current: Optional[ScrapeSnapshot] = None
+        self._saved: Optional[List[Dict]] = None  # записи, из которых сохранён текущий снимок
+
+    def save(self, appointments: List[Dict], window: Tuple[date, date]) -> ScrapeSnapshot:
+        """Сохраняет снимок атомарно (tmp + replace) и делает его текущим."""
+        current = self.current
+        if current is not None and current.window == window and self._saved == appointments:
+            # Журнал тот же: без JSON и gzip, только время снимка
+            try:
+                snapshot = ScrapeSnapshot(current.appointments, self.clock.now(), window)
+                stamp = snapshot.scraped_at.timestamp()
+                os.utime(self.path, (stamp, stamp))
+                self.current = snapshot
+                return snapshot
+            except OSError:
+                pass
+        snapshot = ScrapeSnapshot(
+            [{f: (a.get(f) or "") for f in _SNAPSHOT_FIELDS} for a in appointments],
+            self.clock.now(),
+            window,
+        )
+        payload = {
+            "version": _SNAPSHOT_VERSION,
+            "scraped_at": snapshot.scraped_at.isoformat(timespec="seconds"),
+            "window": [window[0].isoformat(), window[1].isoformat()],
+            "fields": list(_SNAPSHOT_FIELDS),
+            "rows": [[a[f] for f in _SNAPSHOT_FIELDS] for a in snapshot.appointments],
+        }
+        raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        tmp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Уровень 6: файл на несколько процентов больше, чем с 9, а сжатие в разы быстрее —
+            # снимок пишется при каждой синхронизации с изменившимся журналом
+            with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+                f.write(raw)
+            os.replace(tmp_path, self.path)
+            self._saved = list(appointments)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить снимок парсинга: {e}")
+            self._saved = None
+        self.current = snapshot
+        return snapshot
+
+    def load(self) -> Optional[ScrapeSnapshot]:
+        """Загружает снимок с диска. None — если файла нет или он повреждён."""
+        try:
+            with gzip.open(self.path, "rb") as f:
+                payload = json.loads(f.read().decode("utf-8"))
+            if payload.get("version") != _SNAPSHOT_VERSION:
+                return None
+            fields = payload["fields"]
+            snapshot = ScrapeSnapshot(
+                [dict(zip(fields, row)) for row in payload["rows"]],
+                # Неизменный журнал обновлял только mtime (см. save)
+                max(
+                    datetime.fromisoformat(payload["scraped_at"]),
+                    datetime.fromtimestamp(int(os.path.getmtime(self.path))),
+                ),
+                (
+                    date.fromisoformat(payload["window"][0]),
+                    date.fromisoformat(payload["window"][1]),
+                ),
+            )
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+            logger.warning(f"Снимок парсинга повреждён, пропускаем: {e}")
+            return None
+        self.current = snapshot
+        return snapshot
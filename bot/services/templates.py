@@ -0,0 +1,132 @@
+import os
+from functools import lru_cache
+from string import Formatter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bot.config import Config
+
+# Поля записи/салона, доступные шаблону (ссылки — из _link_values)
+APPOINTMENT_FIELDS = ("event", "date", "time", "master", "clientlink", "address", "company")
+
+
+def escape_html(s: str) -> str:
+    """Экранирует HTML для parse_mode=HTML"""
+    if not s:
+        return ""
+    return str(s).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+@lru_cache(maxsize=4096)
+def _escaped_appointment_fields(event: str, date: str, time: str, master: str) -> Tuple[str, str, str, str]:
+    """Экранированные поля записи. Одна и та же запись в рассылке, повторе и объединённом
+    сообщении экранируется один раз"""
+    return escape_html(event), escape_html(date), escape_html(time), escape_html(master)
+
+
+@lru_cache(maxsize=64)
+def _escaped_company_fields(name: str, address: str) -> Tuple[str, str]:
+    return escape_html(name), escape_html(address)
+
+
+def _link_values() -> Dict[str, str]:
+    return {
+        "booking_url": Config.BOOKING_URL,
+        "yandex_review_url": Config.YANDEX_REVIEW_URL,
+        "twogis_review_url": Config.TWOGIS_REVIEW_URL,
+        "vk_review_url": Config.VK_REVIEW_URL,
+        "dikidi_review_url": Config.DIKIDI_REVIEW_URL,
+    }
+
+
+class CompiledTemplate:
+    """
+    Шаблон, разобранный один раз в позиционную строку формата: ссылки из Config
+    подставлены при компиляции, поля записи заменены номерами из APPOINTMENT_FIELDS.
+    """
+
+    def __init__(self, name: str, source: str, links: Dict[str, str]):
+        self.name = name
+        compiled = []
+        for text, field, spec, conversion in Formatter().parse(source):
+            compiled.append(text.replace("{", "{{").replace("}", "}}"))
+            if field is None:
+                continue
+            if spec or conversion:
+                raise ValueError(f"Шаблон {name}: форматирование поля {{{field}}} не поддерживается")
+            if field in links:
+                compiled.append(links[field].replace("{", "{{").replace("}", "}}"))
+            elif field in APPOINTMENT_FIELDS:
+                compiled.append("{%d}" % APPOINTMENT_FIELDS.index(field))
+            else:
+                raise ValueError(f"Шаблон {name}: неизвестное поле {{{field}}}")
+        self.format_string = "".join(compiled)
+
+    def render(self, values: Tuple[str, ...]) -> str:
+        """values — значения полей в порядке APPOINTMENT_FIELDS"""
+        return self.format_string.format(*values)
+
+
+class TemplateRegistry:
+    """
+    Тексты уведомлений по типам из файлов <тип>.txt (Config.TEMPLATES_DIR, по умолчанию bot/templates).
+    Файлы читаются и компилируются один раз в load(); поля записи — {event}, {date}, {time},
+    {master}, {clientlink}, {address}, {company}, ссылки — {booking_url}, {yandex_review_url} и т.д.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or Config.TEMPLATES_DIR
+        self._templates: Dict[str, CompiledTemplate] = {}
+
+    def load(self) -> "TemplateRegistry":
+        links = _link_values()
+        templates = {}
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".txt"):
+                continue
+            name = filename[:-4]
+            with open(os.path.join(self.directory, filename), encoding="utf-8") as f:
+                templates[name] = CompiledTemplate(name, f.read().rstrip("\n"), links)
+        self._templates = templates
+        return self
+
+    @property
+    def types(self) -> List[str]:
+        return sorted(self._templates)
+
+    def render(self, notification_type: str, appointment, company) -> str:
+        """Текст уведомления; пустая строка — шаблона для типа нет"""
+        return self.render_many([(notification_type, appointment, company)])[0]
+
+    def render_many(self, items: Iterable[Tuple[str, object, object]]) -> List[str]:
+        """Пакетный рендер: [(тип, запись, салон)] → тексты в том же порядке"""
+        texts = []
+        for notification_type, appointment, company in items:
+            template = self._templates.get(notification_type)
+            if template is None:
+                texts.append("")
+                continue
+            company_name, address = _escaped_company_fields(
+                company.name if company else "",
+                Config.COMPANY_ADDRESS or (company.address if company else ""),
+            )
+            texts.append(template.render(
+                _escaped_appointment_fields(appointment.event, appointment.date, appointment.time, appointment.master)
+                + (appointment.clientlink or "", address, company_name)
+            ))
+        return texts
+
+    @staticmethod
+    def cache_info():
+        """Статистика LRU экранированных полей записи (hits, misses, maxsize, currsize)"""
+        return _escaped_appointment_fields.cache_info()
+
+
+_registry: Optional[TemplateRegistry] = None
+
+
+def get_templates() -> TemplateRegistry:
+    """Общий реестр шаблонов: компилируется при первом обращении (на старте бота)"""
+    global _registry
+    if _registry is None:
+        _registry = TemplateRegistry().load()
+    return _registry
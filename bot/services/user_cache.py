@@ -0,0 +1,108 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import Config
+from bot.models.models import User
+from bot.services.metrics import METRICS
+
+
+class CachedUser(NamedTuple):
+    """То, что обработчикам нужно о пользователе: id, телефон ("" до регистрации), доступность"""
+    id: int
+    phone: str
+    is_reachable: bool
+
+
+class UserLookupCache:
+    """
+    telegram_id → CachedUser (LRU + TTL): обработчики не ходят в БД за пользователем на каждое
+    сообщение. Регистрация, смена номера и недоступность (dispatch) обновляют запись сразу;
+    TTL (Config.USER_CACHE_TTL) страхует от изменений мимо процесса (другой экземпляр, ручная правка).
+    Не больше max_size записей — сверх вытесняется давно не использованная.
+    """
+
+    def __init__(self, max_size: int = None, ttl: float = None):
+        self.max_size = max(1, max_size or Config.USER_CACHE_SIZE)
+        self.ttl = Config.USER_CACHE_TTL if ttl is None else ttl
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # telegram_id → (CachedUser, истекает)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, telegram_id: int, now: Optional[float] = None) -> Optional[CachedUser]:
+        entry = self._entries.get(telegram_id)
+        if entry is not None and (now if now is not None else time.monotonic()) >= entry[1]:
+            del self._entries[telegram_id]
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, telegram_id: int, user: CachedUser, now: Optional[float] = None):
+        expires = (now if now is not None else time.monotonic()) + self.ttl
+        self._entries[telegram_id] = (user, expires)
+        self._entries.move_to_end(telegram_id)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def update(self, telegram_id: int, **fields):
+        """Меняет поля закэшированной записи (если она есть), не продлевая TTL"""
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            self._entries[telegram_id] = (entry[0]._replace(**fields), entry[1])
+
+    def invalidate(self, telegram_ids: Iterable[int]):
+        for telegram_id in telegram_ids:
+            self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "size": len(self._entries), "hits": self.hits, "misses": self.misses,
+            "expired": self.expired, "evicted": self.evicted, "hit_rate": round(self.hit_rate, 3),
+        }
+
+
+# Общий кэш процесса: читают и обновляют обработчики, недоступность отмечает NotificationService
+USER_CACHE = UserLookupCache()
+METRICS.register_gauge("user_cache_hit_rate", "Доля попаданий в кэш пользователей", lambda: USER_CACHE.hit_rate)
+METRICS.register_gauge("user_cache_size", "Пользователей в кэше", lambda: len(USER_CACHE))
+
+
+def cached_user(user: User) -> CachedUser:
+    return CachedUser(user.id, user.phone or "", bool(user.is_reachable))
+
+
+async def lookup_user(session: AsyncSession, telegram_id: int) -> Optional[CachedUser]:
+    """Пользователь по telegram_id: из кэша или одним запросом (найденный кладётся в кэш)"""
+    user = USER_CACHE.get(telegram_id)
+    if user is not None:
+        return user
+    row = (await session.execute(
+        select(User.id, User.phone, User.is_reachable).where(User.telegram_id == telegram_id)
+    )).first()
+    if row is None:
+        return None
+    user = CachedUser(row[0], row[1] or "", bool(row[2]))
+    USER_CACHE.put(telegram_id, user)
+    return user
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import secrets
+from typing import List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from bot.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def webhook_secret() -> str:
+    """Секрет заголовка X-Telegram-Bot-Api-Secret-Token: из Config или случайный на время запуска"""
+    return Config.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+
+def build_webhook_app(
+    dp: Dispatcher,
+    bot: Bot,
+    secret: str,
+    path: str = None,
+    handle_in_background: bool = True,
+) -> web.Application:
+    """
+    aiohttp-приложение для режима webhook: POST на path с обновлением от Telegram.
+    Запрос без верного секрета получает 401. При handle_in_background Telegram сразу получает
+    ответ 200, а обновление обрабатывается отдельной задачей — обновления разных
+    пользователей идут параллельно, не дожидаясь друг друга.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret,
+        handle_in_background=handle_in_background,
+    ).register(app, path=path or Config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, allowed_updates: Optional[List[str]] = None):
+    """
+    Режим webhook (BOT_RUN_MODE=webhook): регистрирует Config.WEBHOOK_BASE_URL + WEBHOOK_PATH
+    в Telegram и принимает обновления на WEBHOOK_HOST:WEBHOOK_PORT до отмены задачи.
+    TLS обычно завершает обратный прокси (nginx и т.п.) перед этим портом.
+    """
+    secret = webhook_secret()
+    path = Config.WEBHOOK_PATH
+    app = build_webhook_app(dp, bot, secret, path)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, Config.WEBHOOK_HOST, Config.WEBHOOK_PORT).start()
+        if Config.WEBHOOK_BASE_URL:
+            await bot.set_webhook(
+                url=Config.WEBHOOK_BASE_URL.rstrip("/") + path,
+                secret_token=secret,
+                allowed_updates=allowed_updates,
+                max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+            )
+        else:
+            logger.warning("WEBHOOK_BASE_URL не задан — webhook в Telegram не регистрируется")
+        logger.info(f"Webhook: приём обновлений на {Config.WEBHOOK_HOST}:{Config.WEBHOOK_PORT}{path}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
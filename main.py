@@ -7,8 +7,12 @@ from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from bot.config import Config
 from bot.handlers import router
+from bot.middlewares import UpdateConcurrencyMiddleware
+from bot.services.metrics import MetricsExporter
+from bot.services.notifications import refresh_due_metrics
 from bot.services.scheduler import SchedulerService
-from bot.database import init_db
+from bot.webhook import run_webhook
+from bot.database import init_db, start_writer, stop_writer
 
 # Настройка логирования
 logging.basicConfig(
@@ -52,18 +56,27 @@ async def main():
     except Exception as e:
         logger.error(f"Ошибка при инициализации БД: {e}")
         return
+    if start_writer():
+        logger.info("Запись в БД — через единственного писателя (DB_SINGLE_WRITER)")
     
     # Создаем бота и диспетчер
     bot = Bot(token=Config.BOT_TOKEN)
     
-    # Убираем webhook (если был) — иначе конфликт с polling
-    try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        logger.info("Webhook сброшен, запуск polling")
-    except Exception as e:
-        logger.warning(f"Не удалось сбросить webhook: {e}")
+    webhook_mode = Config.BOT_RUN_MODE == "webhook"
+    if not webhook_mode:
+        # Убираем webhook (если был) — иначе конфликт с polling
+        try:
+            await bot.delete_webhook(drop_pending_updates=True)
+            logger.info("Webhook сброшен, запуск polling")
+        except Exception as e:
+            logger.warning(f"Не удалось сбросить webhook: {e}")
     
     dp = Dispatcher(storage=MemoryStorage())
+    # Каждое обновление — отдельная задача (polling: handle_as_tasks, webhook: в фоне);
+    # middleware ограничивает их число и сохраняет порядок обновлений одного пользователя
+    concurrency = UpdateConcurrencyMiddleware()
+    concurrency.register_metrics()
+    dp.update.outer_middleware(concurrency)
     
     # Регистрируем роутеры
     dp.include_router(router)
@@ -71,15 +84,29 @@ async def main():
     # Запускаем планировщик
     scheduler_service = SchedulerService(bot)
     scheduler_service.start()
+    exporter = None
+    if Config.METRICS_PORT:
+        exporter = MetricsExporter(refresh=refresh_due_metrics)
+        try:
+            await exporter.start()
+        except OSError as e:
+            logger.warning(f"Экспортёр метрик не запущен: {e}")
+            exporter = None
     
     try:
         logger.info("Бот запущен!")
         # Запускаем бота
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if webhook_mode:
+            await run_webhook(dp, bot, allowed_updates=dp.resolve_used_update_types())
+        else:
+            await dp.start_polling(bot, handle_as_tasks=True, allowed_updates=dp.resolve_used_update_types())
     except Exception as e:
         logger.error(f"Ошибка при работе бота: {e}")
     finally:
         scheduler_service.shutdown()
+        if exporter is not None:
+            await exporter.close()
+        await stop_writer()
         await bot.session.close()
 
 
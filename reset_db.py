@@ -23,6 +23,9 @@ async def reset():
     path = get_db_path()
     if path and os.path.exists(path):
         os.remove(path)
+        for suffix in ("-wal", "-shm"):  # файлы WAL-режима (профиль tuned)
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
         print(f"База удалена: {path}")
     elif path:
         print(f"Файл БД не найден: {path}")
@@ -0,0 +1,286 @@
+"""
+Симуляция расписания уведомлений на виртуальных часах.
+Синтетические записи (бронирование, перенос, отмена, завершение визита) проигрываются
+через настоящие SchedulerService / NotificationService: уведомления отправляет настоящий
+NotificationTimer, спящий на виртуальных часах (со страховочными проходами), а задачи
+планировщика — синхронизация журнала, маркетинг и хранение — запускаются по тому же расписанию.
+Часы прыгают к ближайшему из этих сроков, реальных ожиданий нет. Бот фейковый.
+Тик синхронизации с неизменным журналом пропускается, остальные сверяют только изменившиеся записи.
+Время уходит на запросы к БД (около миллисекунды каждый): неделя по умолчанию — около 6 с,
+месяц (--days 30) — около 45 с, плюс несколько секунд на импорт и создание базы.
+Отчёт по типам: запланировано, доставлено, пропущено, осталось; задержка доставки
+относительно send_at (в виртуальных минутах) и пик доставок за виртуальный час.
+База — временная SQLite (реальная БД не трогается).
+Запуск: python simulate.py [--days 7] [--per-day 25] [--clients 300] [--sync-minutes 10] [--seed 1]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+if sys.platform == "win32":
+    import codecs
+    sys.stdout = codecs.getwriter("utf-8")(sys.stdout.buffer, "strict")
+    sys.stderr = codecs.getwriter("utf-8")(sys.stderr.buffer, "strict")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class SimBot:
+    """Фейковый бот: считает сообщения"""
+
+    def __init__(self):
+        self.messages = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages += 1
+
+
+class SimAppointment:
+    """Синтетическая запись: когда забронирована, перенесена, отменена, завершена"""
+
+    def __init__(self, rng: random.Random, index: int, visit: datetime, start: datetime, clients: int):
+        self.client = rng.randrange(clients)
+        self.event = rng.choice(["Стрижка", "Окрашивание", "Маникюр", "Педикюр", "Укладка"])
+        self.master = rng.choice(["Аня", "Оля", "Катя"])
+        self.clientlink = f"https://dikidi.ru/ru/recording/{index}"
+        self.visit = visit
+        self.booked_at = max(start, visit - timedelta(minutes=rng.randint(120, 30 * 24 * 60)))
+        self.rescheduled_at = self.new_visit = None
+        self.canceled_at = self.completed_at = None
+        roll = rng.random()
+        if roll < 0.05 and visit - self.booked_at > timedelta(hours=2):
+            # Перенос на другое время того же дня: старая запись пропадает, появляется новая
+            self.rescheduled_at = self.booked_at + (visit - timedelta(hours=1) - self.booked_at) * rng.random()
+            self.new_visit = visit + timedelta(hours=rng.choice([-2, -1, 1, 2]))
+        elif roll < 0.13:
+            self.canceled_at = self.booked_at + (visit - self.booked_at) * rng.random()
+        if self.canceled_at is None and rng.random() < 0.9:
+            self.completed_at = (self.new_visit or visit) + timedelta(hours=1)
+        self._rows = {}  # (время визита, завершён) → строка журнала
+
+    def change_times(self) -> list:
+        """Моменты, когда запись меняется в журнале"""
+        return [t for t in (self.booked_at, self.rescheduled_at, self.canceled_at, self.completed_at) if t]
+
+    def journal_row(self, now: datetime, window) -> dict:
+        """Как запись выглядит в журнале Dikidi в момент now (None — её там нет)"""
+        if now < self.booked_at or (self.canceled_at and now >= self.canceled_at):
+            return None
+        visit = self.new_visit if self.rescheduled_at and now >= self.rescheduled_at else self.visit
+        if not (window[0] <= visit.date() <= window[1]):
+            return None
+        completed = self.completed_at is not None and now >= self.completed_at
+        row = self._rows.get((visit, completed))
+        if row is None:
+            row = self._rows[(visit, completed)] = self._row(visit, completed)
+        return row
+
+    def _row(self, visit: datetime, completed: bool) -> dict:
+        return {
+            "phone": f"8999{self.client:07d}",
+            "event": self.event,
+            "date": visit.strftime("%d.%m.%Y"),
+            "time": visit.strftime("%H:%M"),
+            "master": self.master,
+            "clientlink": self.clientlink,
+            "visit_status": "Визит завершен" if completed else "Ожидает визита",
+        }
+
+
+def _generate(rng: random.Random, start: datetime, days: int, per_day: int, clients: int) -> list:
+    appointments = []
+    for day in range(days):
+        for _ in range(per_day):
+            visit = start + timedelta(days=day, hours=10) + timedelta(minutes=30 * rng.randrange(20))
+            appointments.append(SimAppointment(rng, len(appointments), visit, start, clients))
+    return appointments
+
+
+def _percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def simulate(args):
+    from sqlalchemy import func, select
+    from bot.config import Config
+    from bot.database import get_session, init_db
+    from bot.models.models import Notification, User
+    from bot.services.clock import VirtualClock
+    from bot.services.dispatch_timer import _due_at
+    from bot.services.notifications import MARKETING_TYPES, _marketing_window
+    from bot.services.scheduler import SchedulerService
+
+    rng = random.Random(args.seed)
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    end = start + timedelta(days=args.days)
+    appointments = _generate(rng, start, args.days, args.per_day, args.clients)
+
+    await init_db()
+    async with get_session() as session:
+        session.add_all([
+            User(telegram_id=1000 + i, phone=f"+7999{i:07d}") for i in range(args.clients)
+        ])
+        await session.commit()
+
+    clock = VirtualClock(start)
+    bot = SimBot()
+    scheduler = SchedulerService(bot, clock=clock)
+    service = scheduler.notification_service
+    latency = defaultdict(list)
+    per_hour = defaultdict(Counter)
+
+    def on_delivered(notification):
+        latency[notification.type].append((clock.now() - notification.send_at).total_seconds() / 60)
+        per_hour[notification.type][clock.now().replace(minute=0, second=0, microsecond=0)] += 1
+
+    service.on_delivered = on_delivered
+
+    # Журнал Dikidi вместо браузера: меняется только в моменты изменений записей и при сдвиге окна
+    changes = sorted(t for a in appointments for t in a.change_times())
+    journal = {"window": None, "next_change": 0, "rows": []}
+
+    def journal_changed() -> bool:
+        """Журнал изменился с прошлой синхронизации: пересобирает его строки"""
+        window = scheduler.parser.parse_window()
+        changed = window != journal["window"]
+        while journal["next_change"] < len(changes) and changes[journal["next_change"]] <= clock.now():
+            journal["next_change"] += 1
+            changed = True
+        if changed:
+            journal["window"] = window
+            journal["rows"] = [row for row in (a.journal_row(clock.now(), window) for a in appointments) if row]
+        return changed
+
+    async def parse_journal(session):
+        return journal["rows"]
+
+    scheduler.parser.parse_appointments = parse_journal
+
+    async def next_marketing():
+        """
+        Ближайшая минута (маркетинг — задача раз в минуту), когда маркетинговой полосе есть что
+        отправить. Уведомления, которым было пора к прошлому запуску и которые он не отправил,
+        не учитываются — иначе симуляция запускала бы задачу в ту же минуту снова и снова.
+        """
+        async with get_session() as session:
+            due = (await session.execute(
+                select(func.min(_due_at())).where(
+                    Notification.sent == False, Notification.dead == False,
+                    Notification.type.in_(MARKETING_TYPES), _due_at() > marketing["last_run"],
+                )
+            )).scalar()
+        if due is None:
+            return None
+        due = max(due, clock.now())
+        window_start, window_end = _marketing_window(due)
+        if due >= window_end:
+            due = _marketing_window(due + timedelta(days=1))[0]
+        elif due < window_start:
+            due = window_start
+        minute = due.replace(second=0, microsecond=0)
+        return minute if minute == due else minute + timedelta(minutes=1)
+
+    # Задачи планировщика по виртуальному расписанию: синхронизация, маркетинг, хранение;
+    # уведомления отправляет настоящий NotificationTimer, спящий на виртуальных часах
+    sync_every = timedelta(minutes=args.sync_minutes)
+    next_sync = start
+    next_retention = start.replace(hour=Config.RETENTION_HOUR, minute=30)
+    marketing_at = None
+    marketing = {"last_run": start - timedelta(minutes=1)}
+    syncs = changed_syncs = marketing_runs = 0
+    scheduler.timer.start()
+    started = time.perf_counter()
+    await clock.settle()
+    while True:
+        moment = min(t for t in (next_sync, next_retention, marketing_at, clock.next_wakeup()) if t is not None)
+        if moment >= end:
+            break
+        clock.set(moment)  # будит таймер, если его срок наступил
+        if moment >= next_sync:
+            next_sync += sync_every
+            syncs += 1
+            # Тик с неизменным журналом пропускается: сверка такого журнала ничего не делает
+            if journal_changed():
+                changed_syncs += 1
+                await scheduler.sync_and_schedule()
+                marketing_at = await next_marketing()
+        if marketing_at is not None and moment >= marketing_at:
+            marketing_runs += 1
+            marketing["last_run"] = moment
+            await scheduler.process_marketing()
+            marketing_at = await next_marketing()
+        if moment >= next_retention:
+            next_retention += timedelta(days=1)
+            await scheduler.run_retention()
+        # Таймер доотправил всё, что пора, и снова спит
+        await clock.settle()
+    scheduler.timer.close()
+    elapsed = time.perf_counter() - started
+
+    async with get_session() as session:
+        rows = (await session.execute(
+            select(Notification.type, Notification.sent, Notification.dead, func.count(Notification.id))
+            .group_by(Notification.type, Notification.sent, Notification.dead)
+        )).all()
+    planned, sent_flag, dead = Counter(), Counter(), Counter()
+    for notification_type, sent, is_dead, count in rows:
+        planned[notification_type] += count
+        if sent:
+            sent_flag[notification_type] += count
+        if is_dead:
+            dead[notification_type] += count
+
+    delivered_total = sum(len(v) for v in latency.values())
+    print(
+        f"Симуляция {args.days} дн.: записей {len(appointments)}, синхронизаций {syncs} (журнал менялся в {changed_syncs}), "
+        f"проходов таймера {scheduler.timer.runs}, маркетинга {marketing_runs}, сообщений {bot.messages}, уведомлений {delivered_total}; "
+        f"{elapsed:.1f} с реального времени ({delivered_total / elapsed:.0f} уведомлений/с)"
+    )
+    print(
+        f"{'тип':<13}{'заплан.':>8}{'достав.':>8}{'пропущ.':>8}{'осталось':>9}{'dead':>6}"
+        f"{'p50, мин':>10}{'p95, мин':>10}{'max, мин':>10}{'пик/ч':>7}"
+    )
+    for notification_type in sorted(planned):
+        values = latency.get(notification_type, [])
+        delivered = len(values)
+        skipped = sent_flag[notification_type] - delivered
+        pending = planned[notification_type] - sent_flag[notification_type] - dead[notification_type]
+        stats = (
+            f"{_percentile(values, 0.5):>10.1f}{_percentile(values, 0.95):>10.1f}{max(values):>10.1f}"
+            if values else f"{'-':>10}{'-':>10}{'-':>10}"
+        )
+        peak = max(per_hour[notification_type].values()) if values else 0
+        print(
+            f"{notification_type:<13}{planned[notification_type]:>8}{delivered:>8}{skipped:>8}"
+            f"{pending:>9}{dead[notification_type]:>6}{stats}{peak:>7}"
+        )
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--days", type=int, default=7)
+    ap.add_argument("--per-day", type=int, default=25, help="записей в день")
+    ap.add_argument("--clients", type=int, default=300)
+    ap.add_argument("--sync-minutes", type=int, default=10, help="интервал синхронизации журнала")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    # База в памяти ОС (tmpfs), если есть: симуляция упирается в fsync, а не в логику
+    with tempfile.TemporaryDirectory(dir="/dev/shm" if os.path.isdir("/dev/shm") else None) as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tmp}/simulate.db"
+        os.environ["SNAPSHOT_PATH"] = os.path.join(tmp, "snapshot.json.gz")
+        os.environ.setdefault("NOTIFY_COALESCE_SECONDS", "0")
+        # Лимит скорости маркетинга — в реальных секундах (защита Bot API); фейковому боту он не нужен
+        os.environ.setdefault("MARKETING_RATE_PER_SEC", "1000000")
+        asyncio.run(simulate(args))
+
+
+if __name__ == "__main__":
+    main()